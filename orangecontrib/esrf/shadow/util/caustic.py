@@ -0,0 +1,107 @@
+import numpy
+
+#
+# Retrace-free caustic of a SHADOW beam.
+#
+# The ray columns are extracted once. The position of each ray at the plane Y=y is calculated analytically
+# (as Shadow.Beam.retrace(y, resetY=True) does) for many planes at once, in chunks of planes to bound the memory,
+# and the histograms of all the planes of a chunk are calculated with a single numpy.bincount.
+#
+# The histogram (bins, range) and the FWHM follow Shadow.Beam.histo1.
+#
+
+def get_caustic_rays(shadow3_beam, nolost=1, use_reflectivity=1):
+    # nolost: 0 = all rays, 1 = good rays only, 2 = lost rays only
+    rays = {}
+    for name, col in [("x", 1), ("y", 2), ("z", 3), ("vx", 4), ("vy", 5), ("vz", 6)]:
+        rays[name] = shadow3_beam.getshonecol(col, nolost=nolost)
+    if use_reflectivity:
+        rays["weights"] = shadow3_beam.getshonecol(23, nolost=nolost)
+    else:
+        rays["weights"] = numpy.ones_like(rays["x"])
+    return rays
+
+def _histograms(values, weights, xrange, nbins):
+    # histograms (planes x nbins) of values (planes x rays), same binning as numpy.histogram
+    nplanes = values.shape[0]
+    index = numpy.floor((values - xrange[0]) * (nbins / (xrange[1] - xrange[0]))).astype(numpy.int64)
+    index[values == xrange[1]] = nbins - 1 # the last bin includes the right edge
+    good = (index >= 0) & (index < nbins)
+    index += numpy.arange(nplanes)[:, numpy.newaxis] * nbins
+    return numpy.bincount(index[good],
+                          weights=numpy.broadcast_to(weights, values.shape)[good],
+                          minlength=nplanes * nbins).reshape((nplanes, nbins))
+
+def _fwhm(histograms, bin_size):
+    above = histograms >= 0.5 * histograms.max(axis=1)[:, numpy.newaxis]
+    first = numpy.argmax(above, axis=1)
+    last = histograms.shape[1] - 1 - numpy.argmax(above[:, ::-1], axis=1)
+    fwhm = bin_size * (last - first)
+    fwhm[above.sum(axis=1) < 2] = 0.0
+    return fwhm
+
+def calculate_caustics(rays, positions, columns=(1, 3, 20), xrange=(-0.2, 0.2), nbins=1000, max_elements=2**24):
+    # columns: any of 1 (X), 3 (Z) and 20 (R), all calculated in the same pass over the positions
+    # returns a dictionary, with the column as key, of dictionaries with:
+    #   image (nbins x positions), bin_center, fwhm, center and rms (weighted mean and standard deviation, all rays)
+    positions = numpy.asarray(positions, dtype=float)
+    weights = rays["weights"]
+    for column in columns:
+        if column not in (1, 3, 20): raise Exception("Column not valid for caustic: %d" % column)
+
+    # the coordinates at the plane y are a + b * y for each ray
+    tof0 = -rays["y"] / rays["vy"]
+    ax, bx = rays["x"] + tof0 * rays["vx"], rays["vx"] / rays["vy"]
+    az, bz = rays["z"] + tof0 * rays["vz"], rays["vz"] / rays["vy"]
+
+    out = {}
+    for column in columns:
+        out[column] = {"image": numpy.zeros((nbins, positions.size)),
+                       "center": numpy.zeros(positions.size),
+                       "rms": numpy.zeros(positions.size)}
+
+    chunk = max(1, max_elements // max(1, weights.size * len(columns)))
+    for i in range(0, positions.size, chunk):
+        y = positions[i:i+chunk, numpy.newaxis]
+        x_values = ax + bx * y if (1 in columns or 20 in columns) else None
+        z_values = az + bz * y if (3 in columns or 20 in columns) else None
+
+        for column in columns:
+            if column == 1:
+                values = x_values
+            elif column == 3:
+                values = z_values
+            else:
+                values = numpy.sqrt(x_values ** 2 + z_values ** 2)
+
+            center = numpy.dot(values, weights) / weights.sum()
+            out[column]["image"][:, i:i+chunk] = _histograms(values, weights, xrange, nbins).T
+            out[column]["center"][i:i+chunk] = center
+            out[column]["rms"][i:i+chunk] = numpy.sqrt(numpy.maximum(
+                numpy.dot(values ** 2, weights) / weights.sum() - center ** 2, 0.0))
+
+    bin_size = (xrange[1] - xrange[0]) / nbins
+    bin_center = xrange[0] + bin_size * (numpy.arange(nbins) + 0.5)
+    for column in columns:
+        out[column]["bin_center"] = bin_center
+        out[column]["fwhm"] = _fwhm(out[column]["image"].T, bin_size)
+
+    return out
+
+def calculate_caustic(rays, positions, column=1, xrange=(-0.2, 0.2), nbins=1000, max_elements=2**24):
+    # column: 1 (X), 3 (Z) or 20 (R)
+    return calculate_caustics(rays, positions, columns=(column,), xrange=xrange, nbins=nbins,
+                              max_elements=max_elements)[column]
+
+def get_waist_table(caustics, positions):
+    # for each column: the positions and values of the minimum (non zero) FWHM and of the minimum RMS size
+    table = []
+    for column in caustics.keys():
+        fwhm = numpy.where(caustics[column]["fwhm"] > 0, caustics[column]["fwhm"], numpy.inf)
+        rms = caustics[column]["rms"]
+        table.append({"column": column,
+                      "fwhm_position": positions[numpy.argmin(fwhm)],
+                      "fwhm": fwhm.min(),
+                      "rms_position": positions[numpy.argmin(rms)],
+                      "rms": rms.min()})
+    return table
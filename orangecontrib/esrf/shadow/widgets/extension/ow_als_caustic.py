@@ -10,6 +10,7 @@ from orangecontrib.shadow.util.shadow_objects import ShadowBeam
 from orangecontrib.shadow.util.shadow_util import ShadowCongruence, ShadowPlot
 from orangecontrib.shadow.widgets.gui.ow_automatic_element import AutomaticElement
 from orangecontrib.esrf.shadow.widgets.gui.plots import plot_data1D, plot_data2D
+from orangecontrib.esrf.shadow.util.caustic import get_caustic_rays, calculate_caustics, get_waist_table
 from srxraylib.util.h5_simple_writer import H5SimpleWriter
 
 import numpy
@@ -98,7 +99,7 @@ class ESRFCaustic(AutomaticElement):
 
 
         gui.comboBox(general_box, self, "shadow_column", label="Scan direction",labelWidth=220,
-                                     items=["X (col 1)","Z (col 3)", "R (col 20)"],
+                                     items=["X (col 1)","Z (col 3)", "R (col 20)", "X, Z and R (one pass)"],
                                      sendSelectedValue=False, orientation="horizontal")
 
         box_x = oasysgui.widgetBox(general_box, "Scan direction", addSpace=True, orientation="vertical", height=100)
@@ -131,6 +132,16 @@ class ESRFCaustic(AutomaticElement):
         self.image_box.setFixedHeight(self.IMAGE_HEIGHT-30)
         self.image_box.setFixedWidth(self.IMAGE_WIDTH-20)
 
+        tmp = oasysgui.createTabPage(tabs_setting, "Z vs y")
+        self.image_box_z = gui.widgetBox(tmp, "", addSpace=True, orientation="vertical")
+        self.image_box_z.setFixedHeight(self.IMAGE_HEIGHT-30)
+        self.image_box_z.setFixedWidth(self.IMAGE_WIDTH-20)
+
+        tmp = oasysgui.createTabPage(tabs_setting, "R vs y")
+        self.image_box_r = gui.widgetBox(tmp, "", addSpace=True, orientation="vertical")
+        self.image_box_r.setFixedHeight(self.IMAGE_HEIGHT-30)
+        self.image_box_r.setFixedWidth(self.IMAGE_WIDTH-20)
+
         tmp = oasysgui.createTabPage(tabs_setting, "FWHM(y)")
         self.box_fwhm = gui.widgetBox(tmp, "", addSpace=True, orientation="vertical")
         self.box_fwhm.setFixedHeight(self.IMAGE_HEIGHT-30)
@@ -204,105 +215,111 @@ class ESRFCaustic(AutomaticElement):
 
         positions = numpy.linspace(self.y_min, self.y_max, self.npositions)
 
-        out_x = numpy.zeros((self.npoints_x, self.npositions))
-        fwhm = numpy.zeros(self.npositions)
-        center = numpy.zeros(self.npositions)
-
         if self.shadow_column == 0:
-            col = 1
+            columns = [1]
         elif self.shadow_column == 1:
-            col = 3
+            columns = [3]
         elif self.shadow_column == 2:
-            col = 20
+            columns = [20]
+        elif self.shadow_column == 3:
+            columns = [1, 3, 20]
 
-        if self.use_reflectivity:
-            ref = 23
-        else:
-            ref = 0
+        col_titles = {1: "X (col 1)", 3: "Z (col 3)", 20: "R (col 20)"}
+        image_boxes = {1: self.image_box, 3: self.image_box_z, 20: self.image_box_r}
+        if len(columns) == 1: image_boxes[columns[0]] = self.image_box
 
         self.progressBarSet(10)
-        self.setStatusMessage("Retracing...")
-        for i in range(self.npositions):
-            if numpy.mod(i,10) == 0:
-                print("Calculating position %d of %d"%(i+1,self.npositions))
-                self.progressBarSet(10 + 85 * i / self.npositions)
-            beami = beam_to_analize.duplicate()
-            beami.retrace(positions[i], resetY=True)
-            tkt_x = beami.histo1(col, xrange=[self.x_min, self.x_max], nbins=self.npoints_x, nolost=self.no_lost, ref=ref)
-            out_x[:, i] = tkt_x["histogram"]
-            fwhm[i] = tkt_x["fwhm"]
-
-            if ref == 23:
-                center[i] = numpy.average(beami.getshonecol(col, nolost=self.no_lost),
-                                          weights=beami.getshonecol(23, nolost=self.no_lost))
-            else:
-                center[i] = numpy.average(beami.getshonecol(col,nolost=self.no_lost),)
-
+        self.setStatusMessage("Calculating caustic...")
+        print("Calculating %d positions" % self.npositions)
+        rays = get_caustic_rays(beam_to_analize, nolost=self.no_lost, use_reflectivity=self.use_reflectivity)
+        caustics = calculate_caustics(rays, positions, columns=columns, xrange=[self.x_min, self.x_max], nbins=self.npoints_x)
+        self.progressBarSet(95)
 
-        #
-        # plots
-        #
-        print("\nResult arrays X,Y (shapes): ", out_x.shape, tkt_x["bin_center"].shape, positions.shape )
-        x = tkt_x["bin_center"]
         y = positions
 
-        if self.shadow_column == 0:
-            col_title="X (col 1)"
-        elif self.shadow_column == 1:
-            col_title = "Z (col 3)"
-        elif self.shadow_column == 2:
-            col_title = "R (col 20)"
-
-        plot_canvas = plot_data2D(
-                             out_x.T, y, 1e6 * self.workspace_units_to_m * x,
-                             title="",ytitle="%s [um] (%d pixels)"%(col_title,x.size),xtitle="Y [%s] (%d pixels)"%(self.workspace_units_label,y.size),)
-        self.image_box.layout().removeItem(self.image_box.layout().itemAt(0))
-        self.image_box.layout().addWidget(plot_canvas)
-
-
-        #FWHM
-        fwhm[fwhm == 0] = 'nan'
-        self.box_fwhm.layout().removeItem(self.box_fwhm.layout().itemAt(0))
-        plot_widget_id = plot_data1D(y,1e6 * self.workspace_units_to_m * fwhm,title="FWHM",xtitle="y [%s]"%self.workspace_units_label,ytitle="FHWH [um]",symbol='.')
-        self.box_fwhm.layout().addWidget(plot_widget_id)
-
-        #I0
-        nx, ny = out_x.shape
-        I0 = out_x.T[:,nx//2]
-        self.box_I0.layout().removeItem(self.box_I0.layout().itemAt(0))
-        plot_widget_id = plot_data1D(y,I0,title="I at central profile",xtitle="y [%s]"%self.workspace_units_label,ytitle="I0",symbol='.')
-        self.box_I0.layout().addWidget(plot_widget_id)
-
-        #center
-        self.box_center.layout().removeItem(self.box_center.layout().itemAt(0))
-        plot_widget_id = plot_data1D(y, 1e6 * self.workspace_units_to_m * center,title="CENTER",xtitle="y [%s]"%self.workspace_units_label,ytitle="CENTER [um]",symbol='.',
-                                     yrange=[1e6 * self.workspace_units_to_m * self.x_min, 1e6 * self.workspace_units_to_m * self.x_max])
-        self.box_center.layout().addWidget(plot_widget_id)
-
+        if len(columns) > 1:
+            print("\nWaists (minimum FWHM and minimum RMS size):")
+            print("%12s %16s %16s %16s %16s" % ("column", "Y(FWHM) [%s]" % self.workspace_units_label, "FWHM [um]",
+                                                "Y(RMS) [%s]" % self.workspace_units_label, "RMS [um]"))
+            for row in get_waist_table(caustics, positions):
+                print("%12s %16g %16g %16g %16g" % (col_titles[row["column"]],
+                                                    row["fwhm_position"], 1e6 * self.workspace_units_to_m * row["fwhm"],
+                                                    row["rms_position"], 1e6 * self.workspace_units_to_m * row["rms"]))
 
+        for col in columns:
+            caustics[col]["fwhm"][caustics[col]["fwhm"] == 0] = 'nan'
 
         if self.save_h5_file_flag:
-
             h5w = H5SimpleWriter.initialize_file(self.save_h5_file_name, creator="h5_basic_writer.py")
 
-            h5w.create_entry("caustic", nx_default="image")
-
-            h5w.add_image(out_x.T, y, 1e6 * self.workspace_units_to_m * x,
-                          entry_name="caustic", image_name="image",
-                          title_y="%s [um] (%d pixels)"%(col_title,x.size),
-                          title_x="Y [%s] (%d pixels)"%(self.workspace_units_label, y.size),)
-
-            h5w.add_dataset(y, 1e6 * self.workspace_units_to_m * fwhm,
-                            entry_name="caustic", dataset_name="fwhm",
-                            title_x="Y [%s]" % self.workspace_units_label, title_y="FWHM [um]")
-
-            h5w.add_dataset(y, 1e6 * self.workspace_units_to_m * center,
-                            entry_name="caustic", dataset_name="center",
-                            title_x="Y [%s]" % self.workspace_units_label, title_y="center [um]")
-
-            h5w.add_dataset(y, I0,
-                            entry_name="caustic", dataset_name="I0",
-                            title_x="Y [%s]" % self.workspace_units_label, title_y="I at central profile")
+        for col in columns:
+            tkt_x = caustics[col]
+            out_x = tkt_x["image"]
+            fwhm = tkt_x["fwhm"]
+            center = tkt_x["center"]
+            x = tkt_x["bin_center"]
+            col_title = col_titles[col]
+
+            #
+            # plots
+            #
+            print("\nResult arrays %s, Y (shapes): " % col_title, out_x.shape, x.shape, positions.shape )
+
+            plot_canvas = plot_data2D(
+                                 out_x.T, y, 1e6 * self.workspace_units_to_m * x,
+                                 title="",ytitle="%s [um] (%d pixels)"%(col_title,x.size),xtitle="Y [%s] (%d pixels)"%(self.workspace_units_label,y.size),)
+            image_boxes[col].layout().removeItem(image_boxes[col].layout().itemAt(0))
+            image_boxes[col].layout().addWidget(plot_canvas)
+
+            #I0
+            nx, ny = out_x.shape
+            I0 = out_x.T[:,nx//2]
+
+            if col == columns[0]:
+                #FWHM
+                self.box_fwhm.layout().removeItem(self.box_fwhm.layout().itemAt(0))
+                plot_widget_id = plot_data1D(y,1e6 * self.workspace_units_to_m * fwhm,title="FWHM",xtitle="y [%s]"%self.workspace_units_label,ytitle="FHWH [um]",symbol='.',
+                                             x2=y if len(columns) > 1 else None,
+                                             y2=1e6 * self.workspace_units_to_m * caustics[3]["fwhm"] if len(columns) > 1 else None)
+                self.box_fwhm.layout().addWidget(plot_widget_id)
+
+                self.box_I0.layout().removeItem(self.box_I0.layout().itemAt(0))
+                plot_widget_id = plot_data1D(y,I0,title="I at central profile",xtitle="y [%s]"%self.workspace_units_label,ytitle="I0",symbol='.')
+                self.box_I0.layout().addWidget(plot_widget_id)
+
+                #center
+                self.box_center.layout().removeItem(self.box_center.layout().itemAt(0))
+                plot_widget_id = plot_data1D(y, 1e6 * self.workspace_units_to_m * center,title="CENTER",xtitle="y [%s]"%self.workspace_units_label,ytitle="CENTER [um]",symbol='.',
+                                             yrange=[1e6 * self.workspace_units_to_m * self.x_min, 1e6 * self.workspace_units_to_m * self.x_max],
+                                             x2=y if len(columns) > 1 else None,
+                                             y2=1e6 * self.workspace_units_to_m * caustics[3]["center"] if len(columns) > 1 else None)
+                self.box_center.layout().addWidget(plot_widget_id)
+
+            if self.save_h5_file_flag:
+                entry_name = "caustic" if len(columns) == 1 else "caustic_%s" % col_title[0]
+
+                h5w.create_entry(entry_name, nx_default="image")
+
+                h5w.add_image(out_x.T, y, 1e6 * self.workspace_units_to_m * x,
+                              entry_name=entry_name, image_name="image",
+                              title_y="%s [um] (%d pixels)"%(col_title,x.size),
+                              title_x="Y [%s] (%d pixels)"%(self.workspace_units_label, y.size),)
+
+                h5w.add_dataset(y, 1e6 * self.workspace_units_to_m * fwhm,
+                                entry_name=entry_name, dataset_name="fwhm",
+                                title_x="Y [%s]" % self.workspace_units_label, title_y="FWHM [um]")
+
+                h5w.add_dataset(y, 1e6 * self.workspace_units_to_m * center,
+                                entry_name=entry_name, dataset_name="center",
+                                title_x="Y [%s]" % self.workspace_units_label, title_y="center [um]")
+
+                h5w.add_dataset(y, 1e6 * self.workspace_units_to_m * tkt_x["rms"],
+                                entry_name=entry_name, dataset_name="rms",
+                                title_x="Y [%s]" % self.workspace_units_label, title_y="rms [um]")
+
+                h5w.add_dataset(y, I0,
+                                entry_name=entry_name, dataset_name="I0",
+                                title_x="Y [%s]" % self.workspace_units_label, title_y="I at central profile")
 
         self.progressBarFinished()
 
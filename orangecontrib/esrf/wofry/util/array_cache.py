@@ -0,0 +1,89 @@
+import numpy
+import os
+import hashlib
+from collections import OrderedDict
+
+#
+# Size-bounded LRU cache of tuples of numpy arrays, with optional persistence on disk (one .npz file per entry).
+#
+# Keys are any objects with a deterministic repr (tuples of numbers and strings, typically). numpy arrays inside
+# the key (e.g. the axes of a wavefront) are replaced by a hash of their contents.
+#
+# The cached arrays are shared by all the callers, so they are made read-only when stored: a caller that needs to
+# modify them must work on a copy.
+#
+
+class ArrayCache():
+    def __init__(self, max_bytes=512 * 2**20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def set_directory(self, directory=None):
+        if directory is not None: os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def clear(self, remove_files=False):
+        if remove_files and self.directory is not None:
+            for key_hash in self._cache.keys():
+                filename = self._filename(key_hash)
+                if os.path.exists(filename): os.remove(filename)
+        self._cache.clear()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_counters(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "bytes": self._bytes}
+
+    @classmethod
+    def hash_key(cls, key):
+        h = hashlib.sha1()
+        for item in (key if isinstance(key, tuple) else (key,)):
+            if isinstance(item, numpy.ndarray):
+                h.update(numpy.ascontiguousarray(item).tobytes())
+                h.update(repr((item.dtype.str, item.shape)).encode())
+            else:
+                h.update(repr(item).encode())
+        return h.hexdigest()
+
+    def _filename(self, key_hash):
+        return os.path.join(self.directory, key_hash + ".npz")
+
+    def get(self, key):
+        key_hash = self.hash_key(key)
+
+        if key_hash in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key_hash)
+            return self._cache[key_hash]
+
+        if self.directory is not None and os.path.exists(self._filename(key_hash)):
+            with numpy.load(self._filename(key_hash)) as f:
+                arrays = tuple(f["arr_%d" % i] for i in range(len(f.files)))
+            self.hits += 1
+            self._store(key_hash, arrays)
+            return arrays
+
+        self.misses += 1
+        return None
+
+    def put(self, key, arrays):
+        key_hash = self.hash_key(key)
+        arrays = tuple(numpy.asarray(a) for a in arrays)
+        self._store(key_hash, arrays)
+        if self.directory is not None:
+            numpy.savez(self._filename(key_hash), *arrays)
+        return arrays
+
+    def _store(self, key_hash, arrays):
+        for a in arrays: a.flags.writeable = False
+        if key_hash in self._cache:
+            self._bytes -= sum(a.nbytes for a in self._cache.pop(key_hash))
+        self._cache[key_hash] = arrays
+        self._bytes += sum(a.nbytes for a in arrays)
+        while self._bytes > self.max_bytes and len(self._cache) > 1:
+            self._bytes -= sum(a.nbytes for a in self._cache.popitem(last=False)[1])
@@ -0,0 +1,175 @@
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.beamline_element import BeamlineElement
+from wofry.propagator.propagator import PropagationManager, PropagationElements, PropagationParameters
+from wofryimpl.beamline.optical_elements.ideal_elements.screen import WOScreen1D
+from wofryimpl.propagator.propagators1D.fresnel import Fresnel1D
+
+#
+# Headless propagation of a 1D wavefront to a screen placed at several distances (caustic scan).
+#
+# The distance p is propagated once, then each q is propagated independently from the intermediate wavefront,
+# in a pool of threads (numpy FFTs release the GIL). For the Fresnel (FFT) propagator the forward transform is
+# shared by all the distances and only the (blocked) inverse transforms are calculated.
+#
+
+def propagate_to_screen(input_wavefront, p=0.0, q=0.0, handler_name=Fresnel1D.HANDLER_NAME,
+                        additional_parameters=None, name="screen"):
+    beamline_element = BeamlineElement(optical_element=WOScreen1D(name=name),
+                                       coordinates=ElementCoordinates(p=p, q=q,
+                                                                      angle_radial=0.0, angle_azimuthal=0.0))
+
+    propagation_elements = PropagationElements()
+    propagation_elements.add_beamline_element(beamline_element)
+
+    propagation_parameters = PropagationParameters(wavefront=input_wavefront.duplicate(),
+                                                   propagation_elements=propagation_elements)
+
+    if additional_parameters is not None:
+        for key in additional_parameters.keys():
+            propagation_parameters.set_additional_parameters(key, additional_parameters[key])
+
+    return PropagationManager.Instance().do_propagation(propagation_parameters=propagation_parameters,
+                                                        handler_name=handler_name)
+
+def fresnel_to_distances(input_wavefront, distances, block_size=64):
+    # same transfer function as the Fresnel1D propagator, with the forward FFT calculated once
+    wavelength = input_wavefront.get_wavelength()
+    freq = numpy.fft.fftfreq(input_wavefront.size()) / input_wavefront.delta()
+    fft = numpy.fft.fft(input_wavefront.get_complex_amplitude())
+
+    wavefronts = []
+    for i in range(0, len(distances), block_size):
+        z = numpy.array(distances[i:i+block_size])
+        amplitudes = numpy.fft.ifft(fft[numpy.newaxis, :] *
+                                    numpy.exp(-1j * numpy.pi * wavelength * z[:, numpy.newaxis] * freq ** 2), axis=1)
+        for amplitude in amplitudes:
+            wavefront = input_wavefront.duplicate()
+            wavefront.set_complex_amplitude(amplitude)
+            wavefronts.append(wavefront)
+    return wavefronts
+
+def propagate_to_distances(input_wavefront, distances, p=0.0, handler_name=Fresnel1D.HANDLER_NAME,
+                           additional_parameters=None, number_of_threads=4, name="screen"):
+    # returns the list of wavefronts at the distances q (from the screen placed at p)
+    if p != 0.0:
+        input_wavefront = propagate_to_screen(input_wavefront, p=p, q=0.0, handler_name=handler_name,
+                                              additional_parameters=additional_parameters, name=name)
+
+    if handler_name == Fresnel1D.HANDLER_NAME:
+        return fresnel_to_distances(input_wavefront, distances)
+
+    def propagate(q):
+        if q == 0.0: return input_wavefront.duplicate()
+        return propagate_to_screen(input_wavefront, p=0.0, q=q, handler_name=handler_name,
+                                   additional_parameters=additional_parameters, name=name)
+
+    if number_of_threads <= 1:
+        return [propagate(q) for q in distances]
+
+    with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+        return list(executor.map(propagate, distances))
+
+#
+# Writer of a distance scan in a single HDF5 file kept open during the scan: the intensities (and optionally the
+# complex amplitudes) of all the distances go to chunked (one row per chunk), optionally compressed, 2D datasets
+# that grow as rows are appended. The distances and any per-distance metadata are stored as 1D datasets.
+#
+class DistanceScanH5Writer():
+    def __init__(self, filename, abscissas, number_of_distances=None, compression="gzip",
+                 store_complex_amplitude=False, entry_name="scan"):
+        import h5py
+        self.file = h5py.File(filename, "w")
+        self.filename = filename
+        self.store_complex_amplitude = store_complex_amplitude
+        self.number_of_rows = 0
+
+        npoints = abscissas.size
+        nrows = 0 if number_of_distances is None else number_of_distances
+        self.entry = self.file.create_group(entry_name)
+        self.entry.attrs["NX_class"] = "NXentry"
+        self.entry.create_dataset("abscissas", data=abscissas)
+        self.entry.create_dataset("q", shape=(nrows,), maxshape=(None,), dtype=float)
+        self.entry.create_dataset("intensity", shape=(nrows, npoints), maxshape=(None, npoints), dtype=float,
+                                  chunks=(1, npoints), compression=compression)
+        if store_complex_amplitude:
+            self.entry.create_dataset("complex_amplitude", shape=(nrows, npoints), maxshape=(None, npoints),
+                                      dtype=complex, chunks=(1, npoints), compression=compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _resize(self, nrows):
+        for name in ["q", "intensity", "complex_amplitude"]:
+            if name in self.entry and self.entry[name].shape[0] < nrows:
+                self.entry[name].resize(nrows, axis=0)
+
+    def append(self, q, wavefront):
+        i = self.number_of_rows
+        self._resize(i + 1)
+        self.entry["q"][i] = q
+        self.entry["intensity"][i, :] = wavefront.get_intensity()
+        if self.store_complex_amplitude:
+            self.entry["complex_amplitude"][i, :] = wavefront.get_complex_amplitude()
+        self.number_of_rows += 1
+
+    def append_all(self, qs, wavefronts):
+        for q, wavefront in zip(qs, wavefronts): self.append(q, wavefront)
+
+    def add_dataset(self, name, data, title=None):
+        # per-distance metadata (e.g. peak, fwhm), or any other array
+        dataset = self.entry.create_dataset(name, data=data)
+        if title is not None: dataset.attrs["long_name"] = title
+
+    def close(self):
+        if self.file is not None:
+            for name in ["q", "intensity", "complex_amplitude"]: # shrink, if preallocated for more distances
+                if name in self.entry: self.entry[name].resize(self.number_of_rows, axis=0)
+            self.file.close()
+            self.file = None
+            print("File %s written to disk." % self.filename)
+
+
+def get_intensities(wavefronts):
+    # the intensities (distances x points) of wavefronts sampled on the same number of points
+    intensities = numpy.zeros((len(wavefronts), wavefronts[0].size()))
+    for i, wavefront in enumerate(wavefronts):
+        intensities[i, :] = wavefront.get_intensity()
+    return intensities
+
+
+if __name__ == "__main__":
+    import time
+    from wofry.propagator.wavefront1D.generic_wavefront import GenericWavefront1D
+    from wofryimpl.propagator.propagators1D.fresnel_zoom import FresnelZoom1D
+
+    propagator = PropagationManager.Instance()
+    try:
+        propagator.add_propagator(Fresnel1D())
+        propagator.add_propagator(FresnelZoom1D())
+    except:
+        pass
+
+    input_wavefront = GenericWavefront1D.initialize_wavefront_from_range(x_min=-0.0005, x_max=0.0005,
+                                                                         number_of_points=4096)
+    input_wavefront.set_photon_energy(10000)
+    input_wavefront.set_gaussian_hermite_mode(sigma_x=3e-5, amplitude=1, mode_x=0, shift=0, beta=0.1)
+    input_wavefront.add_phase_shift(-numpy.pi * input_wavefront.get_abscissas() ** 2 /
+                                    input_wavefront.get_wavelength() / 10.0) # focusing at 10 m
+
+    qs = numpy.linspace(5, 15, 100)
+    for handler_name, additional_parameters in [(Fresnel1D.HANDLER_NAME, None),
+                                                (FresnelZoom1D.HANDLER_NAME, {"magnification_x": 1.0})]:
+        for number_of_threads in [1, 4]:
+            t0 = time.time()
+            wavefronts = propagate_to_distances(input_wavefront, qs, p=0.0, handler_name=handler_name,
+                                                additional_parameters=additional_parameters,
+                                                number_of_threads=number_of_threads)
+            intensities = get_intensities(wavefronts)
+            print("%s, threads: %d, time: %.3f s, waist at q = %g m" % (handler_name, number_of_threads,
+                  time.time() - t0, qs[numpy.argmax(intensities.max(axis=1))]))
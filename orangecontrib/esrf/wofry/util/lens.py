@@ -1,5 +1,6 @@
 
 import numpy
+import os
 from orangecontrib.esrf.syned.util.lens import Lens # TODO: from syned.beamline.optical_elements.lenses.lens import Lens
 
 from syned.beamline.shape import Convexity, Direction
@@ -12,6 +13,42 @@ from barc4ro.projected_thickness import proj_thick_2D_crl, proj_thick_1D_crl
 from scipy import interpolate
 import scipy.constants as codata
 import xraylib
+from orangecontrib.esrf.wofry.util.material_constants import get_element_and_density, material_constants_cache
+from orangecontrib.esrf.wofry.util.array_cache import ArrayCache
+
+#
+# cache of the profile error files (parsed arrays and interpolators), keyed on file name and modification time
+#
+_error_profile_cache = {}
+
+def _get_error_profile(error_file, error_edge_management=None):
+    key = (os.path.abspath(error_file), os.path.getmtime(error_file))
+    if not key in _error_profile_cache:
+        if len(_error_profile_cache) >= 16: _error_profile_cache.clear()
+        _error_profile_cache[key] = {"profile": numpy.loadtxt(error_file)}
+
+    entry = _error_profile_cache[key]
+    if error_edge_management is None:
+        return entry["profile"]
+
+    if not error_edge_management in entry:
+        a = entry["profile"]
+        if error_edge_management == 0:
+            finterpolate = interpolate.interp1d(a[:, 0], a[:, 1],
+                                                fill_value="extrapolate")  # fill_value=(0,0),bounds_error=False)
+        elif error_edge_management == 1:
+            finterpolate = interpolate.interp1d(a[:, 0], a[:, 1], fill_value=(0, 0), bounds_error=False)
+        else:  # crop
+            raise Exception("Bad value of error_edge_management")
+        entry[error_edge_management] = finterpolate
+
+    return entry["profile"], entry[error_edge_management]
+
+#
+# cache of the projected thickness meshes calculated by barc4ro for WOLens (keyed on the barc4ro inputs and the
+# wavefront grid). Use thickness_mesh_cache.set_directory(path) to keep them on disk between sessions.
+#
+thickness_mesh_cache = ArrayCache(max_bytes=512 * 2**20)
 
 class WOLens(Lens, OpticalElementDecorator):
     def __init__(self,
@@ -30,8 +67,6 @@ class WOLens(Lens, OpticalElementDecorator):
 
     def get_refraction_index(self, photon_energy=10000.0):
 
-        wave_length = codata.h * codata.c / codata.e / photon_energy
-
         if self.get_material() == "External":
             refraction_index_delta = self._keywords_at_creation["refraction_index_delta"]
             att_coefficient = self._keywords_at_creation["att_coefficient"]
@@ -40,21 +75,9 @@ class WOLens(Lens, OpticalElementDecorator):
                 print("Attenuation coeff mu = %g m^-1" % (att_coefficient))
             return refraction_index_delta, att_coefficient
 
-        if self.get_material() == "Be": # Be
-            element = "Be"
-            density = xraylib.ElementDensity(4)
-        elif self.get_material() == "Al": # Al
-            element = "Al"
-            density = xraylib.ElementDensity(13)
-        elif self.get_material() == "Diamond": # Diamond
-            element = "C"
-            density = 3.51
-        else:
-            raise Exception("Bad material: " + self.get_material())
-
-        refraction_index = xraylib.Refractive_Index(element, photon_energy/1000, density)
-        refraction_index_delta = 1 - refraction_index.real
-        att_coefficient = 4*numpy.pi * (xraylib.Refractive_Index(element, photon_energy/1000, density)).imag / wave_length
+        element, density = get_element_and_density(self.get_material())
+        refraction_index_delta, att_coefficient = \
+            material_constants_cache.get_delta_and_mu(element, density, photon_energy)
 
         if self._keywords_at_creation["verbose"]:
             print("\n\n\n ==========  parameters recovered from xraylib : ")
@@ -125,19 +148,28 @@ class WOLens(Lens, OpticalElementDecorator):
             print(">>> _axis_y : from, to, n = ", _axis_y.min(), _axis_y.max(), _axis_y.size)
 
 
-        x, y, lens_thickness = proj_thick_2D_crl(_foc_plane, _shape, _apert_h, _apert_v, _r_min, _n,
-                     _wall_thick=_wall_thickness, _aperture=_aperture,
-                     _nx=_axis_x.size, _ny=_axis_y.size,
-                     _axis_x=_axis_x, _axis_y=_axis_y,
-                     _xc=0, _yc=0,
-                     _ang_rot_ex=0, _ang_rot_ey=0, _ang_rot_ez=0,
-                     _offst_ffs_x=0, _offst_ffs_y=0,
-                     _tilt_ffs_x=0, _tilt_ffs_y=0, _ang_rot_ez_ffs=0,
-                     _wt_offst_ffs=0, _offst_bfs_x=0, _offst_bfs_y=0,
-                     _tilt_bfs_x=0, _tilt_bfs_y=0, _ang_rot_ez_bfs=0, _wt_offst_bfs=0,
-                     isdgr=False, project=True,)
+        key = ("proj_thick_2D_crl", _foc_plane, _shape, _apert_h, _apert_v, _r_min, _n, _wall_thickness, _aperture,
+               _axis_x, _axis_y)
+        cached = thickness_mesh_cache.get(key)
+
+        if cached is None:
+            x, y, lens_thickness = proj_thick_2D_crl(_foc_plane, _shape, _apert_h, _apert_v, _r_min, _n,
+                         _wall_thick=_wall_thickness, _aperture=_aperture,
+                         _nx=_axis_x.size, _ny=_axis_y.size,
+                         _axis_x=_axis_x, _axis_y=_axis_y,
+                         _xc=0, _yc=0,
+                         _ang_rot_ex=0, _ang_rot_ey=0, _ang_rot_ez=0,
+                         _offst_ffs_x=0, _offst_ffs_y=0,
+                         _tilt_ffs_x=0, _tilt_ffs_y=0, _ang_rot_ez_ffs=0,
+                         _wt_offst_ffs=0, _offst_bfs_x=0, _offst_bfs_y=0,
+                         _tilt_bfs_x=0, _tilt_bfs_y=0, _ang_rot_ez_bfs=0, _wt_offst_bfs=0,
+                         isdgr=False, project=True,)
+            x, y, lens_thickness = thickness_mesh_cache.put(key, (x, y, lens_thickness)) # (read-only, shared)
+        else:
+            if self._keywords_at_creation["verbose"]: print(">>> projected thickness recovered from cache")
+            x, y, lens_thickness = cached
 
-        lens_thickness *= self._keywords_at_creation["n_lenses"]
+        lens_thickness = lens_thickness * self._keywords_at_creation["n_lenses"]
 
         return x, y, lens_thickness
 
@@ -400,28 +432,18 @@ class WOLens1D(Lens, OpticalElementDecorator):
                                                         _axis=abscissas)
 
             elif shape == 2:  # Circular
-                lens_thickness = n_ref_lens * (
-                            numpy.abs(radius) - numpy.sqrt(radius ** 2 - abscissas_on_lens ** 2)) + wall_thickness
                 bound = 0.5 * lens_aperture
                 if radius < bound: bound = radius
-                for i, x in enumerate(abscissas_on_lens):
-                    if (x < -bound) or (x > bound):
-                        lens_thickness[i] = 0
-                for i, x in enumerate(abscissas_on_lens):
-                    if (x < -bound) or (x > bound):
-                        lens_thickness[i] = lens_thickness.max()
+                outside = (abscissas_on_lens < -bound) | (abscissas_on_lens > bound)
+                lens_thickness = n_ref_lens * (numpy.abs(radius) -
+                            numpy.sqrt(numpy.maximum(radius ** 2 - abscissas_on_lens ** 2, 0))) + wall_thickness
+                lens_thickness[outside] = 0
+                lens_thickness[outside] = lens_thickness.max()
 
         lens_thickness *= n_lenses
 
         if error_flag:
-            a = numpy.loadtxt(error_file)  # extrapolation
-            if error_edge_management == 0:
-                finterpolate = interpolate.interp1d(a[:, 0], a[:, 1],
-                                                    fill_value="extrapolate")  # fill_value=(0,0),bounds_error=False)
-            elif error_edge_management == 1:
-                finterpolate = interpolate.interp1d(a[:, 0], a[:, 1], fill_value=(0, 0), bounds_error=False)
-            else:  # crop
-                raise Exception("Bad value of error_edge_management")
+            a, finterpolate = _get_error_profile(error_file, error_edge_management)
             thickness_interpolated = finterpolate(abscissas_on_lens)
             lens_thickness += thickness_interpolated
 
@@ -438,8 +460,6 @@ class WOLens1D(Lens, OpticalElementDecorator):
 
     def get_refraction_index(self, photon_energy=10000.0):
 
-        wave_length = codata.h * codata.c / codata.e / photon_energy
-
         if self.get_material() == "External":
             refraction_index_delta = self._keywords_at_creation["refraction_index_delta"]
             att_coefficient = self._keywords_at_creation["att_coefficient"]
@@ -447,21 +467,9 @@ class WOLens1D(Lens, OpticalElementDecorator):
             print("Attenuation coeff mu = %g m^-1" % (att_coefficient))
             return refraction_index_delta, att_coefficient
 
-        if self.get_material() == "Be": # Be
-            element = "Be"
-            density = xraylib.ElementDensity(4)
-        elif self.get_material() == "Al": # Al
-            element = "Al"
-            density = xraylib.ElementDensity(13)
-        elif self.get_material() == "Diamond": # Diamond
-            element = "C"
-            density = 3.51
-        else:
-            raise Exception("Bad material: " + self.get_material())
-
-        refraction_index = xraylib.Refractive_Index(element, photon_energy/1000, density)
-        refraction_index_delta = 1 - refraction_index.real
-        att_coefficient = 4*numpy.pi * (xraylib.Refractive_Index(element, photon_energy/1000, density)).imag / wave_length
+        element, density = get_element_and_density(self.get_material())
+        refraction_index_delta, att_coefficient = \
+            material_constants_cache.get_delta_and_mu(element, density, photon_energy)
 
         if self._keywords_at_creation["verbose"]:
             print("\n\n\n ==========  parameters recovered from xraylib : ")
@@ -516,7 +524,7 @@ class WOLens1D(Lens, OpticalElementDecorator):
         output_wavefront.add_phase_shifts(phase_shifts)
 
         if error_flag:
-            a = numpy.loadtxt(error_file)  # extrapolation
+            a = _get_error_profile(error_file)
             # profile_limits = a[-1, 0] - a[0, 0]
             profile_limits_projected = a[-1, 0] - a[0, 0]
             wavefront_dimension = output_wavefront.get_abscissas()[-1] - output_wavefront.get_abscissas()[0]
@@ -633,6 +641,37 @@ class WOLens1D(Lens, OpticalElementDecorator):
         txt += "\n"
         return txt
 
+def benchmark_lens1D(number_of_points=1000000, error_profile=True, number_of_runs=3):
+    import time
+    import tempfile
+    from wofry.propagator.wavefront1D.generic_wavefront import GenericWavefront1D
+
+    input_wavefront = GenericWavefront1D.initialize_wavefront_from_range(x_min=-0.0005, x_max=0.0005,
+                                                                         number_of_points=number_of_points)
+    input_wavefront.set_photon_energy(10000)
+    input_wavefront.set_spherical_wave(radius=13.73, center=0, complex_amplitude=complex(1, 0))
+
+    error_file = ""
+    if error_profile:
+        # temporary profile file (closed before use, removed at the end)
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".dat", prefix="tmp_lens1D_error_profile_",
+                                         delete=False) as f:
+            error_file = f.name
+            x = numpy.linspace(-0.0006, 0.0006, 1001)
+            numpy.savetxt(f, numpy.column_stack((x, 1e-7 * numpy.sin(2 * numpy.pi * x / 1e-4))))
+
+    try:
+        for shape in (1, 2):
+            wolens = WOLens1D.create_from_keywords(shape=shape, error_flag=int(error_profile), error_file=error_file,
+                                                   verbose=0)
+            for i in range(number_of_runs):
+                t0 = time.time()
+                wolens.applyOpticalElement(input_wavefront)
+                print("shape=%d (1=parabolic, 2=circular), %d points, run %d: %.3f s" %
+                      (shape, number_of_points, i, time.time() - t0))
+    finally:
+        if error_profile: os.remove(error_file)
+
 if __name__ == "__main__":
     pass
 
@@ -680,3 +719,9 @@ if __name__ == "__main__":
     # print(">>> _r_min: radius (on tip of parabola for parabolic shape) [m] = ", _r_min)
     # print(">>> _shape: 1- parabolic, 2- circular (spherical) = ", _shape)
     # print(">>> _foc_plane: (plane of focusing: 1- horizontal, 2- vertical, 3- both) = ", _foc_plane)
+
+    #
+    # benchmark of the 1D real lens (the calculation of the Real Lens 1D widget) on large wavefronts
+    #
+    if False:
+        benchmark_lens1D(number_of_points=1000000)
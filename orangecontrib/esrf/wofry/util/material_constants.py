@@ -0,0 +1,99 @@
+import numpy
+import scipy.constants as codata
+import xraylib
+from collections import OrderedDict
+
+#
+# Cache of the refraction index decrement (delta) and linear attenuation coefficient (mu) of the lens and
+# thin object materials, shared by WOLens, WOLens1D, WOThinObject and WOThinObject1D.
+#
+# Values are stored per (element, density, photon energy) in a LRU dictionary. Optionally, the constants can be
+# precomputed on an energy grid (precompute) and then interpolated (log-log) for any energy inside the grid,
+# which is useful in long energy scans. Note that the interpolation is not accurate across absorption edges.
+#
+
+def get_element_and_density(material):
+    if material == "Be": # Be
+        return "Be", xraylib.ElementDensity(4)
+    elif material == "Al": # Al
+        return "Al", xraylib.ElementDensity(13)
+    elif material == "Diamond": # Diamond
+        return "C", 3.51
+    else:
+        raise Exception("Bad material: " + material)
+
+
+class MaterialConstantsCache():
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._tables = {}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.interpolations = 0
+
+    def clear(self):
+        self._cache.clear()
+        self._tables.clear()
+        self.reset_counters()
+
+    def get_counters(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "interpolations": self.interpolations,
+                "size": len(self._cache),
+                "tables": len(self._tables)}
+
+    @classmethod
+    def calculate_delta_and_mu(cls, element, density, photon_energy):
+        wave_length = codata.h * codata.c / codata.e / photon_energy
+        refraction_index = xraylib.Refractive_Index(element, photon_energy / 1000, density)
+        return 1 - refraction_index.real, 4 * numpy.pi * refraction_index.imag / wave_length
+
+    def precompute(self, element, density, photon_energy_min, photon_energy_max, number_of_points=1000):
+        photon_energies = numpy.geomspace(photon_energy_min, photon_energy_max, number_of_points)
+        delta = numpy.zeros(number_of_points)
+        mu = numpy.zeros(number_of_points)
+        for i, photon_energy in enumerate(photon_energies):
+            delta[i], mu[i] = self.calculate_delta_and_mu(element, density, photon_energy)
+        self._tables[(element, float(density))] = (numpy.log(photon_energies), numpy.log(delta), numpy.log(mu))
+
+    def get_delta_and_mu(self, element, density, photon_energy):
+        key = (element, float(density), float(photon_energy))
+
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        table = self._tables.get(key[0:2])
+        if table is not None and table[0][0] <= numpy.log(photon_energy) <= table[0][-1]:
+            self.interpolations += 1
+            log_energy = numpy.log(photon_energy)
+            return float(numpy.exp(numpy.interp(log_energy, table[0], table[1]))), \
+                   float(numpy.exp(numpy.interp(log_energy, table[0], table[2])))
+
+        self.misses += 1
+        value = self.calculate_delta_and_mu(element, density, photon_energy)
+        self._cache[key] = value
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return value
+
+
+material_constants_cache = MaterialConstantsCache()
+
+def get_delta_and_mu(material, photon_energy):
+    element, density = get_element_and_density(material)
+    return material_constants_cache.get_delta_and_mu(element, density, photon_energy)
+
+
+if __name__ == "__main__":
+    for photon_energy in numpy.linspace(8000, 12000, 5):
+        for i in range(3):
+            delta, mu = get_delta_and_mu("Be", photon_energy)
+        print("Be, photon energy = %g eV: delta = %g, mu = %g m^-1" % (photon_energy, delta, mu))
+    print(material_constants_cache.get_counters())
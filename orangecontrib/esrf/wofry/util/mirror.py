@@ -1,4 +1,6 @@
 import numpy
+import os
+import hashlib
 from syned.beamline.optical_elements.mirrors.mirror import Mirror
 
 
@@ -22,6 +24,240 @@ def goFromToSequential(field1, x1, y1, x2, y2, wavelength=1e-10, normalize_inten
         field2 *= numpy.sqrt((numpy.abs(field1) ** 2).sum() / (numpy.abs(field2) ** 2).sum())
     return field2
 
+#
+# blocked (cache-aware) variants of goFromToSequential
+#
+# Targets are distributed among threads in small blocks, and sources are streamed in blocks that fit in cache.
+# Distance, phase and accumulation are fused in scalar loops, so no temporary array is allocated per target.
+# In the single precision kernel the geometry and the phase are kept in double precision (k r ~ 1e10 rad for
+# X-rays) and only the phase reduced to [0, 2pi), the trigonometric functions and the fields are in float32.
+#
+@jit(nopython=True, parallel=True)
+def _goFromToBlockedKernel(field1_re, field1_im, x1, y1, x2, y2, wavenumber, source_block, target_block):
+    field2_re = numpy.zeros(x2.size)
+    field2_im = numpy.zeros(x2.size)
+    n_target_blocks = (x2.size + target_block - 1) // target_block
+    for b in prange(n_target_blocks):
+        i_start = b * target_block
+        i_end = min(i_start + target_block, x2.size)
+        for j_start in range(0, x1.size, source_block):
+            j_end = min(j_start + source_block, x1.size)
+            for i in range(i_start, i_end):
+                xi = x2[i]
+                yi = y2[i]
+                acc_re = 0.0
+                acc_im = 0.0
+                for j in range(j_start, j_end):
+                    dx = x1[j] - xi
+                    dy = y1[j] - yi
+                    phase = wavenumber * numpy.sqrt(dx * dx + dy * dy)
+                    c = numpy.cos(phase)
+                    s = numpy.sin(phase)
+                    acc_re += field1_re[j] * c - field1_im[j] * s
+                    acc_im += field1_re[j] * s + field1_im[j] * c
+                field2_re[i] += acc_re
+                field2_im[i] += acc_im
+    return field2_re, field2_im
+
+@jit(nopython=True, parallel=True)
+def _goFromToBlockedKernel32(field1_re, field1_im, x1, y1, x2, y2, wavenumber, source_block, target_block):
+    two_pi = 2 * numpy.pi
+    field2_re = numpy.zeros(x2.size)
+    field2_im = numpy.zeros(x2.size)
+    n_target_blocks = (x2.size + target_block - 1) // target_block
+    for b in prange(n_target_blocks):
+        i_start = b * target_block
+        i_end = min(i_start + target_block, x2.size)
+        for j_start in range(0, x1.size, source_block):
+            j_end = min(j_start + source_block, x1.size)
+            for i in range(i_start, i_end):
+                xi = x2[i]
+                yi = y2[i]
+                acc_re = numpy.float32(0.0)
+                acc_im = numpy.float32(0.0)
+                for j in range(j_start, j_end):
+                    dx = x1[j] - xi
+                    dy = y1[j] - yi
+                    phase = wavenumber * numpy.sqrt(dx * dx + dy * dy)
+                    phase32 = numpy.float32(phase - two_pi * numpy.floor(phase / two_pi))
+                    c = numpy.cos(phase32)
+                    s = numpy.sin(phase32)
+                    acc_re += field1_re[j] * c - field1_im[j] * s
+                    acc_im += field1_re[j] * s + field1_im[j] * c
+                field2_re[i] += acc_re
+                field2_im[i] += acc_im
+    return field2_re, field2_im
+
+def goFromToBlocked(field1, x1, y1, x2, y2, wavelength=1e-10, normalize_intensities=False,
+                    single_precision=False, source_block=4096, target_block=16):
+    wavenumber = numpy.pi * 2 / wavelength
+    x1 = numpy.ascontiguousarray(x1, dtype=numpy.float64)
+    y1 = numpy.ascontiguousarray(y1, dtype=numpy.float64)
+    x2 = numpy.ascontiguousarray(x2, dtype=numpy.float64)
+    y2 = numpy.ascontiguousarray(y2, dtype=numpy.float64)
+
+    if single_precision:
+        field2_re, field2_im = _goFromToBlockedKernel32(
+            numpy.ascontiguousarray(field1.real, dtype=numpy.float32),
+            numpy.ascontiguousarray(field1.imag, dtype=numpy.float32),
+            x1, y1, x2, y2, wavenumber, source_block, target_block)
+        field2 = (field2_re + 1j * field2_im).astype(numpy.complex64)
+    else:
+        field2_re, field2_im = _goFromToBlockedKernel(
+            numpy.ascontiguousarray(field1.real, dtype=numpy.float64),
+            numpy.ascontiguousarray(field1.imag, dtype=numpy.float64),
+            x1, y1, x2, y2, wavenumber, source_block, target_block)
+        field2 = field2_re + 1j * field2_im
+
+    if normalize_intensities:
+        field2 *= numpy.sqrt((numpy.abs(field1) ** 2).sum() / (numpy.abs(field2) ** 2).sum())
+    return field2
+
+#
+# fast evaluation of the Huygens sum (anchored envelope interpolation)
+#
+# The kernel exp(i k r) oscillates too fast to be interpolated, but once the phase to a reference point of the other
+# set is removed, exp(i k (r - R)) is smooth along the densely sampled set (typically the mirror profile). The sum
+# is then evaluated exactly only on a subset of "anchor" points, and the envelope is interpolated (targets) or
+# anterpolated (sources) with local Lagrange polynomials. The result is checked against the direct sum at a few
+# points and the number of anchors is doubled until the requested tolerance is met (or the direct sum is used).
+#
+def _arc_length(x, y):
+    s = numpy.zeros(x.size)
+    s[1:] = numpy.cumsum(numpy.sqrt(numpy.diff(x) ** 2 + numpy.diff(y) ** 2))
+    return s
+
+def _lagrange_weights(s_nodes, s, order=6):
+    order = min(order, s_nodes.size)
+    start = numpy.clip(numpy.searchsorted(s_nodes, s) - order // 2, 0, s_nodes.size - order)
+    index = start[:, numpy.newaxis] + numpy.arange(order)[numpy.newaxis, :]
+    nodes = s_nodes[index]
+    weights = numpy.ones_like(nodes)
+    for k in range(order):
+        for m in range(order):
+            if m != k:
+                weights[:, k] *= (s - nodes[:, m]) / (nodes[:, k] - nodes[:, m])
+    return index, weights
+
+def _envelope_number_of_anchors(x_dense, y_dense, x_sparse, y_sparse, s_dense, wavenumber, xc, yc, order):
+    # maximum phase slope (rad/m) of the envelope exp(i k (r - R)) along the dense set, estimated at the
+    # extreme and central points of the sparse set. Anchors are placed every pi/4 of envelope phase.
+    r_ref = numpy.sqrt((x_dense - xc) ** 2 + (y_dense - yc) ** 2)
+    ds = numpy.diff(s_dense)
+    ds[ds == 0] = numpy.inf
+    slope = 0.0
+    for i in (0, x_sparse.size // 2, x_sparse.size - 1):
+        r = numpy.sqrt((x_dense - x_sparse[i]) ** 2 + (y_dense - y_sparse[i]) ** 2)
+        slope = max(slope, (numpy.abs(numpy.diff(wavenumber * (r - r_ref))) / ds).max())
+    return int(numpy.ceil(s_dense[-1] * slope / (numpy.pi / 4))) + order
+
+def goFromToInterpolated(field1, x1, y1, x2, y2, wavelength=1e-10, normalize_intensities=False,
+                         phase_tolerance=1e-3, interpolation_order=6, number_of_checks=16, verbose=False):
+    """
+    Same integral as goFromToSequential, evaluated on a subset of anchor points of the largest set.
+
+    phase_tolerance: maximum deviation from the direct sum at the check points, relative to the peak
+                     amplitude (i.e., the phase error in radians at the intensity peak).
+    """
+    wavenumber = numpy.pi * 2 / wavelength
+    targets_are_dense = x2.size >= x1.size
+
+    if targets_are_dense:
+        x_dense, y_dense, x_sparse, y_sparse = x2, y2, x1, y1
+    else:
+        x_dense, y_dense, x_sparse, y_sparse = x1, y1, x2, y2
+
+    n_dense = x_dense.size
+    s_dense = _arc_length(x_dense, y_dense)
+    xc, yc = x_sparse.mean(), y_sparse.mean()
+    phase_ref = numpy.exp(1j * wavenumber * numpy.sqrt((x_dense - xc) ** 2 + (y_dense - yc) ** 2))
+
+    n_anchors = _envelope_number_of_anchors(x_dense, y_dense, x_sparse, y_sparse, s_dense, wavenumber, xc, yc,
+                                            interpolation_order)
+    field2 = None
+    while 2 * n_anchors < n_dense:
+        anchors = numpy.unique(numpy.round(numpy.linspace(0, n_dense - 1, n_anchors)).astype(int))
+        index, weights = _lagrange_weights(s_dense[anchors], s_dense, order=interpolation_order)
+
+        if targets_are_dense:
+            envelope = goFromToSequential(field1, x1, y1, x2[anchors], y2[anchors], wavelength=wavelength) / \
+                       phase_ref[anchors]
+            field2 = phase_ref * (weights * envelope[index]).sum(axis=1)
+            # check at the points between anchors (where the interpolation error is largest)
+            checks = (anchors[:-1] + anchors[1:]) // 2
+            checks = checks[numpy.round(numpy.linspace(0, checks.size - 1, number_of_checks)).astype(int)]
+            direct = goFromToSequential(field1, x1, y1, x2[checks], y2[checks], wavelength=wavelength)
+        else:
+            weighted = (weights * (field1 * phase_ref)[:, numpy.newaxis]).ravel()
+            field1_anchors = numpy.bincount(index.ravel(), weights=weighted.real, minlength=anchors.size) + \
+                        1j * numpy.bincount(index.ravel(), weights=weighted.imag, minlength=anchors.size)
+            field2 = goFromToSequential(field1_anchors / phase_ref[anchors], x1[anchors], y1[anchors], x2, y2,
+                                        wavelength=wavelength)
+            checks = numpy.round(numpy.linspace(0, x2.size - 1, number_of_checks)).astype(int)
+            checks = numpy.unique(numpy.append(checks, numpy.abs(field2).argmax()))
+            direct = goFromToSequential(field1, x1, y1, x2[checks], y2[checks], wavelength=wavelength)
+
+        peak = numpy.abs(field2).max()
+        deviation = numpy.abs(field2[checks] - direct).max() / peak if peak > 0 else 0.0
+        if verbose:
+            print("goFromToInterpolated: %d anchors for %d points, deviation from direct sum: %g" %
+                  (anchors.size, n_dense, deviation))
+        if deviation <= phase_tolerance:
+            break
+        field2 = None
+        n_anchors *= 2
+
+    if field2 is None:
+        if verbose: print("goFromToInterpolated: tolerance not reached with anchors, using direct sum.")
+        return goFromToSequential(field1, x1, y1, x2, y2, wavelength=wavelength,
+                                  normalize_intensities=normalize_intensities)
+
+    if normalize_intensities:
+        field2 *= numpy.sqrt((numpy.abs(field1) ** 2).sum() / (numpy.abs(field2) ** 2).sum())
+    return field2
+
+def goFromTo(field1, x1, y1, x2, y2, wavelength=1e-10, normalize_intensities=False,
+             propagation_method=0, phase_tolerance=1e-3):
+    # propagation_method: 0=direct sum, 1=fast (anchored envelope interpolation),
+    #                     2=direct sum (blocked kernel), 3=direct sum (blocked kernel, single precision)
+    if propagation_method == 0:
+        return goFromToSequential(field1, x1, y1, x2, y2, wavelength=wavelength,
+                                  normalize_intensities=normalize_intensities)
+    elif propagation_method == 1:
+        return goFromToInterpolated(field1, x1, y1, x2, y2, wavelength=wavelength,
+                                    normalize_intensities=normalize_intensities,
+                                    phase_tolerance=phase_tolerance)
+    elif propagation_method == 2:
+        return goFromToBlocked(field1, x1, y1, x2, y2, wavelength=wavelength,
+                               normalize_intensities=normalize_intensities)
+    elif propagation_method == 3:
+        return goFromToBlocked(field1, x1, y1, x2, y2, wavelength=wavelength,
+                               normalize_intensities=normalize_intensities, single_precision=True)
+    else:
+        raise Exception("Wrong propagation method")
+
+#
+# batched propagation of several modes sharing the same geometry: the kernel exp(i k r) is evaluated once (in chunks
+# of targets of at most max_kernel_size elements) and applied to all the modes as a matrix product.
+#
+def goFromToModes(fields1, x1, y1, x2, y2, wavelength=1e-10, normalize_intensities=False, max_kernel_size=2**22):
+    # fields1: array (modes x points in x1), returns array (modes x points in x2)
+    fields1 = numpy.atleast_2d(fields1)
+    wavenumber = numpy.pi * 2 / wavelength
+    fields2 = numpy.zeros((fields1.shape[0], x2.size), dtype=complex)
+
+    chunk = max(1, max_kernel_size // x1.size)
+    for i in range(0, x2.size, chunk):
+        r = numpy.sqrt((x2[i:i+chunk, numpy.newaxis] - x1[numpy.newaxis, :]) ** 2 +
+                       (y2[i:i+chunk, numpy.newaxis] - y1[numpy.newaxis, :]) ** 2)
+        fields2[:, i:i+chunk] = numpy.dot(fields1, numpy.exp(1j * wavenumber * r).T)
+
+    if normalize_intensities:
+        intensities2 = (numpy.abs(fields2) ** 2).sum(axis=1)
+        intensities2[intensities2 == 0] = 1.0
+        fields2 *= numpy.sqrt((numpy.abs(fields1) ** 2).sum(axis=1) / intensities2)[:, numpy.newaxis]
+    return fields2
+
 class WOMirror1D(Mirror, OpticalElementDecorator):
     def __init__(self,
                  name="Undefined",
@@ -37,9 +273,77 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
                       coating=coating, coating_thickness=coating_thickness)
 
         self._keywords_at_creation = keywords_at_creation
+        self._memo = {}
+
+    #
+    # memo of the height profile and of the field on the mirror, shared by get_footprint and applyOpticalElement
+    #
+    # (the memoized arrays are read-only, and returned as views that cannot be made writeable)
+    def _memoize(self, name, key, function):
+        if not name in self._memo or self._memo[name][0] != key:
+            self._memo[name] = (key, self._read_only(function()))
+        return self._views(self._memo[name][1])
+
+    @classmethod
+    def _read_only(cls, value):
+        if isinstance(value, tuple): return tuple(cls._read_only(item) for item in value)
+        value = numpy.array(value)
+        value.flags.writeable = False
+        return value
+
+    @classmethod
+    def _views(cls, value):
+        if isinstance(value, tuple): return tuple(cls._views(item) for item in value)
+        return value.view()
 
+    def same_keywords(self, optical_element):
+        # True if optical_element has been created with the same keywords (and can share this memo)
+        return isinstance(optical_element, WOMirror1D) and \
+               self._keywords_at_creation == optical_element._keywords_at_creation
+
+    def _keywords_key(self, *names):
+        return tuple(self._keywords_at_creation[name] for name in names)
+
+    def _height_profile_key(self):
+        key = self._keywords_key("shape", "p_focus", "q_focus", "grazing_angle_in", "error_flag", "error_file",
+                                 "error_file_oversampling_factor", "mirror_length", "mirror_points")
+        if self._keywords_at_creation["error_flag"]:
+            key += (os.path.getmtime(self._keywords_at_creation["error_file"]),)
+        return key
+
+    @classmethod
+    def _wavefront_hash(cls, wavefront):
+        h = hashlib.sha1()
+        h.update(numpy.ascontiguousarray(wavefront.get_abscissas()).tobytes())
+        h.update(numpy.ascontiguousarray(wavefront.get_complex_amplitude()).tobytes())
+        h.update(repr(wavefront.get_wavelength()).encode())
+        return h.hexdigest()
 
     def get_height_profile(self, input_wavefront):
+        return self._memoize("height_profile", self._height_profile_key(),
+                             lambda: self._calculate_height_profile(input_wavefront))
+
+    def get_mirror_field(self, input_wavefront):
+        # electric field on the mirror (not normalized)
+        grazing_angle_in   = self._keywords_at_creation["grazing_angle_in"]
+        flip               = self._keywords_at_creation["flip"]
+        p_distance         = self._keywords_at_creation["p_distance"]
+        propagation_method = self._keywords_at_creation["propagation_method"]
+        phase_tolerance    = self._keywords_at_creation["phase_tolerance"]
+
+        x2_oe, y2_oe = self.get_height_profile(input_wavefront)
+
+        key = (self._wavefront_hash(input_wavefront), self._height_profile_key()) + \
+              self._keywords_key("p_distance", "grazing_angle_in", "flip", "propagation_method", "phase_tolerance")
+
+        field2 = self._memoize("mirror_field", key,
+                               lambda: self.propagator1D_offaxis_up_to_mirror(input_wavefront, x2_oe, y2_oe,
+                                                    p_distance, grazing_angle_in, flip=flip,
+                                                    propagation_method=propagation_method,
+                                                    phase_tolerance=phase_tolerance))
+        return x2_oe, y2_oe, field2
+
+    def _calculate_height_profile(self, input_wavefront):
 
 
         shape                          = self._keywords_at_creation["shape"]
@@ -95,17 +399,7 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
 
 
     def get_footprint(self, input_wavefront):
-
-        grazing_angle_in   = self._keywords_at_creation["grazing_angle_in"]
-        p_distance         = self._keywords_at_creation["p_distance"]
-
-        # TODO avoid recalculation??
-        x2_oe, y2_oe = self.get_height_profile(input_wavefront)
-
-        field2  = self.propagator1D_offaxis_up_to_mirror(input_wavefront, x2_oe, y2_oe,
-                                                    p_distance, grazing_angle_in)
-
-        return x2_oe, y2_oe, field2
+        return self.get_mirror_field(input_wavefront)
 
 
 
@@ -118,15 +412,20 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
         q_distance         = self._keywords_at_creation["q_distance"]
         zoom_factor        = self._keywords_at_creation["zoom_factor"]
         write_profile      = self._keywords_at_creation["write_profile"]
+        propagation_method = self._keywords_at_creation["propagation_method"]
+        phase_tolerance    = self._keywords_at_creation["phase_tolerance"]
 
-        x2_oe, y2_oe = self.get_height_profile(input_wavefront)
+        x2_oe, y2_oe, field2 = self.get_mirror_field(input_wavefront)
 
         output_wavefront, x2_oe, y2_oe, field2  = self.propagator1D_offaxis(input_wavefront, x2_oe, y2_oe,
                                                     p_distance, q_distance,
                                                     grazing_angle_in,
                                                     zoom_factor=zoom_factor,
                                                     normalize_intensities=True,
-                                                    flip=flip)
+                                                    flip=flip,
+                                                    propagation_method=propagation_method,
+                                                    phase_tolerance=phase_tolerance,
+                                                    field2=field2)
 
         # output files
         if write_profile:
@@ -141,7 +440,8 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
 
     @classmethod
     def propagator1D_offaxis(cls, input_wavefront, x2_oe, y2_oe, p, q, theta_grazing_in, theta_grazing_out=None,
-                             zoom_factor=1.0, normalize_intensities=False, flip=0):
+                             zoom_factor=1.0, normalize_intensities=False, flip=0,
+                             propagation_method=0, phase_tolerance=1e-3, field2=None):
 
         if theta_grazing_out is None:
             theta_grazing_out = theta_grazing_in
@@ -157,9 +457,13 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
             x1_oe =  p * numpy.cos(theta_grazing_in) + x1 * numpy.sin(theta_grazing_in)
             y1_oe =  p * numpy.sin(theta_grazing_in) - x1 * numpy.cos(theta_grazing_in)
 
-        # field2 is the electric field in the mirror
-        field2 = goFromToSequential(field1, x1_oe, y1_oe, x2_oe, y2_oe,
-                                    wavelength=wavelength, normalize_intensities=normalize_intensities)
+        # field2 is the electric field in the mirror (if not given, e.g. from get_mirror_field)
+        if field2 is None:
+            field2 = goFromTo(field1, x1_oe, y1_oe, x2_oe, y2_oe,
+                              wavelength=wavelength, normalize_intensities=normalize_intensities,
+                              propagation_method=propagation_method, phase_tolerance=phase_tolerance)
+        elif normalize_intensities:
+            field2 = field2 * numpy.sqrt((numpy.abs(field1) ** 2).sum() / (numpy.abs(field2) ** 2).sum())
 
         x3 = x1 * zoom_factor
 
@@ -174,8 +478,9 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
 
 
         # field3 is the electric field in the image plane
-        field3 = goFromToSequential(field2, x2_oe, y2_oe, x3_oe, y3_oe,
-                                    wavelength=wavelength, normalize_intensities=normalize_intensities)
+        field3 = goFromTo(field2, x2_oe, y2_oe, x3_oe, y3_oe,
+                          wavelength=wavelength, normalize_intensities=normalize_intensities,
+                          propagation_method=propagation_method, phase_tolerance=phase_tolerance)
 
 
         output_wavefront = GenericWavefront1D.initialize_wavefront_from_arrays(x3, field3 / numpy.sqrt(zoom_factor),
@@ -183,21 +488,90 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
 
         return output_wavefront, x2_oe, y2_oe, field2
 
+    def applyOpticalElementToModes(self, input_wavefront, complex_amplitudes=None):
+        # batched propagation of coherent modes sharing the abscissas and photon energy of input_wavefront
+        # complex_amplitudes: array (modes x points) (default: the amplitude of input_wavefront)
+        # returns the output abscissas and the array (modes x points) of output complex amplitudes
+        grazing_angle_in   = self._keywords_at_creation["grazing_angle_in"]
+        flip               = self._keywords_at_creation["flip"]
+        p_distance         = self._keywords_at_creation["p_distance"]
+        q_distance         = self._keywords_at_creation["q_distance"]
+        zoom_factor        = self._keywords_at_creation["zoom_factor"]
+
+        if complex_amplitudes is None:
+            complex_amplitudes = input_wavefront.get_complex_amplitude()
+
+        x2_oe, y2_oe = self.get_height_profile(input_wavefront)
+
+        x3, complex_amplitudes3, complex_amplitudes2 = self.propagator1D_offaxis_modes(
+                                                    complex_amplitudes,
+                                                    input_wavefront.get_abscissas(),
+                                                    input_wavefront.get_wavelength(),
+                                                    x2_oe, y2_oe,
+                                                    p_distance, q_distance,
+                                                    grazing_angle_in,
+                                                    zoom_factor=zoom_factor,
+                                                    normalize_intensities=True,
+                                                    flip=flip)
+        return x3, complex_amplitudes3
+
+    @classmethod
+    def propagator1D_offaxis_modes(cls, complex_amplitudes, x1, wavelength, x2_oe, y2_oe, p, q, theta_grazing_in,
+                                   theta_grazing_out=None, zoom_factor=1.0, normalize_intensities=False, flip=0,
+                                   max_kernel_size=2**22):
+
+        if theta_grazing_out is None:
+            theta_grazing_out = theta_grazing_in
+
+        if flip == 0:
+            x1_oe = -p * numpy.cos(theta_grazing_in) + x1 * numpy.sin(theta_grazing_in)
+            y1_oe =  p * numpy.sin(theta_grazing_in) + x1 * numpy.cos(theta_grazing_in)
+        else:
+            x1_oe =  p * numpy.cos(theta_grazing_in) + x1 * numpy.sin(theta_grazing_in)
+            y1_oe =  p * numpy.sin(theta_grazing_in) - x1 * numpy.cos(theta_grazing_in)
+
+        # fields in the mirror (modes x mirror points)
+        complex_amplitudes2 = goFromToModes(complex_amplitudes, x1_oe, y1_oe, x2_oe, y2_oe, wavelength=wavelength,
+                                            normalize_intensities=normalize_intensities,
+                                            max_kernel_size=max_kernel_size)
+
+        x3 = x1 * zoom_factor
+
+        if flip == 0:
+            x3_oe = q * numpy.cos(theta_grazing_out) - x3 * numpy.sin(theta_grazing_out)
+            y3_oe = q * numpy.sin(theta_grazing_out) + x3 * numpy.cos(theta_grazing_out)
+        else:
+            x3_oe = -q * numpy.cos(theta_grazing_out) - x3 * numpy.sin(theta_grazing_out)
+            y3_oe =  q * numpy.sin(theta_grazing_out) - x3 * numpy.cos(theta_grazing_out)
+
+        # fields in the image plane (modes x points)
+        complex_amplitudes3 = goFromToModes(complex_amplitudes2, x2_oe, y2_oe, x3_oe, y3_oe, wavelength=wavelength,
+                                            normalize_intensities=normalize_intensities,
+                                            max_kernel_size=max_kernel_size)
+
+        return x3, complex_amplitudes3 / numpy.sqrt(zoom_factor), complex_amplitudes2
+
     @classmethod
     def propagator1D_offaxis_up_to_mirror(cls, input_wavefront, x2_oe, y2_oe, p, theta_grazing_in,
-                                          normalize_intensities=False):
+                                          normalize_intensities=False, propagation_method=0, phase_tolerance=1e-3,
+                                          flip=0):
 
 
         x1 = input_wavefront.get_abscissas()
         field1 = input_wavefront.get_complex_amplitude()
         wavelength = input_wavefront.get_wavelength()
 
-        x1_oe = -p * numpy.cos(theta_grazing_in) + x1 * numpy.sin(theta_grazing_in)
-        y1_oe =  p * numpy.sin(theta_grazing_in) + x1 * numpy.cos(theta_grazing_in)
+        if flip == 0:
+            x1_oe = -p * numpy.cos(theta_grazing_in) + x1 * numpy.sin(theta_grazing_in)
+            y1_oe =  p * numpy.sin(theta_grazing_in) + x1 * numpy.cos(theta_grazing_in)
+        else:
+            x1_oe =  p * numpy.cos(theta_grazing_in) + x1 * numpy.sin(theta_grazing_in)
+            y1_oe =  p * numpy.sin(theta_grazing_in) - x1 * numpy.cos(theta_grazing_in)
 
         # field2 is the electric field in the mirror
-        field2 = goFromToSequential(field1, x1_oe, y1_oe, x2_oe, y2_oe,
-                                    wavelength=wavelength, normalize_intensities=normalize_intensities)
+        field2 = goFromTo(field1, x1_oe, y1_oe, x2_oe, y2_oe,
+                          wavelength=wavelength, normalize_intensities=normalize_intensities,
+                          propagation_method=propagation_method, phase_tolerance=phase_tolerance)
 
         return field2
 
@@ -219,6 +593,8 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
                 mirror_length=1.0,
                 mirror_points=100,
                 write_profile=0,
+                propagation_method=0,
+                phase_tolerance=1e-3,
                              ):
 
         keywords_at_creation = {}
@@ -237,6 +613,8 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
         keywords_at_creation["mirror_length"]                  = mirror_length
         keywords_at_creation["mirror_points"]                  = mirror_points
         keywords_at_creation["write_profile"]                  = write_profile
+        keywords_at_creation["propagation_method"]             = propagation_method
+        keywords_at_creation["phase_tolerance"]                = phase_tolerance
 
         out = WOMirror1D(name="Undefined",
                  surface_shape=None,
@@ -271,10 +649,55 @@ class WOMirror1D(Mirror, OpticalElementDecorator):
         txt += "\n    error_file_oversampling_factor=%g," % self._keywords_at_creation["error_file_oversampling_factor"]
         txt += "\n    mirror_length=%g," % self._keywords_at_creation["mirror_length"]
         txt += "\n    mirror_points=%d," % self._keywords_at_creation["mirror_points"]
-        txt += "\n    write_profile=%d)" % self._keywords_at_creation["write_profile"]
+        txt += "\n    write_profile=%d," % self._keywords_at_creation["write_profile"]
+        txt += "\n    propagation_method=%d, # 0=direct, 1=fast, 2=direct blocked, 3=direct blocked float32" % self._keywords_at_creation["propagation_method"]
+        txt += "\n    phase_tolerance=%g)" % self._keywords_at_creation["phase_tolerance"]
         txt += "\n"
         return txt
 
+#
+# micro-benchmark of the Huygens sum kernels
+#
+def benchmark_goFromTo(number_of_points=(10000, 100000, 1000000), number_of_targets=1000,
+                       photon_energy=10000.0, max_deviation=1e-3, phase_tolerance=1e-3):
+    # geometry of the first leg of WOMirror1D (source plane to a 0.2 m long mirror at 3 mrad),
+    # with number_of_points on the mirror and number_of_targets on the wavefront (and vice versa).
+    import time
+    wavelength = 1.23984193e-06 / photon_energy
+    theta = 3e-3
+    p = 10.0
+
+    def run(function, *args, **kwargs):
+        function(*[a[:10] for a in args], **kwargs) # compilation is not benchmarked
+        t0 = time.time()
+        out = function(*args, **kwargs)
+        return out, time.time() - t0
+
+    variants = [("direct (blocked)", goFromToBlocked, {}),
+                ("direct (blocked, float32)", goFromToBlocked, {"single_precision": True}),
+                ("fast (interpolated)", goFromToInterpolated, {"phase_tolerance": phase_tolerance})]
+
+    results = []
+    for n in number_of_points:
+        x = numpy.linspace(-5e-4, 5e-4, number_of_targets)
+        field1 = numpy.exp(-x ** 2 / (2 * 1e-4 ** 2)) * numpy.exp(1j * numpy.pi / wavelength * x ** 2 / p)
+        x1 = -p * numpy.cos(theta) + x * numpy.sin(theta)
+        y1 =  p * numpy.sin(theta) + x * numpy.cos(theta)
+        x2 = numpy.linspace(-0.1, 0.1, n)
+        y2 = numpy.zeros_like(x2)
+
+        reference, t_reference = run(goFromToSequential, field1, x1, y1, x2, y2, wavelength=wavelength)
+        print("\n%d x %d points: goFromToSequential %.3f s" % (x1.size, n, t_reference))
+        results.append((n, "direct (goFromToSequential)", t_reference, 0.0))
+        for name, function, kwargs in variants:
+            out, t = run(function, field1, x1, y1, x2, y2, wavelength=wavelength, **kwargs)
+            deviation = numpy.abs(out - reference).max() / numpy.abs(reference).max()
+            print("    %-28s %8.3f s  speedup: %6.2f  deviation: %g %s" % (name, t, t_reference / t, deviation,
+                  "" if deviation <= max_deviation else "<<<< REGRESSION"))
+            results.append((n, name, t, deviation))
+
+    return results
+
 #
 #
 #
@@ -303,5 +726,8 @@ if __name__ == "__main__":
     plot(input_wavefront.get_abscissas(), input_wavefront.get_intensity())
     plot(output_wavefront.get_abscissas(),output_wavefront.get_intensity())
 
-
-
+    #
+    # micro-benchmark of the Huygens sum kernels
+    #
+    if False:
+        benchmark_goFromTo(number_of_points=(10000, 100000, 1000000), number_of_targets=1000)
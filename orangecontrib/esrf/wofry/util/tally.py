@@ -4,6 +4,7 @@ from oasys.util.oasys_util import get_fwhm
 from srxraylib.plot.gol import plot, plot_image
 import matplotlib.pylab as plt
 import os
+from orangecontrib.esrf.wofry.util.profile_metrics import get_profiles_metrics
 
 # def get_fwhm(histogram, bins):
 #     quote = numpy.max(histogram)*0.5
@@ -19,18 +20,36 @@ import os
 #
 #     return fwhm, quote, coordinates
 
+def _append_row(buffer, index, row, dtype):
+    # stores row in buffer[index, :], allocating or growing (by doubling) the buffer when needed
+    if buffer is None:
+        buffer = numpy.zeros((16, row.size), dtype=dtype)
+    elif index >= buffer.shape[0]:
+        buffer = numpy.concatenate((buffer, numpy.zeros_like(buffer)))
+    buffer[index, :] = row
+    return buffer
+
 #
 #
 #
 class Tally():
+    # do_store_wavefronts: store a copy of each appended wavefront.
+    # do_store_intensities: store only the intensities, as rows of a preallocated (grown by doubling) array, and the
+    #                       abscissas of the first wavefront. Use it for long scans where the wavefronts do not fit
+    #                       in memory.
+    # intensity_dtype: type of the stored intensities (e.g. numpy.float32 to halve the memory).
     def __init__(self,
                  scan_variable_name='x',
                  additional_stored_variable_names=None,
-                 do_store_wavefronts=False):
+                 do_store_wavefronts=False,
+                 do_store_intensities=False,
+                 intensity_dtype=numpy.float64):
         self.reset()
         self.scan_variable_name = scan_variable_name
         self.additional_stored_variable_names = additional_stored_variable_names
         self.do_store_wavefronts = do_store_wavefronts
+        self.do_store_intensities = do_store_intensities
+        self.intensity_dtype = intensity_dtype
 
     def reset(self):
         self.scan_variable_index = -1
@@ -41,6 +60,8 @@ class Tally():
         self.intensity_peak = []
         self.additional_stored_values = []
         self.stored_wavefronts = []
+        self.stored_intensities = None
+        self.stored_abscissas = None
 
 
     def append(self, wf, scan_variable_value=None, additional_stored_values=None):
@@ -60,6 +81,11 @@ class Tally():
         if self.do_store_wavefronts:
             self.stored_wavefronts.append(wf.duplicate())
 
+        if self.do_store_intensities:
+            if self.stored_abscissas is None: self.stored_abscissas = wf.get_abscissas().copy()
+            self.stored_intensities = _append_row(self.stored_intensities, self.scan_variable_index,
+                                                  wf.get_intensity(), self.intensity_dtype)
+
     def get_wavefronts(self):
         return self.stored_wavefronts
 
@@ -79,6 +105,9 @@ class Tally():
         return numpy.array(self.fwhm)
 
     def get_wavefronts_intensity(self):
+        if self.stored_intensities is not None:
+            return self.stored_intensities[0:self.get_number_of_calls(), :]
+
         if len(self.stored_wavefronts) == 0:
             raise Exception("No stored wavefronts found")
 
@@ -90,18 +119,22 @@ class Tally():
         return INTENSITY
 
     def get_wavefronts_abscissas(self):
+        if self.stored_abscissas is not None:
+            return self.stored_abscissas
+
         if len(self.stored_wavefronts) == 0:
             raise Exception("No stored wavefronts found")
         else:
             return self.stored_wavefronts[-1].get_abscissas()
 
     def save_scan(self, filename="tmp.dat", add_header=True):
+        if self.additional_stored_variable_names is None:
+            number_of_additional_parameters = 0
+        else:
+            number_of_additional_parameters = len(self.additional_stored_variable_names)
+
         f = open(filename, 'w')
         if add_header:
-            if self.additional_stored_variable_names is None:
-                number_of_additional_parameters = 0
-            else:
-                number_of_additional_parameters = len(self.additional_stored_variable_names)
             header = "#S 1 scored data\n"
             header += "#N %d\n" % (number_of_additional_parameters + 5)
             header_titles = "#L  %s  %s  %s  %s  %s" % (self.scan_variable_name, "fwhm", "total_intensity", "on_axis_intensity", "peak_intensity")
@@ -122,6 +155,14 @@ class Tally():
         f.close()
         print("File written to disk: %s" % filename)
 
+    def save_wavefronts_intensity(self, filename="tmp.npz"):
+        # writes the scan values, abscissas and intensities (scan points x abscissas) in a numpy .npz file
+        numpy.savez(filename,
+                    scan_variable_value=self.get_scan_variable_value(),
+                    abscissas=self.get_wavefronts_abscissas(),
+                    intensity=self.get_wavefronts_intensity())
+        print("File written to disk: %s" % filename)
+
     def plot(self, title="", factor_abscissas=1.0, xtitle=None):
         self.plot_fwhm(title=title, factor_abscissas=factor_abscissas, xtitle=xtitle)
         self.plot_intensity_at_center(title=title, factor_abscissas=factor_abscissas, xtitle=xtitle)
@@ -166,57 +207,108 @@ class Tally():
                    xtitle=xtitle, ytitle=ytitle, title=title, aspect='auto')
         return out
 
+    def get_wavefronts_metrics(self):
+        # peak, fwhm, centroid, rms, integral and at_center of all the stored intensities, in one pass
+        return get_profiles_metrics(self.get_wavefronts_intensity(), self.get_wavefronts_abscissas())
+
     @classmethod
     def process_wavefront(cls, wf):
-        I = wf.get_intensity()
-        x = wf.get_abscissas()
-
-        fwhm, quote, coordinates = get_fwhm(I, x)
-        intensity_at_center = I[I.size // 2]
-        intensity_total = I.sum() * (x[1] - x[0])
-        intensity_peak = I.max()
-
-        return fwhm, intensity_total, intensity_at_center, intensity_peak
+        metrics = get_profiles_metrics(wf.get_intensity(), wf.get_abscissas())
+        return metrics["fwhm"][0], metrics["integral"][0], metrics["at_center"][0], metrics["peak"][0]
 
 
 
 class TallyCoherentModes(Tally):
+    # storage_mode: 0 = store the wavefronts (default),
+    #               1 = store only the complex amplitudes (modes x points), i.e., a low-rank factor A of the CSD = A^H A,
+    #               2 = accumulate the CSD in append (nothing is stored per mode).
+    # csd_memmap_file: if not None, the CSD (points x points) is created as a memory-mapped array in this file.
+    # diagonalization_method: 0 = numpy.linalg.eig of the CSD (default),
+    #                         1 = numpy.linalg.eigh of the CSD (Hermitian),
+    #                         2 = scipy.sparse.linalg.eigsh (Lanczos) for the largest number_of_eigenvalues,
+    #                         3 = SVD of the stacked mode amplitudes A (CSD = A^H A, rank <= number of modes).
+    # number_of_eigenvalues: eigenvalues calculated with diagonalization_method=2 (default: number of modes).
+    #                        The occupation and coherent fraction are normalized to the trace of the CSD, so they
+    #                        are right also when only some eigenvalues are calculated.
     def __init__(self,
-                 additional_stored_variable_names=None):
+                 additional_stored_variable_names=None,
+                 storage_mode=0,
+                 csd_memmap_file=None,
+                 diagonalization_method=0,
+                 number_of_eigenvalues=None):
 
         super().__init__(scan_variable_name='mode_index',
                  additional_stored_variable_names=additional_stored_variable_names,
-                 do_store_wavefronts=True)
+                 do_store_wavefronts=(storage_mode == 0))
+
+        self.storage_mode = storage_mode
+        self.csd_memmap_file = csd_memmap_file
+        self.diagonalization_method = diagonalization_method
+        self.number_of_eigenvalues = number_of_eigenvalues
 
+    def reset(self):
+        super().reset()
         self.abscissas = None
         self.cross_spectral_density = None
-        self.spectral_density = None,
+        self.spectral_density = None
+        self.eigenvalues = None
+        self.eigenvectors = None
+        self.mode_amplitudes = None # buffer (grown by doubling) for storage_mode=1
+
+    def append(self, wf, scan_variable_value=None, additional_stored_values=None):
+        super().append(wf, scan_variable_value=scan_variable_value, additional_stored_values=additional_stored_values)
+
+        if self.abscissas is None: self.abscissas = wf.get_abscissas().copy()
+        amplitude = wf.get_complex_amplitude()
+        nmodes = self.get_number_of_calls()
+
+        if self.storage_mode == 1:
+            self.mode_amplitudes = _append_row(self.mode_amplitudes, nmodes - 1, amplitude, complex)
+        elif self.storage_mode == 2:
+            if self.cross_spectral_density is None:
+                self.cross_spectral_density = self._allocate_cross_spectral_density(amplitude.size)
+            # rank-one update, in blocks of rows to bound the temporary memory
+            csd = self.cross_spectral_density
+            block = max(1, 2**21 // amplitude.size)
+            for i in range(0, amplitude.size, block):
+                csd[i:i+block, :] += numpy.outer(numpy.conjugate(amplitude[i:i+block]), amplitude)
+
+        if self.storage_mode != 2: self.cross_spectral_density = None
         self.eigenvalues = None
         self.eigenvectors = None
 
+    def _allocate_cross_spectral_density(self, npoints):
+        if self.csd_memmap_file is None:
+            return numpy.zeros((npoints, npoints), dtype=complex)
+        else:
+            return numpy.memmap(self.csd_memmap_file, dtype=complex, mode="w+", shape=(npoints, npoints))
+
+    def get_mode_amplitudes(self):
+        # the matrix A (modes x points) of the complex amplitudes of the modes
+        if self.storage_mode == 0:
+            WFs = self.get_wavefronts()
+            input_array = numpy.zeros((len(WFs), self.get_abscissas().size), dtype=complex)
+            for i,wf in enumerate(WFs):
+                input_array[i,:] = wf.get_complex_amplitude()
+            return input_array
+        elif self.storage_mode == 1:
+            return self.mode_amplitudes[0:self.get_number_of_calls(), :]
+        else:
+            raise Exception("Mode amplitudes are not stored with storage_mode=2")
+
     def get_cross_pectral_density(self):
         if self.cross_spectral_density is None: self.calculate_cross_spectral_density()
         return self.cross_spectral_density
 
     def get_spectral_density_from_intensities(self):
-        WF = self.get_wavefronts()
-        print(WF)
-        intensity = None
-        for i,wf in enumerate(WF):
-            if intensity is None:
-                intensity = wf.get_intensity()
-            else:
-                intensity += wf.get_intensity()
-        return intensity
+        if self.storage_mode == 2:
+            return numpy.real(numpy.diagonal(self.get_cross_pectral_density())).copy()
+        return (numpy.abs(self.get_mode_amplitudes()) ** 2).sum(axis=0)
 
 
     def get_spectral_density(self):
         csd = self.get_cross_pectral_density()
-        nx = csd.shape[0]
-        spectral_density = numpy.zeros(nx)
-        for i in range(nx):
-            spectral_density[i] = csd[i, i]
-        return spectral_density
+        return numpy.real(numpy.diagonal(csd)).copy()
 
     def get_eigenvalues(self):
         if self.eigenvalues is None: self.diagonalize()
@@ -226,40 +318,64 @@ class TallyCoherentModes(Tally):
         if self.eigenvectors is None: self.diagonalize()
         return self.eigenvectors
 
+    def get_total_intensity(self):
+        # trace of the CSD (the sum of all its eigenvalues), i.e., the summed intensities of the modes
+        return self.get_spectral_density_from_intensities().sum()
+
     def get_abscissas(self):
         if self.abscissas is None: self.abscissas = self.get_wavefronts()[-1].get_abscissas()
         return self.abscissas
 
 
     def calculate_cross_spectral_density(self, do_plot=False):
-        # retrieve arrays
-        WFs = self.get_wavefronts()
-        nmodes = self.get_number_of_calls()
-        abscissas = self.get_abscissas()
+        if self.storage_mode == 2:
+            if self.cross_spectral_density is None: raise Exception("No modes appended")
+            return  # accumulated in append
+
         #
-        # calculate the CSD
+        # calculate the CSD = A^H A, with A the array (modes x points)
         #
+        input_array = self.get_mode_amplitudes()
 
-        input_array = numpy.zeros((nmodes, abscissas.size), dtype=complex)
-        for i,wf in enumerate(WFs):
-            input_array[i,:] = wf.get_complex_amplitude() # tmp[i][0]
-
-        cross_spectral_density = numpy.zeros((abscissas.size, abscissas.size), dtype=complex)
-
-        for i in range(nmodes):
-            cross_spectral_density += numpy.outer(numpy.conjugate(input_array[i, :]), input_array[i, :])
+        if self.csd_memmap_file is None:
+            cross_spectral_density = numpy.dot(numpy.conjugate(input_array.T), input_array)
+        else:
+            cross_spectral_density = self._allocate_cross_spectral_density(input_array.shape[1])
+            block = max(1, 2**21 // input_array.shape[1])
+            for i in range(0, input_array.shape[1], block):
+                cross_spectral_density[i:i+block, :] = numpy.dot(numpy.conjugate(input_array[:, i:i+block].T),
+                                                                 input_array)
 
         self.cross_spectral_density = cross_spectral_density
 
 
     def diagonalize(self, do_plot=False):
+
+        if self.diagonalization_method == 3:
+            #
+            # SVD of the mode amplitudes: A = U S Vh, so CSD = A^H A = Vh^H S^2 Vh
+            #
+            u, sv, vh = numpy.linalg.svd(self.get_mode_amplitudes(), full_matrices=False)
+            self.eigenvalues = sv ** 2
+            self.eigenvectors = numpy.conjugate(vh)
+            return
+
         csd = self.get_cross_pectral_density()
 
         #
         # diagonalize the CSD
         #
+        if self.diagonalization_method == 0:
+            w, v = numpy.linalg.eig(csd)
+        elif self.diagonalization_method == 1:
+            w, v = numpy.linalg.eigh(csd)
+        elif self.diagonalization_method == 2:
+            from scipy.sparse.linalg import eigsh
+            k = self.get_number_of_calls() if self.number_of_eigenvalues is None else self.number_of_eigenvalues
+            w, v = eigsh(csd, k=max(1, min(k, csd.shape[0] - 1)), which='LA')
+        else:
+            raise Exception("Wrong diagonalization method")
 
-        w, v = numpy.linalg.eig(csd)
         print(w.shape, v.shape)
         idx = w.argsort()[::-1]  # large to small
         self.eigenvalues = numpy.real(w[idx])
@@ -268,13 +384,13 @@ class TallyCoherentModes(Tally):
 
     def get_occupation(self):
         ev = self.get_eigenvalues()
-        return  numpy.arange(ev.size), ev / ev.sum()
+        return  numpy.arange(ev.size), ev / self.get_total_intensity()
 
 
     def calculate_coherent_fraction(self, do_plot=False):
         if self.eigenvalues is None:
             self.diagonalize()
-        cf = self.eigenvalues[0] / self.eigenvalues.sum()
+        cf = self.eigenvalues[0] / self.get_total_intensity()
         return cf, self.eigenvalues, self.eigenvectors, self.cross_spectral_density
 
     def plot_cross_spectral_density(self, show=True, filename=""):
@@ -305,7 +421,7 @@ class TallyCoherentModes(Tally):
         fwhm, quote, coordinates = get_fwhm(spectral_density, 1e6 * abscissas)
 
         if method > 0:
-            nmodes = self.get_number_of_calls()
+            nmodes = min(self.get_number_of_calls(), eigenvalues.size)
             y = numpy.zeros_like(abscissas)
             for i in range(nmodes):
                 y += eigenvalues[i] * numpy.real(numpy.conjugate(eigenvectors[i, :]) * eigenvectors[i, :])
@@ -372,7 +488,7 @@ class TallyCoherentModes(Tally):
 
     def save_occupation(self, filename="", add_header=True):
         x, y = self.get_occupation()
-        nmodes = self.get_number_of_calls()
+        nmodes = min(self.get_number_of_calls(), y.size)
 
 
         f = open(filename, 'w')
@@ -387,6 +503,29 @@ class TallyCoherentModes(Tally):
         print("File written to disk: %s" % filename)
 
 
+def benchmark_diagonalization(number_of_points=(2048, 4096, 8192), number_of_modes=50,
+                              diagonalization_methods=(1, 2, 3)):
+    # time of the coherent fraction calculation of Gaussian-Hermite modes with the different diagonalization methods
+    import time
+    from wofry.propagator.wavefront1D.generic_wavefront import GenericWavefront1D
+
+    for npoints in number_of_points:
+        tallies = [TallyCoherentModes(storage_mode=1, diagonalization_method=method)
+                   for method in diagonalization_methods]
+        for xmode in range(number_of_modes):
+            output_wavefront = GenericWavefront1D.initialize_wavefront_from_range(x_min=-0.00012, x_max=0.00012,
+                                                                                  number_of_points=npoints)
+            output_wavefront.set_photon_energy(10000)
+            output_wavefront.set_gaussian_hermite_mode(sigma_x=3.03783e-05, amplitude=0.9**xmode, mode_x=xmode,
+                                                       shift=0, beta=0.0922395)
+            for tally in tallies: tally.append(output_wavefront)
+
+        for method, tally in zip(diagonalization_methods, tallies):
+            t0 = time.time()
+            cf, _, _, _ = tally.calculate_coherent_fraction()
+            print("points: %d, modes: %d, diagonalization_method: %d, coherent fraction: %g, time: %.3f s" %
+                  (npoints, number_of_modes, method, cf, time.time() - t0))
+
 if __name__ == "__main__":
     from wofry.propagator.wavefront1D.generic_wavefront import GenericWavefront1D
 
@@ -413,4 +552,10 @@ if __name__ == "__main__":
     sc.save_occupation(filename="tmp_occ.txt")
 
 
-    # cf, _, _, _ = sc.calculate_coherent_fraction(do_plot=1)
\ No newline at end of file
+    # cf, _, _, _ = sc.calculate_coherent_fraction(do_plot=1)
+
+    #
+    # benchmark of the diagonalization methods
+    #
+    if False:
+        benchmark_diagonalization(number_of_points=(2048, 4096, 8192), number_of_modes=50)
@@ -0,0 +1,26 @@
+import numpy
+import pytest
+
+from orangecontrib.esrf.wofry.util.array_cache import ArrayCache
+
+
+def test_cached_arrays_are_read_only(tmp_path):
+    cache = ArrayCache(directory=str(tmp_path))
+    key = ("mesh", 1.0, numpy.linspace(0.0, 1.0, 11))
+
+    x, z = cache.put(key, (numpy.linspace(0.0, 1.0, 11), numpy.ones((11, 11))))
+    with pytest.raises(ValueError):
+        z *= 2.0
+
+    # from memory and from disk, unchanged by the callers
+    for i in range(2):
+        x, z = cache.get(key)
+        assert not x.flags.writeable and not z.flags.writeable
+        with pytest.raises(ValueError):
+            z[0, 0] = 0.0
+        numpy.testing.assert_array_equal(z, 1.0)
+        cache.clear() # (the file is kept)
+
+    cache.get(key)
+    cache.clear(remove_files=True)
+    assert cache.get(key) is None
@@ -0,0 +1,60 @@
+import numpy
+import pytest
+
+pytest.importorskip("oasys.util.oasys_util")
+pytest.importorskip("srxraylib.plot.gol")
+pytest.importorskip("scipy.sparse.linalg")
+
+from orangecontrib.esrf.wofry.util.tally import TallyCoherentModes
+
+
+class _Wavefront():
+    def __init__(self, abscissas, complex_amplitude):
+        self.abscissas = abscissas
+        self.complex_amplitude = complex_amplitude
+
+    def get_abscissas(self):
+        return self.abscissas
+
+    def get_complex_amplitude(self):
+        return self.complex_amplitude
+
+    def get_intensity(self):
+        return numpy.abs(self.complex_amplitude) ** 2
+
+    def duplicate(self):
+        return _Wavefront(self.abscissas.copy(), self.complex_amplitude.copy())
+
+def _orthogonal_modes(number_of_modes=10, number_of_points=200):
+    # orthogonal modes with occupations 0.7**n
+    x = numpy.linspace(-1.0, 1.0, number_of_points)
+    q, _ = numpy.linalg.qr(numpy.exp(-(x[:, numpy.newaxis] / 0.3) ** 2) *
+                           x[:, numpy.newaxis] ** numpy.arange(number_of_modes))
+    return x, [_Wavefront(x, numpy.sqrt(0.7 ** n) * q[:, n].astype(complex)) for n in range(number_of_modes)]
+
+@pytest.mark.parametrize("storage_mode", [0, 1, 2])
+def test_coherent_fraction_with_truncated_eigsh(storage_mode):
+    x, wavefronts = _orthogonal_modes()
+    occupation = 0.7 ** numpy.arange(len(wavefronts))
+    expected = occupation[0] / occupation.sum()
+
+    for number_of_eigenvalues in [None, 3]:
+        tally = TallyCoherentModes(storage_mode=storage_mode, diagonalization_method=2,
+                                   number_of_eigenvalues=number_of_eigenvalues)
+        for wf in wavefronts: tally.append(wf)
+
+        cf, eigenvalues, _, _ = tally.calculate_coherent_fraction()
+        assert eigenvalues.size == (len(wavefronts) if number_of_eigenvalues is None else number_of_eigenvalues)
+        numpy.testing.assert_allclose(cf, expected, rtol=1e-8)
+
+        _, y = tally.get_occupation()
+        numpy.testing.assert_allclose(y, occupation[0:y.size] / occupation.sum(), rtol=1e-8)
+
+def test_truncated_eigsh_plots_and_saves(tmp_path):
+    x, wavefronts = _orthogonal_modes()
+    tally = TallyCoherentModes(storage_mode=1, diagonalization_method=2, number_of_eigenvalues=3)
+    for wf in wavefronts: tally.append(wf)
+
+    tally.plot_spectral_density(show=False, method=1)
+    tally.save_occupation(filename=str(tmp_path / "occupation.txt"))
+    assert numpy.loadtxt(str(tmp_path / "occupation.txt")).shape == (3, 2)
@@ -1,7 +1,9 @@
 import numpy
-from scipy.interpolate import interp2d
+import os
 import scipy.constants as codata
 import xraylib
+from orangecontrib.esrf.wofry.util.material_constants import get_element_and_density, material_constants_cache
+from orangecontrib.esrf.wofry.util.array_cache import ArrayCache
 
 from oasys.util.oasys_util import write_surface_file, read_surface_file
 from oasys.util.oasys_objects import OasysSurfaceData
@@ -13,6 +15,60 @@ from syned.widget.widget_decorator import WidgetDecorator
 from wofry.beamline.decorators import OpticalElementDecorator
 
 
+#
+# thickness files are loaded once per file name and modification time (the cached arrays are read-only)
+#
+surface_cache = ArrayCache(max_bytes=256 * 2**20)
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+def load_surface_file(filename):
+    # returns xx, yy, zz (zz shifted to be non negative), with zz of shape (yy.size, xx.size)
+    key = ("surface",) + _file_key(filename)
+    cached = surface_cache.get(key)
+    if cached is None:
+        xx, yy, zz = read_surface_file(filename)
+        if zz.min() < 0: zz -= zz.min()
+        cached = surface_cache.put(key, (numpy.asarray(xx), numpy.asarray(yy), numpy.asarray(zz)))
+    return cached
+
+def load_profile_file(filename):
+    # returns xx, zz of a two-column text file (zz shifted to be non negative)
+    key = ("profile",) + _file_key(filename)
+    cached = surface_cache.get(key)
+    if cached is None:
+        a = numpy.loadtxt(filename)
+        xx = a[:,0].copy()
+        zz = a[:,1].copy()
+        if zz.min() < 0: zz -= zz.min()
+        cached = surface_cache.put(key, (xx, zz))
+    return cached
+
+def _linear_weights(grid, points):
+    # indices and weights of a linear interpolation on an increasing grid, and mask of points inside the grid
+    index = numpy.clip(numpy.searchsorted(grid, points, side="right") - 1, 0, grid.size - 2)
+    weight = (points - grid[index]) / (grid[index + 1] - grid[index])
+    inside = (points >= grid[0]) & (points <= grid[-1])
+    return index, weight, inside
+
+def interpolate_regular_grid(xx, yy, zz, x, y):
+    # separable bilinear interpolation of zz (yy.size, xx.size) on the grid (y, x), zero outside
+    # (same result as interp2d(xx, yy, zz, kind='linear', bounds_error=False, fill_value=0)(x, y)).
+    # If the grids are the same, a copy of zz is returned (zz may be an entry of surface_cache).
+    if x.size == xx.size and y.size == yy.size and numpy.array_equal(x, xx) and numpy.array_equal(y, yy):
+        return zz.copy()
+
+    ix, wx, inside_x = _linear_weights(xx, x)
+    tmp = zz[:, ix] * (1 - wx) + zz[:, ix + 1] * wx
+    tmp[:, ~inside_x] = 0
+
+    iy, wy, inside_y = _linear_weights(yy, y)
+    out = tmp[iy, :] * (1 - wy)[:, numpy.newaxis] + tmp[iy + 1, :] * wy[:, numpy.newaxis]
+    out[~inside_y, :] = 0
+    return out
+
 # mimics a syned element
 class ThinObject(OpticalElement):
     def __init__(self,
@@ -59,27 +115,13 @@ class WOThinObject(ThinObject, OpticalElementDecorator):
 
     def get_refraction_index(self, photon_energy=10000.0):
 
-        wave_length = codata.h * codata.c / codata.e / photon_energy
-
         if self.get_material() == "External": # Be
              return self._refraction_index_delta, \
                     self._att_coefficient
 
-        if self.get_material() == "Be": # Be
-            element = "Be"
-            density = xraylib.ElementDensity(4)
-        elif self.get_material() == "Al": # Al
-            element = "Al"
-            density = xraylib.ElementDensity(13)
-        elif self.get_material() == "Diamond": # Diamond
-            element = "C"
-            density = 3.51
-        else:
-            raise Exception("Bad material: " + self.get_material())
-
-        refraction_index = xraylib.Refractive_Index(element, photon_energy/1000, density)
-        refraction_index_delta = 1 - refraction_index.real
-        att_coefficient = 4*numpy.pi * (xraylib.Refractive_Index(element, photon_energy/1000, density)).imag / wave_length
+        element, density = get_element_and_density(self.get_material())
+        refraction_index_delta, att_coefficient = \
+            material_constants_cache.get_delta_and_mu(element, density, photon_energy)
 
         # print("\n\n\n ==========  parameters recovered from xraylib : ")
         # print("Element: %s" % element)
@@ -91,14 +133,11 @@ class WOThinObject(ThinObject, OpticalElementDecorator):
         return refraction_index_delta, att_coefficient
 
     def get_surface_thickness_mesh(self, wavefront):
-        xx, yy, zz = read_surface_file(self.get_file_with_thickness_mesh())
-
-        if zz.min() < 0: zz -= zz.min()
+        xx, yy, zz = load_surface_file(self.get_file_with_thickness_mesh())
 
-        f = interp2d(xx, yy, zz, kind='linear', bounds_error=False, fill_value=0)
         x = wavefront.get_coordinate_x()
         y = wavefront.get_coordinate_y()
-        interpolated_profile = f(x, y)
+        interpolated_profile = interpolate_regular_grid(xx, yy, zz, x, y)
         return x, y, interpolated_profile
 
     def applyOpticalElement(self, wavefront, parameters=None, element_index=None):
@@ -162,38 +201,21 @@ class WOThinObject1D(ThinObject, OpticalElementDecorator):
         self._att_coefficient = att_coefficient
 
     def get_surface_thickness_mesh(self, wavefront):
-        a = numpy.loadtxt(self.get_file_with_thickness_mesh())
-        xx = a[:,0].copy()
-        zz = a[:,1].copy()
+        xx, zz = load_profile_file(self.get_file_with_thickness_mesh())
 
-        if zz.min() < 0: zz -= zz.min()
         x = wavefront.get_abscissas()
         interpolated_profile = numpy.interp(x, xx, zz)
         return x, interpolated_profile
 
     def get_refraction_index(self, photon_energy=10000.0):
 
-        wave_length = codata.h * codata.c / codata.e / photon_energy
-
         if self.get_material() == "External": # Be
              return self._refraction_index_delta, \
                     self._att_coefficient
 
-        if self.get_material() == "Be": # Be
-            element = "Be"
-            density = xraylib.ElementDensity(4)
-        elif self.get_material() == "Al": # Al
-            element = "Al"
-            density = xraylib.ElementDensity(13)
-        elif self.get_material() == "Diamond": # Diamond
-            element = "C"
-            density = 3.51
-        else:
-            raise Exception("Bad material: " + self.get_material())
-
-        refraction_index = xraylib.Refractive_Index(element, photon_energy/1000, density)
-        refraction_index_delta = 1 - refraction_index.real
-        att_coefficient = 4*numpy.pi * (xraylib.Refractive_Index(element, photon_energy/1000, density)).imag / wave_length
+        element, density = get_element_and_density(self.get_material())
+        refraction_index_delta, att_coefficient = \
+            material_constants_cache.get_delta_and_mu(element, density, photon_energy)
 
         if False:
             print("\n\n\n ==========  parameters recovered from xraylib : ")
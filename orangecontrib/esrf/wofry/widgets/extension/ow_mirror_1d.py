@@ -62,9 +62,12 @@ class OWMirror1D(OWWOOpticalElement1D):
     mirror_points = Setting(500)
     write_profile = Setting(0)
     write_input_wavefront = Setting(0)
+    propagation_method = Setting(0)
+    phase_tolerance = Setting(1e-3)
 
 
     input_data = None
+    optical_element = None # element of the last propagation, its memo is reused by the profile and footprint plots
     titles = ["Wavefront 1D Intensity", "Wavefront 1D Phase","Wavefront Real(Amplitude)","Wavefront Imag(Amplitude)","O.E. Profile"]
 
 
@@ -133,6 +136,7 @@ class OWMirror1D(OWWOOpticalElement1D):
         self.q_focus = congruence.checkNumber(self.q_focus, "q focus")
         self.error_file = congruence.checkFileName(self.error_file)
         self.error_file_oversampling_factor = congruence.checkStrictlyPositiveNumber(self.error_file_oversampling_factor)
+        self.phase_tolerance = congruence.checkStrictlyPositiveNumber(self.phase_tolerance, "Phase tolerance")
 
     def receive_syned_data(self):
         raise Exception(NotImplementedError)
@@ -194,7 +198,9 @@ class OWMirror1D(OWWOOpticalElement1D):
                     error_file_oversampling_factor=self.error_file_oversampling_factor,
                     mirror_length=mirror_length,
                     mirror_points=mirror_points,
-                    write_profile=self.write_profile)
+                    write_profile=self.write_profile,
+                    propagation_method=self.propagation_method,
+                    phase_tolerance=self.phase_tolerance)
 
 
     def propagate_wavefront(self):
@@ -215,6 +221,7 @@ class OWMirror1D(OWWOOpticalElement1D):
 
         optical_element = self.get_optical_element()
         optical_element.name = self.oe_name if not self.oe_name is None else self.windowTitle()
+        self.optical_element = optical_element
 
         beamline_element = BeamlineElement(optical_element=optical_element,
                                            coordinates=ElementCoordinates(p=0.0, # to avoid using standard propagators
@@ -256,10 +263,25 @@ class OWMirror1D(OWWOOpticalElement1D):
     # overwritten method for specific built-in propagator
     def create_propagation_setting_tab(self):
         self.tab_pro = oasysgui.createTabPage(self.tabs_setting, "Propagation Setting")
-        self.zoom_box = oasysgui.widgetBox(self.tab_pro, "", addSpace=False, orientation="vertical", height=90)
+        self.zoom_box = oasysgui.widgetBox(self.tab_pro, "", addSpace=False, orientation="vertical", height=120)
         oasysgui.lineEdit(self.zoom_box, self, "magnification_x", "Magnification Factor for interval",
                           labelWidth=260, valueType=float, orientation="horizontal")
 
+        gui.comboBox(self.zoom_box, self, "propagation_method", label="Integration method",
+                     items=["Direct sum (exact)", "Fast (interpolated envelope)",
+                            "Direct sum (blocked)", "Direct sum (blocked, single precision)"],
+                     callback=self.set_visible_propagation_method,
+                     sendSelectedValue=False, orientation="horizontal")
+
+        self.phase_tolerance_box = oasysgui.widgetBox(self.zoom_box, "", addSpace=False, orientation="vertical")
+        oasysgui.lineEdit(self.phase_tolerance_box, self, "phase_tolerance", "Phase tolerance [rad]",
+                          labelWidth=260, valueType=float, orientation="horizontal")
+
+        self.set_visible_propagation_method()
+
+    def set_visible_propagation_method(self):
+        self.phase_tolerance_box.setVisible(self.propagation_method == 1)
+
     # overwritten methods to append profile plot
     def get_titles(self):
         titles = super().get_titles()
@@ -275,7 +297,11 @@ class OWMirror1D(OWWOOpticalElement1D):
 
                 self.progressBarSet(progressBarValue)
 
-                x, y = self.get_optical_element().get_height_profile(self.input_data.get_wavefront())
+                # the element of the current settings, or the one of the last propagation (with its memo) if unchanged
+                optical_element = self.get_optical_element()
+                if optical_element.same_keywords(self.optical_element): optical_element = self.optical_element
+
+                x, y = optical_element.get_height_profile(self.input_data.get_wavefront())
                 self.plot_data1D(x=x,
                                  y=1e6*y,
                                  progressBarValue=progressBarValue + 10,
@@ -287,7 +313,7 @@ class OWMirror1D(OWWOOpticalElement1D):
                                  ytitle="Profile Height [$\mu$m]")
 
 
-                x, y, amplitude = self.get_optical_element().get_footprint(self.input_data.get_wavefront())
+                x, y, amplitude = optical_element.get_footprint(self.input_data.get_wavefront())
                 self.plot_data1D(x=x,
                                  y=numpy.abs(amplitude)**2,
                                  progressBarValue=progressBarValue + 10,
@@ -37,7 +37,13 @@ from orangecontrib.wofry.widgets.gui.ow_wofry_widget import WofryWidget
 #################
 
 from orangecontrib.wofry.widgets.gui.ow_wofry_widget import WofryWidget
-from oasys.util.oasys_util import get_fwhm
+from orangecontrib.esrf.wofry.util.profile_metrics import get_profiles_metrics
+from orangecontrib.esrf.wofry.util.distance_scan import propagate_to_distances, get_intensities, DistanceScanH5Writer
+
+class _AdditionalParameters(dict):
+    # collects the additional parameters set by OWWOOpticalElement1D.set_additional_parameters
+    def set_additional_parameters(self, key, value):
+        self[key] = value
 
 class OWWOScanningScreen1D(OWWOOpticalElement1D):
 
@@ -52,6 +58,9 @@ class OWWOScanningScreen1D(OWWOOpticalElement1D):
     q_points = Setting(2)
     file_flag = Setting(0)
     file_name = Setting("tmp.h5")
+    file_format = Setting(0)
+    scan_mode = Setting(0)
+    number_of_threads = Setting(4)
 
     def __init__(self,is_automatic=True, show_view_options=True, show_script_tab=True):
         WofryWidget.__init__(self,is_automatic=is_automatic, show_view_options=show_view_options, show_script_tab=show_script_tab)
@@ -110,16 +119,32 @@ class OWWOScanningScreen1D(OWWOOpticalElement1D):
                      callback=self.set_file_flag,
                      sendSelectedValue=False, orientation="horizontal")
 
-        self.file_box = oasysgui.widgetBox(self.coordinates_box, "", addSpace=False, orientation="horizontal")
+        self.file_box = oasysgui.widgetBox(self.coordinates_box, "", addSpace=False, orientation="vertical")
         tmp = oasysgui.lineEdit(self.file_box, self, "file_name", "File name [.h5]", labelWidth=280, valueType=int, orientation="horizontal")
         tmp.setToolTip("file_name")
+        gui.comboBox(self.file_box, self, "file_format", label="File format", labelWidth=150,
+                     items=["Wavefronts + scan image", "Single pass (scan only)"],
+                     sendSelectedValue=False, orientation="horizontal")
+
+
+        gui.comboBox(self.coordinates_box, self, "scan_mode", label="Scan mode", labelWidth=200,
+                     items=["Serial (widget propagation)", "Headless (parallel)"],
+                     callback=self.set_scan_mode,
+                     sendSelectedValue=False, orientation="horizontal")
 
+        self.threads_box = oasysgui.widgetBox(self.coordinates_box, "", addSpace=False, orientation="horizontal")
+        tmp = oasysgui.lineEdit(self.threads_box, self, "number_of_threads", "Number of threads", labelWidth=280, valueType=int, orientation="horizontal")
+        tmp.setToolTip("number_of_threads")
 
         self.draw_specific_box()
 
         self.create_propagation_setting_tab()
 
         self.set_file_flag()
+        self.set_scan_mode()
+
+    def set_scan_mode(self):
+        self.threads_box.setVisible(self.scan_mode == 1)
 
     def set_file_flag(self):
         self.file_box.setVisible(self.file_flag == 0)
@@ -132,6 +157,11 @@ class OWWOScanningScreen1D(OWWOOpticalElement1D):
         if not isinstance(optical_element, Screen):
             raise Exception("Syned Data not correct: Optical Element is not a Screen")
 
+    def check_data(self):
+        super().check_data()
+        if self.scan_mode == 1:
+            self.number_of_threads = congruence.checkStrictlyPositiveNumber(self.number_of_threads, "Number of threads")
+
     def propagate_wavefront(self):
 
         qs = numpy.linspace(self.q_min, self.q_max, self.q_points)
@@ -139,52 +169,47 @@ class OWWOScanningScreen1D(OWWOOpticalElement1D):
         view_type_old = self.view_type
         self.view_type = 0
 
-        wavefronts = []
-        peak = numpy.zeros(self.q_points)
-        fwhm = numpy.zeros(self.q_points)
-        integral = numpy.zeros(self.q_points)
-
-        for i,q in enumerate(qs):
-            self.q = q
-            super().propagate_wavefront()
-            wavefronts.append(self.wavefront_to_plot)
-            if i == 0:
-                intensities = numpy.zeros((self.q_points,self.wavefront_to_plot.get_abscissas().size))
-                x = self.wavefront_to_plot.get_abscissas()
-
-            active_profile = self.wavefront_to_plot.get_intensity()
-
-            intensities[i,:] = active_profile
-
-            peak[i] = numpy.max(active_profile)
-            try:
-                fwhm[i], _, _ = get_fwhm(active_profile, x)
-                print("fwhm: ", i, fwhm[i])
-            except:
-                fwhm[i] = 0.0
-                print("bad fwhm: ", i, fwhm[i])
-
-        if self.file_flag:
-            from srxraylib.util.h5_simple_writer import H5SimpleWriter
-            h5w = H5SimpleWriter.initialize_file(self.file_name, overwrite=1)
-            for i, q in enumerate(qs):
-                if i == 0:
-                    # from srxraylib.util.h5_simple_writer import H5SimpleWriter
-                    # h5w = H5SimpleWriter.initialize_file(self.file_name, creator="h5_basic_writer.py")
-
-
-                    wavefronts[i].save_h5_file(self.file_name, subgroupname="wfr%03d" % i,
-                                                        intensity=True, phase=False, overwrite=True, verbose=False)
+        h5w = None # single pass writer (file_format=1)
+
+        try:
+            if self.scan_mode == 1:
+                wavefronts = self.propagate_headless(qs)
+            else:
+                wavefronts = []
+                for i,q in enumerate(qs):
+                    self.q = q
+                    super().propagate_wavefront()
+                    wavefronts.append(self.wavefront_to_plot)
+                    if self.file_flag and self.file_format == 1: # rows are written as they are calculated
+                        if h5w is None:
+                            h5w = DistanceScanH5Writer(self.file_name, self.wavefront_to_plot.get_abscissas(),
+                                                       number_of_distances=len(qs))
+                        h5w.append(q, self.wavefront_to_plot)
+
+            intensities = get_intensities(wavefronts)
+            x = wavefronts[0].get_abscissas()
+
+            metrics = get_profiles_metrics(intensities, x)
+            peak = metrics["peak"]
+            fwhm = metrics["fwhm"]
+
+            if self.file_flag:
+                if self.file_format == 0:
+                    self.write_file(qs, wavefronts, intensities, x, peak, fwhm)
                 else:
-                    wavefronts[i].save_h5_file(self.file_name, subgroupname="wfr%03d" % i,
-                                                            intensity=True, phase=False, overwrite=False, verbose=False)
-
-
-            h5w.add_dataset(qs, peak, dataset_name="peak", entry_name=None, title_x="q [m]", title_y="peak")
-            h5w.add_dataset(qs, fwhm*1e6, dataset_name="fwhm", entry_name=None, title_x="q [m]", title_y="fwhm [$\mu$m]")
-            h5w.add_image(intensities, image_x=qs,image_y=x*1e6,image_name="scan",entry_name=None,title_x="q [m]",
-                          title_y="Spatial Coordinate [$\mu$m]")
-            print("\nFile %s written to disk." % self.file_name)
+                    if h5w is None:
+                        h5w = DistanceScanH5Writer(self.file_name, x, number_of_distances=len(qs))
+                        h5w.append_all(qs, wavefronts)
+                    h5w.add_dataset("peak", peak, title="peak")
+                    h5w.add_dataset("fwhm", fwhm*1e6, title="fwhm [$\mu$m]")
+        except Exception as exception:
+            self.view_type = view_type_old
+            QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
+
+            if self.IS_DEVELOP: raise exception
+            return
+        finally:
+            if h5w is not None: h5w.close()
 
         print("\nNumber of wavefronts generated: ", len(wavefronts))
 
@@ -225,6 +250,90 @@ class OWWOScanningScreen1D(OWWOOpticalElement1D):
                              )
             self.progressBarFinished()
 
+    def propagate_headless(self, qs):
+        # all the distances in one call (see distance_scan.propagate_to_distances). The output, plots and script are
+        # those of the screen at the last distance, taken from the scan result
+        self.progressBarInit()
+        self.wofry_output.setText("")
+        sys.stdout = EmittingStream(textWritten=self.writeStdOut)
+
+        try:
+            if self.input_data is None: raise Exception("No Input Data")
+            self.check_data()
+
+            wavefronts = propagate_to_distances(self.input_data.get_wavefront(), qs, p=self.p,
+                                                handler_name=self.get_handler_name(),
+                                                additional_parameters=self.get_additional_parameters_dictionary(),
+                                                number_of_threads=self.number_of_threads,
+                                                name=self.oe_name)
+            self.q = qs[-1]
+            self.send_wavefront(wavefronts[-1])
+        finally:
+            self.progressBarFinished()
+
+        return wavefronts
+
+    def send_wavefront(self, output_wavefront):
+        # same output and script as OWWOOpticalElement1D.propagate_wavefront, for an already propagated wavefront
+        beamline = self.input_data.get_beamline().duplicate()
+
+        optical_element = self.get_optical_element()
+        optical_element.name = self.oe_name if not self.oe_name is None else self.windowTitle()
+
+        beamline_element = BeamlineElement(optical_element=optical_element,
+                                           coordinates=ElementCoordinates(p=self.p,
+                                                                          q=self.q,
+                                                                          angle_radial=numpy.radians(self.angle_radial),
+                                                                          angle_azimuthal=numpy.radians(self.angle_azimuthal)))
+
+        additional_parameters = self.get_additional_parameters_dictionary()
+        propagator_info = {
+            "propagator_class_name": self.get_propagator_class_name(),
+            "propagator_handler_name": self.get_handler_name(),
+            "propagator_additional_parameters_names": list(additional_parameters.keys()),
+            "propagator_additional_parameters_values": list(additional_parameters.values())}
+
+        beamline.append_beamline_element(beamline_element, propagator_info)
+
+        self.wavefront_to_plot = output_wavefront
+
+        self.send("WofryData", WofryData(beamline=beamline, wavefront=output_wavefront))
+        self.send("Trigger", TriggerIn(new_object=True))
+
+        self.wofry_python_script.set_code(beamline.to_python_code())
+
+    def write_file(self, qs, wavefronts, intensities, x, peak, fwhm):
+        # the wavefronts (wofry groups wfr000, wfr001...), the peak and fwhm, and the NXdata image "scan"
+        from srxraylib.util.h5_simple_writer import H5SimpleWriter
+        h5w = H5SimpleWriter.initialize_file(self.file_name, overwrite=1)
+        for i, q in enumerate(qs):
+            if i == 0:
+                wavefronts[i].save_h5_file(self.file_name, subgroupname="wfr%03d" % i,
+                                           intensity=True, phase=False, overwrite=True, verbose=False)
+            else:
+                wavefronts[i].save_h5_file(self.file_name, subgroupname="wfr%03d" % i,
+                                           intensity=True, phase=False, overwrite=False, verbose=False)
+
+        h5w.add_dataset(qs, peak, dataset_name="peak", entry_name=None, title_x="q [m]", title_y="peak")
+        h5w.add_dataset(qs, fwhm*1e6, dataset_name="fwhm", entry_name=None, title_x="q [m]", title_y="fwhm [$\mu$m]")
+        h5w.add_image(intensities, image_x=qs,image_y=x*1e6,image_name="scan",entry_name=None,title_x="q [m]",
+                      title_y="Spatial Coordinate [$\mu$m]")
+        print("\nFile %s written to disk." % self.file_name)
+
+    def get_propagator_class_name(self):
+        # the class of the propagator with the handler selected by the base class
+        handler_name = self.get_handler_name()
+        for propagator_class in [Fresnel1D, FresnelConvolution1D, Fraunhofer1D, Integral1D, FresnelZoom1D,
+                                 FresnelZoomScaling1D]:
+            if propagator_class.HANDLER_NAME == handler_name: return propagator_class.__name__
+        raise Exception("No propagator with handler name %s" % handler_name)
+
+    def get_additional_parameters_dictionary(self):
+        # the additional parameters that the base class sets for the selected propagator
+        additional_parameters = _AdditionalParameters()
+        self.set_additional_parameters(additional_parameters)
+        return dict(additional_parameters)
+
     def initializeTabs(self):
         super().initializeTabs()
 
@@ -20,7 +20,7 @@ from orangewidget.settings import Setting
 
 from oasys.util.oasys_util import TriggerIn, TriggerOut, EmittingStream
 
-from oasys.util.oasys_util import get_fwhm
+from orangecontrib.esrf.wofry.util.profile_metrics import get_profiles_metrics
 
 class OWstepper1D(WofryWidget):
 
@@ -69,6 +69,7 @@ class OWstepper1D(WofryWidget):
     #
     wofry_data = None
     accumulated_data = None
+    plotted_layout = None # (view type, number of points) of the plots drawn by do_plot_results, None if not drawn
 
     titles = ["Intensity (current/last run)","Intensity (accumulated)",
               "Scanned peak", "Scanned FWHM", "Scanned Integral", "Scans"]
@@ -228,6 +229,8 @@ class OWstepper1D(WofryWidget):
             self.progressBarFinished
 
     def initializeTabs(self):
+        self.plotted_layout = None
+
         size = len(self.titles) # len(self.tab)
         indexes = range(0, size)
 
@@ -251,42 +254,56 @@ class OWstepper1D(WofryWidget):
         if not wofry_data is None:
             self.wofry_data = wofry_data
 
-            if self.accumulated_data is None:
-                self.accumulated_data = {}
-                self.accumulated_data["counter"] = 1
-                self.accumulated_data["intensity"] = self.wofry_data.get_wavefront().get_intensity()
-
-                intensities = []
-                intensities.append( self.wofry_data.get_wavefront().get_intensity() )
-                self.accumulated_data["intensities"] = intensities
-
-                current_variable_values = []
-                current_variable_values.append(self.current_variable_value)
-                self.accumulated_data["current_variable_values"] = current_variable_values
-
-                self.accumulated_data["complex_amplitude"] = self.wofry_data.get_wavefront().get_complex_amplitude()
-
-                self.accumulated_data["x"] = self.wofry_data.get_wavefront().get_abscissas()
-
-            else:
-                self.accumulated_data["counter"] += 1
-                self.accumulated_data["intensity"] = self.wofry_data.get_wavefront().get_intensity()
-
-                intensities = self.accumulated_data["intensities"]
-                intensities.append( self.wofry_data.get_wavefront().get_intensity() )
-                self.accumulated_data["intensities"] = intensities
-
-                current_variable_values = self.accumulated_data["current_variable_values"]
-                current_variable_values.append(self.current_variable_value)
-                self.accumulated_data["current_variable_values"] = current_variable_values
-
-                self.accumulated_data["complex_amplitude"] += self.wofry_data.get_wavefront().get_complex_amplitude()
-
+            self.append_run(self.wofry_data.get_wavefront())
 
             self.refresh()
             #NEWNEWNEW
             self.passTrigger(TriggerIn(new_object=True))
 
+    #
+    # running accumulators, updated once per new run: the scans (current and accumulated) are stored in
+    # preallocated arrays (grown by doubling) and the metrics of the new run are appended to lists.
+    # "intensities" and "accumulated_intensities" are buffers, only the first "counter" rows are valid.
+    #
+    def append_run(self, wavefront):
+        intensity = wavefront.get_intensity()
+
+        if self.accumulated_data is None:
+            self.accumulated_data = {}
+            self.accumulated_data["counter"] = 0
+            self.accumulated_data["x"] = wavefront.get_abscissas()
+            self.accumulated_data["complex_amplitude"] = numpy.zeros(intensity.size, dtype=complex)
+            self.accumulated_data["accumulated_intensity"] = numpy.zeros(intensity.size)
+            self.accumulated_data["intensities"] = numpy.zeros((16, intensity.size))
+            self.accumulated_data["accumulated_intensities"] = numpy.zeros((16, intensity.size))
+            self.accumulated_data["current_variable_values"] = []
+            for key in ["peak", "fwhm", "integral", "accumulated_peak", "accumulated_fwhm", "accumulated_integral"]:
+                self.accumulated_data[key] = []
+
+        data = self.accumulated_data
+        i = data["counter"]
+
+        if i >= data["intensities"].shape[0]:
+            data["intensities"] = numpy.concatenate((data["intensities"], numpy.zeros_like(data["intensities"])))
+            data["accumulated_intensities"] = numpy.concatenate((data["accumulated_intensities"],
+                                                                 numpy.zeros_like(data["accumulated_intensities"])))
+
+        data["counter"] = i + 1
+        data["intensity"] = intensity
+        data["accumulated_intensity"] += intensity
+        data["complex_amplitude"] += wavefront.get_complex_amplitude()
+        data["intensities"][i, :] = intensity
+        data["accumulated_intensities"][i, :] = data["accumulated_intensity"]
+        data["current_variable_values"].append(self.current_variable_value)
+
+        metrics = get_profiles_metrics(numpy.array([intensity, data["accumulated_intensity"]]), data["x"])
+        data["peak"].append(metrics["peak"][0])
+        data["fwhm"].append(metrics["fwhm"][0])
+        data["integral"].append(intensity.sum())
+        data["accumulated_peak"].append(metrics["peak"][1])
+        data["accumulated_fwhm"].append(metrics["fwhm"][1])
+        data["accumulated_integral"].append(data["accumulated_intensity"].sum())
+
     def refresh(self):
 
         self.wofry_output.setText("")
@@ -298,15 +315,41 @@ class OWstepper1D(WofryWidget):
 
                 if self.view_type != 0:
                     self.progressBarInit()
-                    current_index = self.tabs.currentIndex()
-                    self.initializeTabs()
-                    self.plot_results()
-                    self.tabs.setCurrentIndex(current_index)
+                    if self.plotted_layout == (self.view_type, self.accumulated_data["x"].size):
+                        self.update_plots()
+                    else:
+                        current_index = self.tabs.currentIndex()
+                        self.initializeTabs()
+                        self.plot_results()
+                        self.tabs.setCurrentIndex(current_index)
                     self.progressBarFinished()
         except Exception as exception:
             QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
 
 
+    def get_scanned_data(self):
+        # scanned variable, scans (runs x points), peak, fwhm, integral and accumulated profile, as displayed
+        try:
+            nruns = self.accumulated_data["counter"]
+
+            if nruns == 1:
+                x = numpy.arange(nruns)
+            else:
+                x = numpy.array(self.accumulated_data["current_variable_values"])
+
+            prefix = "accumulated_" if self.accumulate_flag == 1 else ""
+            all_scans = self.accumulated_data[prefix + "intensities"][0:nruns]
+            peak = numpy.array(self.accumulated_data[prefix + "peak"])
+            fwhm = numpy.array(self.accumulated_data[prefix + "fwhm"])
+            integral = numpy.array(self.accumulated_data[prefix + "integral"])
+            accumulated_profile = self.accumulated_data["accumulated_intensity"]
+        except:
+            x = numpy.array([-2,-1])
+            peak = numpy.array([-1, -1])
+            fwhm = numpy.array([-1, -1])
+
+        return x, all_scans, peak, fwhm, integral, accumulated_profile
+
     def do_plot_results(self, progressBarValue=50):
         if self.accumulated_data is None:
             return
@@ -324,44 +367,8 @@ class OWstepper1D(WofryWidget):
                              xtitle="Spatial Coordinate [$\mu$m]",
                              ytitle="Intensity")
 
-            try:
-                nruns = len(self.accumulated_data['intensities'])
-
-                if nruns == 1:
-                    x = numpy.arange(nruns)
-                else:
-                    x = numpy.array(self.accumulated_data["current_variable_values"])
-
-                peak = numpy.zeros(nruns)
-                fwhm = numpy.zeros(nruns)
-                integral = numpy.zeros(nruns)
-                all_scans = numpy.zeros((nruns, len(self.accumulated_data['intensities'][0])))
-                for i in range(nruns):
-                    current_profile = self.accumulated_data['intensities'][i]
-                    if i == 0:
-                        accumulated_profile = current_profile.copy()
-                    else:
-                        accumulated_profile += current_profile
-
-
-                    if self.accumulate_flag == 0:
-                        active_profile = current_profile
-                    elif self.accumulate_flag == 1:
-                        active_profile = accumulated_profile
-
-                    peak[i] = numpy.max(active_profile)
-                    try:
-                        fwhm[i], _, _ = get_fwhm(active_profile, self.accumulated_data['x'] )
-                        print("fwhm: ", i, fwhm[i])
-                    except:
-                        fwhm[i] = 0.0
-                        print("bad fwhm: ",i,fwhm[i])
-                    integral[i] = (active_profile).sum()
-                    all_scans[i, :] = active_profile
-            except:
-                x = numpy.array([-2,-1])
-                peak = numpy.array([-1, -1])
-                fwhm = numpy.array([-1, -1])
+            nruns = self.accumulated_data["counter"]
+            x, all_scans, peak, fwhm, integral, accumulated_profile = self.get_scanned_data()
 
             self.plot_data1D(x=1e6*self.accumulated_data["x"],
                              y=accumulated_profile,
@@ -389,7 +396,7 @@ class OWstepper1D(WofryWidget):
                              tabs_canvas_index=3,
                              plot_canvas_index=3,
                              calculate_fwhm=False,
-                             title="%s nruns: %s" % (self.titles[3] , len(self.accumulated_data["intensities"])),
+                             title="%s nruns: %s" % (self.titles[3] , self.accumulated_data["counter"]),
                              xtitle="%s [%s]" % (self.variable_display_name, self.variable_um),
                              ytitle="FWHM [um]")
 
@@ -399,7 +406,7 @@ class OWstepper1D(WofryWidget):
                              tabs_canvas_index=4,
                              plot_canvas_index=4,
                              calculate_fwhm=False,
-                             title="%s nruns: %s" % (self.titles[4] , len(self.accumulated_data["intensities"])),
+                             title="%s nruns: %s" % (self.titles[4] , self.accumulated_data["counter"]),
                              xtitle="%s [%s]" % (self.variable_display_name, self.variable_um),
                              ytitle="Integral [a.u.]")
 
@@ -408,10 +415,12 @@ class OWstepper1D(WofryWidget):
                                  progressBarValue=progressBarValue + 5,
                                  tabs_canvas_index=5,
                                  plot_canvas_index=5,
-                                 title="%s nruns: %s" % (self.titles[5] , len(self.accumulated_data["intensities"])),
+                                 title="%s nruns: %s" % (self.titles[5] , self.accumulated_data["counter"]),
                                  xtitle="%s [%s]" % (self.variable_display_name, self.variable_um),
                                  ytitle="Spatial Coordinate [$\mu$m]",)
 
+            self.plotted_layout = (self.view_type, self.accumulated_data["x"].size)
+
             print("> current value: ",self.current_variable_value)
             print("> current valueSS: ", self.accumulated_data["current_variable_values"])
             print("> current new object: ",self.current_new_object)
@@ -420,8 +429,62 @@ class OWstepper1D(WofryWidget):
             print("> self.current_variable_value = ",self.current_variable_value)
             print("> self.variable_um = ",self.variable_um)
 
+    #
+    # in place update of the plots drawn by do_plot_results with the same view type and number of points: the data
+    # of the existing curves and image are replaced, without creating new tabs or plot windows
+    #
+    def update_plots(self, progressBarValue=50):
+        self.progressBarSet(progressBarValue)
+
+        nruns = self.accumulated_data["counter"]
+        x, all_scans, peak, fwhm, integral, accumulated_profile = self.get_scanned_data()
+        abscissas = 1e6*self.accumulated_data["x"]
+
+        self.update_curve(0, abscissas, self.accumulated_data["intensity"], self.titles[0], calculate_fwhm=True)
+        self.update_curve(1, abscissas, accumulated_profile, self.titles[1], calculate_fwhm=True)
+        for index, y in ((2, peak), (3, 1e6*fwhm), (4, integral)):
+            self.update_curve(index, x, y, "%s nruns: %s" % (self.titles[index], nruns))
+
+        self.progressBarSet(progressBarValue + 25)
+
+        if nruns > 1:
+            title = "%s nruns: %s" % (self.titles[5] , nruns)
+            if self.view_type == 1 and not self.plot_canvas[5] is None:
+                origin = (x[0], abscissas[0])
+                scale = (abs((x[-1] - x[0]) / len(x)), abs((abscissas[-1] - abscissas[0]) / len(abscissas)))
+                colormap = {"name":"temperature", "normalization":"linear", "autoscale":True, "vmin":0, "vmax":0, "colors":256}
+                self.plot_canvas[5].addImage(all_scans.T, legend="None", scale=scale, origin=origin,
+                                             colormap=colormap, replace=True)
+                self.plot_canvas[5].setGraphTitle(title)
+            else: # first image, or image with histograms (redrawn)
+                self.plot_data2D(all_scans, x, abscissas,
+                                 progressBarValue=progressBarValue + 40,
+                                 tabs_canvas_index=5,
+                                 plot_canvas_index=5,
+                                 title=title,
+                                 xtitle="%s [%s]" % (self.variable_display_name, self.variable_um),
+                                 ytitle="Spatial Coordinate [$\mu$m]",)
+
+    def update_curve(self, plot_canvas_index, x, y, title, calculate_fwhm=False):
+        plot_canvas = self.plot_canvas[plot_canvas_index]
 
+        plot_canvas.getAllCurves()[0].setData(x, y)
+        plot_canvas.setGraphTitle(title)
+
+        # same FWHM markers as plot_data1D (replaced, as they have the same legends)
+        if calculate_fwhm:
+            try:
+                t = numpy.where(y>=max(y)*0.5)
+                x_left,x_right =  x[t[0][0]], x[t[0][-1]]
+
+                plot_canvas.addMarker(x_left, 0.5*y.max(), legend="G1", text="FWHM=%5.2f"%(numpy.abs(x_right-x_left)),
+                                      color="pink",selectable=False, draggable=False, symbol="+", constraint=None)
+                plot_canvas.addMarker(x_right, 0.5*y.max(), legend="G2", text=None, color="pink",
+                                      selectable=False, draggable=False, symbol="+", constraint=None)
+            except:
+                pass
 
+        plot_canvas.resetZoom()
 
     def reset_accumumation(self):
         self.initializeTabs()
@@ -0,0 +1,160 @@
+import numpy
+import scipy.constants as codata
+
+from orangecontrib.esrf.xoppy.util.material_constants_cache import get_material_constants
+
+#
+# Search of the attenuator combinations (one filter per axis) that meet a target in transmitted power, absorbed
+# power or transmitted flux.
+#
+# The log-transmission of every filter is calculated once on the energy grid (same attenuation as the filters
+# of xoppy_calc_power, with the cross sections taken from the shared material constants cache). The axes are
+# split in two groups, and all the combinations of each group are built by adding the log-transmissions. As the
+# transmission of a combination is the product of the transmissions of the two groups, the transmitted power
+# (or flux) of all the combinations is a single matrix product:
+#
+#     value[i, j] = sum_e weight[e] * T_first[i, e] * T_second[j, e]
+#
+# Since the transmissions are <= 1, a partial combination with a value already below the lower bound cannot
+# meet the target whatever the filters added later, so it is discarded while the groups are built.
+#
+
+TRANSMITTED_POWER = 0
+ABSORBED_POWER = 1
+TRANSMITTED_FLUX = 2
+
+QUANTITY_NAMES = ["Transmitted power [W]", "Absorbed power [W]", "Transmitted flux [ph/s]"]
+
+def get_filter_log_transmission(energies, substance, thickness, density, material_constants_library):
+    # thickness in mm, density in g/cm3 ("?" for the element density)
+    energies = numpy.asarray(energies, dtype=float)
+    if thickness == 0.0: return numpy.zeros_like(energies)
+
+    if isinstance(density, str):
+        if density.strip() == "?":
+            density = material_constants_library.ElementDensity(material_constants_library.SymbolToAtomicNumber(substance))
+        density = float(density)
+
+    mu = get_material_constants(material_constants_library, "CS_Total_CP", substance, energies / 1000.0)
+    return -mu * density * thickness * 0.1
+
+def get_axes_log_transmission(energies, axes, material_constants_library):
+    # axes: list (axes) of lists (filters of the axis) of lists of layers (substance, thickness [mm], density)
+    # returns the list (axes) of arrays (filters x energies) with the log-transmission of each filter
+    cache = {}
+    out = []
+    for axis in axes:
+        log_transmission = numpy.zeros((len(axis), len(energies)))
+        for i, layers in enumerate(axis):
+            for layer in layers:
+                if layer not in cache:
+                    cache[layer] = get_filter_log_transmission(energies, *layer,
+                                                               material_constants_library=material_constants_library)
+                log_transmission[i] += cache[layer]
+        out.append(log_transmission)
+    return out
+
+def _integration_weights(energies, source, quantity):
+    # weights of the trapezoidal integration over the energy grid
+    energies = numpy.asarray(energies, dtype=float)
+    step = numpy.diff(energies)
+    weights = numpy.zeros_like(energies)
+    weights[:-1] += 0.5 * step
+    weights[1:] += 0.5 * step
+    weights *= numpy.asarray(source, dtype=float)
+    if quantity == TRANSMITTED_FLUX: weights /= energies * codata.e # W/eV -> ph/s/eV
+    return weights
+
+def _combine_axes(axes_log_transmission, weights, minimum):
+    # all the (not pruned) combinations of the axes: indices (combinations x axes) and transmissions
+    indices = numpy.zeros((1, 0), dtype=int)
+    log_transmission = numpy.zeros((1, weights.size))
+    for axis in axes_log_transmission:
+        n = axis.shape[0]
+        indices = numpy.hstack((numpy.repeat(indices, n, axis=0), numpy.tile(numpy.arange(n), indices.shape[0])[:, numpy.newaxis]))
+        log_transmission = (log_transmission[:, numpy.newaxis, :] + axis[numpy.newaxis, :, :]).reshape((-1, weights.size))
+        good = numpy.dot(numpy.exp(log_transmission), weights) >= minimum
+        indices, log_transmission = indices[good], log_transmission[good]
+    return indices, numpy.exp(log_transmission)
+
+def find_attenuator_combinations(energies, source, axes_log_transmission, quantity=TRANSMITTED_POWER,
+                                 minimum=None, maximum=None, max_results=20, max_elements=2**24):
+    # energies [eV], source [W/eV], axes_log_transmission as given by get_axes_log_transmission
+    # quantity: TRANSMITTED_POWER, ABSORBED_POWER or TRANSMITTED_FLUX, with minimum and maximum in its units (None = no limit)
+    # returns the list (up to max_results) of the combinations meeting the target, the least attenuating first, as
+    # dictionaries with the filter index for each axis ("indices"), the "value" of the quantity and the "transmitted"
+    # power (or flux)
+    weights = _integration_weights(energies, source, quantity)
+    incident = weights.sum()
+
+    # everything is calculated for the transmitted power (or flux)
+    minimum = -numpy.inf if minimum is None else minimum
+    maximum = numpy.inf if maximum is None else maximum
+    if quantity == ABSORBED_POWER:
+        t_minimum, t_maximum = incident - maximum, incident - minimum
+    else:
+        t_minimum, t_maximum = minimum, maximum
+
+    naxes = len(axes_log_transmission)
+    if naxes == 0: raise Exception("No attenuator axes")
+    first_indices, first = _combine_axes(axes_log_transmission[:(naxes + 1) // 2], weights, t_minimum)
+    second_indices, second = _combine_axes(axes_log_transmission[(naxes + 1) // 2:], weights, t_minimum)
+
+    best_values = numpy.zeros(0)
+    best_i = numpy.zeros(0, dtype=int)
+    best_j = numpy.zeros(0, dtype=int)
+    weighted_second = (second * weights).T
+    chunk = max(1, max_elements // max(1, second.shape[0]))
+    for i0 in range(0, first.shape[0], chunk):
+        values = numpy.dot(first[i0:i0+chunk], weighted_second)
+        i, j = numpy.nonzero((values >= t_minimum) & (values <= t_maximum))
+        best_values = numpy.concatenate((best_values, values[i, j]))
+        best_i = numpy.concatenate((best_i, i + i0))
+        best_j = numpy.concatenate((best_j, j))
+        if best_values.size > max_results:
+            keep = numpy.argpartition(-best_values, max_results)[:max_results]
+            best_values, best_i, best_j = best_values[keep], best_i[keep], best_j[keep]
+
+    out = []
+    for k in numpy.argsort(-best_values, kind="stable"):
+        transmitted = best_values[k]
+        out.append({"indices": tuple(first_indices[best_i[k]].tolist() + second_indices[best_j[k]].tolist()),
+                    "value": incident - transmitted if quantity == ABSORBED_POWER else transmitted,
+                    "transmitted": transmitted,
+                    })
+    return out
+
+def format_attenuator_combinations(combinations, filter_names=None, quantity=TRANSMITTED_POWER):
+    # filter_names: list (axes) of lists with the names of the filters
+    txt = "\n%d combinations found (%s):\n" % (len(combinations), QUANTITY_NAMES[quantity])
+    for k, combination in enumerate(combinations):
+        if filter_names is None:
+            names = ["%d" % index for index in combination["indices"]]
+        else:
+            names = [filter_names[axis][index] for axis, index in enumerate(combination["indices"])]
+        txt += "  %3d  %12.6g  %s\n" % (k + 1, combination["value"], " | ".join(names))
+    return txt
+
+
+if __name__ == "__main__":
+    import time
+    import xraylib
+
+    energies = numpy.linspace(1000.0, 100000.0, 500)
+    source = 1e-3 * numpy.exp(-energies / 30000.0) # W/eV
+
+    # 10 axes of 4 filters each
+    substances = [("C", 3.52), ("Al", 2.7), ("Cu", 8.96), ("Mo", 10.2), ("W", 19.3)]
+    axes = []
+    for i in range(10):
+        substance, density = substances[i % len(substances)]
+        axes.append([[(substance, thickness, density)] for thickness in [0.0, 0.1 * (i + 1), 0.2 * (i + 1), 0.5 * (i + 1)]])
+
+    t0 = time.time()
+    axes_log_transmission = get_axes_log_transmission(energies, axes, xraylib)
+    t1 = time.time()
+    combinations = find_attenuator_combinations(energies, source, axes_log_transmission, quantity=TRANSMITTED_POWER,
+                                                minimum=1.0, maximum=5.0, max_results=10)
+    t2 = time.time()
+    print(format_attenuator_combinations(combinations, quantity=TRANSMITTED_POWER))
+    print("log-transmission: %.3f s, %d combinations: %.3f s" % (t1 - t0, 4 ** 10, t2 - t1))
@@ -0,0 +1,276 @@
+import numpy
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+#
+# Reflectivity versus photon energy of Si crystal monochromators (crystalpy), at a fixed crystal angle (the Bragg
+# angle at the setup energy), summed over the odd harmonics.
+#
+# The DiffractionSetupXraylib and Diffraction objects are created once per harmonic (not per energy), the energies
+# can be distributed in chunks over a pool of processes, and the resulting curves are kept in a LRU cache keyed by
+# the crystal configuration and the energy grid.
+#
+
+BRAGG = 0
+LAUE = 1
+
+_reflectivity_cache = OrderedDict()
+_reflectivity_cache_max_size = 32
+
+def _diffraction_setup(geometry, h_miller, k_miller, l_miller, thickness):
+    from crystalpy.diffraction.GeometryType import BraggDiffraction, LaueDiffraction
+    from crystalpy.diffraction.DiffractionSetupXraylib import DiffractionSetupXraylib
+
+    if geometry == BRAGG:
+        return DiffractionSetupXraylib(geometry_type=BraggDiffraction(),
+                                       crystal_name="Si",
+                                       thickness=1,            # meters
+                                       miller_h=h_miller,
+                                       miller_k=k_miller,
+                                       miller_l=l_miller,
+                                       asymmetry_angle=0,      # radians
+                                       azimuthal_angle=0.0)    # radians
+    else:
+        return DiffractionSetupXraylib(geometry_type=LaueDiffraction(),
+                                       crystal_name="Si",
+                                       thickness=thickness,    # meters
+                                       miller_h=h_miller,
+                                       miller_k=k_miller,
+                                       miller_l=l_miller,
+                                       asymmetry_angle=numpy.pi/2,
+                                       azimuthal_angle=0)
+
+def _calculate_harmonic(arguments):
+    # |S|**power for the energies, with one diffraction setup (module function, to be used by the process pool)
+    energies, geometry, h_miller, k_miller, l_miller, thickness, bragg_angle, method, power = arguments
+
+    from crystalpy.diffraction.Diffraction import Diffraction
+    from crystalpy.util.Vector import Vector
+    from crystalpy.util.Photon import Photon
+
+    diffraction_setup = _diffraction_setup(geometry, h_miller, k_miller, l_miller, thickness)
+    diffraction = Diffraction()
+
+    if geometry == BRAGG:
+        angle = bragg_angle
+    else:
+        angle = numpy.pi/2 + bragg_angle
+
+    # the components of the unitary vector of the incident photon (the diffraction plane is YZ)
+    direction = Vector(0.0, numpy.cos(angle), - numpy.abs(numpy.sin(angle)))
+
+    r = numpy.zeros_like(energies)
+    for i, energy in enumerate(energies):
+        try:
+            photon = Photon(energy_in_ev=energy, direction_vector=direction)
+            coeffs_r = diffraction.calculateDiffractedComplexAmplitudes(diffraction_setup, photon,
+                                                                        calculation_method=method)
+            r[i] = numpy.abs(coeffs_r['S']) ** power
+        except:
+            print("Failed to calculate reflectivity at E=%g eV for %d%d%d reflection" % (energy,
+                                                                                       h_miller, k_miller, l_miller))
+    return r
+
+def calculate_crystal_reflectivity(energies, energy_setup=8000.0, h_miller=1, k_miller=1, l_miller=1,
+                                   geometry=BRAGG, thickness=15e-6, method=0, number_of_reflections=None,
+                                   number_of_processes=1, use_cache=True):
+    # geometry: BRAGG (double reflection, thickness not used) or LAUE (single reflection, thickness in meters)
+    # method: 0 = Zachariasen, 1 = Guigay
+    # number_of_reflections: the power of |S|**2 (default: 2 for BRAGG, 1 for LAUE)
+    energies = numpy.asarray(energies, dtype=float)
+
+    if number_of_reflections is None:
+        number_of_reflections = 2 if geometry == BRAGG else 1
+
+    key = (geometry, h_miller, k_miller, l_miller, float(thickness if geometry == LAUE else 0.0), method,
+           number_of_reflections, float(energy_setup), energies.size, energies.tobytes())
+
+    if use_cache and key in _reflectivity_cache:
+        _reflectivity_cache.move_to_end(key)
+        return _reflectivity_cache[key].copy()
+
+    bragg_angle = _diffraction_setup(geometry, h_miller, k_miller, l_miller, thickness).angleBragg(energy_setup)
+    print("Bragg angle for Si%d%d%d at E=%f eV is %f deg" % (
+        h_miller, k_miller, l_miller, energy_setup, bragg_angle * 180.0 / numpy.pi))
+
+    nharmonics = max(1, int(energies.max() / energy_setup))
+    print("Calculating %d harmonics" % nharmonics)
+
+    tasks = []
+    chunks = numpy.array_split(energies, max(1, min(number_of_processes, energies.size)))
+    harmonics = range(1, nharmonics + 1, 2) # calculate only odd harmonics
+    for harmonic in harmonics:
+        for chunk in chunks:
+            tasks.append((chunk, geometry, harmonic * h_miller, harmonic * k_miller, harmonic * l_miller,
+                          thickness, bragg_angle, method, 2 * number_of_reflections))
+
+    if number_of_processes > 1:
+        with ProcessPoolExecutor(max_workers=number_of_processes) as executor:
+            results = list(executor.map(_calculate_harmonic, tasks))
+    else:
+        results = [_calculate_harmonic(task) for task in tasks]
+
+    r = numpy.zeros_like(energies)
+    for i, harmonic in enumerate(harmonics):
+        ri = numpy.concatenate(results[i * len(chunks):(i + 1) * len(chunks)])
+        print("Harmonic %d, max reflectivity: %g at energy: %g" % (harmonic, ri.max(), energies[ri.argmax()]))
+        r += ri
+
+    if use_cache:
+        _reflectivity_cache[key] = r.copy()
+        if len(_reflectivity_cache) > _reflectivity_cache_max_size:
+            _reflectivity_cache.popitem(last=False)
+
+    return r
+
+def clear_reflectivity_cache():
+    _reflectivity_cache.clear()
+
+
+#
+# On-disk lookup tables (npz) of the reflectivity, one per configuration (geometry, hkl, thickness, method,
+# number of reflections, setup energy). The reflectivity is only significant close to the odd harmonics of the
+# setup energy, so the table samples one window per harmonic (up to energy_max) and is zero elsewhere. The window
+# of a harmonic is centered at the refraction corrected energy and spans darwin_widths Darwin half widths on each
+# side, so that the narrow high order reflections get the same sampling as the first one. The energy_max covered
+# by the table is stored with it. Spectral transmission is then an interpolation and a multiplication.
+#
+
+LUT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".oasys", "crystal_reflectivity")
+
+_lut_cache = OrderedDict()
+
+def get_reflectivity_lut_filename(energy_setup, h_miller=1, k_miller=1, l_miller=1, geometry=BRAGG,
+                                  thickness=15e-6, method=0, number_of_reflections=None, directory=None):
+    if number_of_reflections is None: number_of_reflections = 2 if geometry == BRAGG else 1
+    if directory is None: directory = LUT_DIRECTORY
+    name = "Si%d%d%d_%s_%s_E%.3f_m%d_n%d.npz" % (h_miller, k_miller, l_miller,
+                                                 "bragg" if geometry == BRAGG else "laue",
+                                                 "0" if geometry == BRAGG else "%gum" % (thickness * 1e6),
+                                                 energy_setup, method, number_of_reflections)
+    return os.path.join(directory, name)
+
+def get_harmonic_window(energy_setup, harmonic, h_miller=1, k_miller=1, l_miller=1, geometry=BRAGG,
+                        thickness=15e-6, darwin_widths=20.0):
+    # energy interval [eV] of the reflection of an odd harmonic at the Bragg angle of the setup energy: centered
+    # at the refraction corrected energy, darwin_widths Darwin half widths (sigma polarization) on each side
+    energy = harmonic * energy_setup
+    diffraction_setup = _diffraction_setup(geometry, harmonic * h_miller, harmonic * k_miller, harmonic * l_miller,
+                                           thickness)
+    bragg_angle = diffraction_setup.angleBragg(energy)
+    shift = diffraction_setup.angleBraggCorrected(energy) - bragg_angle
+    halfwidth = darwin_widths * abs(diffraction_setup.darwinHalfwidthS(energy))
+    # dE / E = d(theta) / tan(theta)
+    energy_center = energy * (1 + shift / numpy.tan(bragg_angle))
+    energy_halfwidth = energy * halfwidth / numpy.tan(bragg_angle)
+    return energy_center - energy_halfwidth, energy_center + energy_halfwidth
+
+def build_reflectivity_lut(energy_setup, h_miller=1, k_miller=1, l_miller=1, geometry=BRAGG, thickness=15e-6,
+                           method=0, number_of_reflections=None, energy_max=100000.0, darwin_widths=20.0,
+                           points_per_window=4001, number_of_processes=1, directory=None):
+    if number_of_reflections is None: number_of_reflections = 2 if geometry == BRAGG else 1
+    filename = get_reflectivity_lut_filename(energy_setup, h_miller, k_miller, l_miller, geometry, thickness,
+                                             method, number_of_reflections, directory)
+
+    bragg_angle = _diffraction_setup(geometry, h_miller, k_miller, l_miller, thickness).angleBragg(energy_setup)
+
+    windows = []
+    tasks = []
+    for harmonic in range(1, max(1, int(energy_max / energy_setup)) + 1, 2): # only odd harmonics
+        energies = numpy.linspace(*get_harmonic_window(energy_setup, harmonic, h_miller, k_miller, l_miller,
+                                                       geometry, thickness, darwin_widths),
+                                  points_per_window)
+        windows.append(energies)
+        for chunk in numpy.array_split(energies, number_of_processes):
+            tasks.append((chunk, geometry, harmonic * h_miller, harmonic * k_miller, harmonic * l_miller,
+                          thickness, bragg_angle, method, 2 * number_of_reflections))
+
+    if number_of_processes > 1:
+        with ProcessPoolExecutor(max_workers=number_of_processes) as executor:
+            results = list(executor.map(_calculate_harmonic, tasks))
+    else:
+        results = [_calculate_harmonic(task) for task in tasks]
+
+    energies = numpy.concatenate(windows)
+    reflectivity = numpy.concatenate(results)
+    reflectivity[numpy.cumsum([w.size for w in windows]) - 1] = 0.0 # zero at the window edges, and outside
+    reflectivity[numpy.cumsum([0] + [w.size for w in windows[:-1]])] = 0.0
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    numpy.savez(filename, energies=energies, reflectivity=reflectivity, energy_max=energy_max,
+                configuration=numpy.array([energy_setup, h_miller, k_miller, l_miller, geometry, thickness,
+                                           method, number_of_reflections]))
+    print("File written to disk: %s" % filename)
+    _lut_cache.pop(filename, None)
+    return filename
+
+def _load_reflectivity_lut(filename):
+    # energies, reflectivity and covered energy_max of a table (tables written without energy_max only cover
+    # up to their last sampled energy)
+    with numpy.load(filename) as f:
+        energy_max = float(f["energy_max"]) if "energy_max" in f.files else float(f["energies"][-1])
+        _lut_cache[filename] = (f["energies"], f["reflectivity"], energy_max)
+    if len(_lut_cache) > _reflectivity_cache_max_size: _lut_cache.popitem(last=False)
+
+def get_reflectivity_from_lut(energies, energy_setup=8000.0, h_miller=1, k_miller=1, l_miller=1, geometry=BRAGG,
+                              thickness=15e-6, method=0, number_of_reflections=None, directory=None,
+                              build_if_missing=True, number_of_processes=1):
+    # interpolated reflectivity at the energies (the table is built and written to disk if not found)
+    filename = get_reflectivity_lut_filename(energy_setup, h_miller, k_miller, l_miller, geometry, thickness,
+                                             method, number_of_reflections, directory)
+
+    energy_max = max(numpy.max(energies), energy_setup)
+
+    if filename not in _lut_cache and os.path.exists(filename): _load_reflectivity_lut(filename)
+
+    # missing, or built for a smaller energy range
+    if filename not in _lut_cache or energy_max > _lut_cache[filename][2]:
+        if not build_if_missing: raise Exception("Reflectivity table not found or too short: %s" % filename)
+        if filename in _lut_cache: energy_max = max(energy_max, _lut_cache[filename][2])
+        build_reflectivity_lut(energy_setup, h_miller, k_miller, l_miller, geometry, thickness, method,
+                               number_of_reflections, energy_max=energy_max,
+                               number_of_processes=number_of_processes, directory=directory)
+        _load_reflectivity_lut(filename)
+
+    lut_energies, lut_reflectivity, _ = _lut_cache[filename]
+    return numpy.interp(energies, lut_energies, lut_reflectivity, left=0.0, right=0.0)
+
+def prebuild_reflectivity_luts(directory=None, number_of_processes=1, energy_max=100000.0):
+    # Si111 and Si311 double crystal (Bragg) monochromators at typical setup energies
+    setups = [((1, 1, 1), [8000.0, 10000.0, 12400.0, 15000.0, 17000.0, 20000.0]),
+              ((3, 1, 1), [20000.0, 30000.0, 40000.0, 50000.0])]
+    filenames = []
+    for hkl, energy_setups in setups:
+        for energy_setup in energy_setups:
+            for method in [0, 1]:
+                filenames.append(build_reflectivity_lut(energy_setup, *hkl, geometry=BRAGG, method=method,
+                                                        energy_max=energy_max,
+                                                        number_of_processes=number_of_processes,
+                                                        directory=directory))
+    return filenames
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Crystal monochromator reflectivity lookup tables")
+    parser.add_argument("--prebuild", action="store_true", help="build the tables for Si111 and Si311 setups")
+    parser.add_argument("--directory", default=None, help="directory of the tables (default: %s)" % LUT_DIRECTORY)
+    parser.add_argument("--processes", type=int, default=1, help="number of processes")
+    parser.add_argument("--energy-max", type=float, default=100000.0, help="maximum energy (harmonics) [eV]")
+    args = parser.parse_args()
+
+    if args.prebuild:
+        prebuild_reflectivity_luts(directory=args.directory, number_of_processes=args.processes,
+                                   energy_max=args.energy_max)
+    else:
+        import time
+        from orangecontrib.esrf.xoppy.util.spectral_algebra import integrate_spectra
+        energies = numpy.linspace(7900, 8100, 1000)
+        for number_of_processes in [1, 4]:
+            t0 = time.time()
+            r = calculate_crystal_reflectivity(energies, energy_setup=8000.0,
+                                               number_of_processes=number_of_processes, use_cache=False)
+            print("processes: %d, time: %.3f s, integrated reflectivity: %g eV" % (number_of_processes,
+                  time.time() - t0, integrate_spectra(r, energies)))
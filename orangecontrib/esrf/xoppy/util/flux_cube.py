@@ -0,0 +1,25 @@
+import numpy
+
+#
+# Integration of an angle- and energy-resolved flux cube (as given by xoppy_calc_undulator_radiation) over
+# rectangular apertures, used by the power-load script.
+#
+# The cube (energies x h x v, flux per mm^2) is calculated once at a given distance on an equally spaced grid (h, v
+# in mm). The flux through an aperture at another distance is the integral of the cube over the aperture projected
+# to the distance of the cube, with each pixel weighted by its fraction inside the aperture. Apertures larger than
+# the cube are limited to the cube.
+#
+
+def _overlap_weights(x, half_width):
+    # length (same units as x) of each pixel of the (equally spaced) grid x inside [-half_width, half_width]
+    step = x[1] - x[0]
+    return numpy.clip(numpy.minimum(x + step / 2, half_width) - numpy.maximum(x - step / 2, -half_width), 0.0, step)
+
+def integrate_flux_cube(cube, dist, h_slit, v_slit):
+    # flux (photons/s/0.1%bw) versus energy through the aperture h_slit x v_slit (in m) at the distance dist (in m)
+    # cube: dictionary with "distance" (m), "h" and "v" (mm) and "flux" (energies x h x v, photons/s/0.1%bw/mm^2)
+    scale = 1e3 * cube["distance"] / dist # m at dist -> mm at the cube distance
+    weights_h = _overlap_weights(numpy.asarray(cube["h"], dtype=float), 0.5 * h_slit * scale)
+    weights_v = _overlap_weights(numpy.asarray(cube["v"], dtype=float), 0.5 * v_slit * scale)
+
+    return numpy.einsum("ehv,h,v->e", cube["flux"], weights_h, weights_v)
@@ -0,0 +1,162 @@
+import numpy
+import os
+import hashlib
+from collections import OrderedDict
+from functools import partial
+
+#
+# Cache of the energy dependent material constants (cross sections, refractive index) shared by the xoppy widgets.
+#
+# The values of a function of the material constants library (xraylib or DabaxXraylib) for a substance (and the
+# other arguments, e.g. the density) are calculated at once for all the points of an energy grid (with a single
+# call on the whole grid for DabaxXraylib, point by point for xraylib), and kept in a LRU cache keyed by library
+# (and, for DabaxXraylib, its repository and files), function, substance, arguments and energy grid. Optionally,
+# they are also stored on disk (one .npy file per key) so that they survive the session.
+#
+# xoppy_calc_power_cached runs xoppy_calc_power with a proxy of the library that answers the point-by-point
+# calls of xoppy_calc_power from the cache.
+#
+
+CACHED_FUNCTIONS = ["CS_Total_CP", "CS_Photo_CP", "CS_Rayl_CP", "CS_Compt_CP",
+                    "CS_Total", "CS_Photo", "CS_Rayl", "CS_Compt",
+                    "Refractive_Index_Re", "Refractive_Index_Im"]
+
+DISK_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".oasys", "material_constants")
+USE_DISK_CACHE = False
+
+_material_constants_cache = OrderedDict()
+_material_constants_cache_max_size = 256
+
+def _is_dabax(material_constants_library):
+    try:
+        from dabax.dabax_xraylib import DabaxXraylib
+    except ImportError:
+        return False
+    return isinstance(material_constants_library, DabaxXraylib)
+
+def get_library_name(material_constants_library):
+    # the module name (xraylib), or the class name and the configuration (repository and files) of an instance
+    name = getattr(material_constants_library, "__name__", None)
+    if name is not None: return name
+
+    configuration = [type(material_constants_library).__name__]
+    for attribute in sorted(dir(material_constants_library)):
+        if attribute == "get_dabax_repository" or attribute.startswith("get_file_"):
+            configuration.append("%s=%s" % (attribute[4:], getattr(material_constants_library, attribute)()))
+    return ",".join(configuration)
+
+def _get_key(material_constants_library, function_name, substance, energies_kev, arguments):
+    arguments = tuple(argument if isinstance(argument, str) else float(argument) for argument in arguments)
+    return (get_library_name(material_constants_library), function_name, str(substance), arguments,
+            energies_kev.size, energies_kev.tobytes())
+
+def _get_filename(key, directory):
+    name = hashlib.sha1(repr(key[:-1]).encode() + key[-1]).hexdigest()
+    return os.path.join(directory, "%s_%s.npy" % (key[1], name))
+
+def get_material_constants(material_constants_library, function_name, substance, energies_kev, arguments=(),
+                           use_disk_cache=None, directory=None):
+    # values of material_constants_library.function_name(substance, energy_kev, *arguments) for all the energies
+    energies_kev = numpy.asarray(energies_kev, dtype=float)
+    if use_disk_cache is None: use_disk_cache = USE_DISK_CACHE
+    if directory is None: directory = DISK_CACHE_DIRECTORY
+
+    key = _get_key(material_constants_library, function_name, substance, energies_kev, arguments)
+
+    if key in _material_constants_cache:
+        _material_constants_cache.move_to_end(key)
+        return _material_constants_cache[key]
+
+    filename = _get_filename(key, directory) if use_disk_cache else None
+
+    if filename is not None and os.path.exists(filename):
+        values = numpy.load(filename)
+    else:
+        function = getattr(material_constants_library, function_name)
+        if _is_dabax(material_constants_library): # vectorized
+            values = numpy.array(function(substance, energies_kev, *arguments), dtype=float).reshape(energies_kev.shape)
+        else:
+            values = numpy.array([function(substance, energy_kev, *arguments) for energy_kev in energies_kev])
+        if filename is not None:
+            os.makedirs(directory, exist_ok=True)
+            numpy.save(filename, values)
+
+    values.flags.writeable = False
+    _material_constants_cache[key] = values
+    if len(_material_constants_cache) > _material_constants_cache_max_size:
+        _material_constants_cache.popitem(last=False)
+
+    return values
+
+def clear_material_constants_cache(disk=False, directory=None):
+    _material_constants_cache.clear()
+    if disk:
+        if directory is None: directory = DISK_CACHE_DIRECTORY
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.endswith(".npy"): os.remove(os.path.join(directory, filename))
+
+class CachedMaterialConstantsLibrary():
+    # proxy of a material constants library: the functions in CACHED_FUNCTIONS called at an energy of the grid
+    # (or on the whole grid) are answered from the cache, anything else goes to the library
+    def __init__(self, material_constants_library, energies_kev, use_disk_cache=None, directory=None):
+        self._library = material_constants_library
+        self._energies_kev = numpy.asarray(energies_kev, dtype=float)
+        self._index = {energy_kev: i for i, energy_kev in enumerate(self._energies_kev.tolist())}
+        self._use_disk_cache = use_disk_cache
+        self._directory = directory
+        self._values = {} # values on the grid, by function, substance and arguments
+
+    def __getattr__(self, name):
+        attribute = getattr(self._library, name)
+        if name in CACHED_FUNCTIONS: return partial(self._cached_call, name, attribute)
+        return attribute
+
+    def _cached_call(self, function_name, function, substance, energy_kev, *arguments):
+        if numpy.ndim(energy_kev) == 0:
+            index = self._index.get(float(energy_kev))
+        elif numpy.shape(energy_kev) == self._energies_kev.shape and numpy.array_equal(energy_kev, self._energies_kev):
+            index = Ellipsis # the whole grid
+        else:
+            index = None
+        if index is None: return function(substance, energy_kev, *arguments)
+
+        key = (function_name, substance, arguments)
+        if key not in self._values:
+            self._values[key] = get_material_constants(self._library, function_name, substance, self._energies_kev,
+                                                       arguments, use_disk_cache=self._use_disk_cache,
+                                                       directory=self._directory)
+        return self._values[key].copy() if index is Ellipsis else self._values[key][index]
+
+def xoppy_calc_power_cached(energies, source, material_constants_library=None, use_disk_cache=None, **kwargs):
+    # same as xoppylib.power.xoppy_calc_power.xoppy_calc_power, with the material constants taken from the cache
+    from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+
+    if material_constants_library is None:
+        import xraylib
+        material_constants_library = xraylib
+
+    energies_kev = numpy.asarray(energies, dtype=float) / 1000.0
+    return xoppy_calc_power(energies, source,
+                            material_constants_library=CachedMaterialConstantsLibrary(material_constants_library,
+                                                                                      energies_kev,
+                                                                                      use_disk_cache=use_disk_cache),
+                            **kwargs)
+
+
+if __name__ == "__main__":
+    import time
+    import xraylib
+    from orangecontrib.esrf.xoppy.util.spectral_algebra import integrate_spectra
+
+    energies = numpy.linspace(1000.0, 100000.0, 2000)
+    source = numpy.ones_like(energies)
+    kwargs = {"substance": ["C", "Al", "Cu", "Mo", "W"], "thick": [1.0, 1.0, 0.1, 0.05, 0.01],
+              "angle": [0.0] * 5, "dens": ["?"] * 5, "roughness": [0.0] * 5, "flags": [0] * 5, "nelements": 5}
+
+    for i in range(2):
+        t0 = time.time()
+        # (xoppy_calc_power modifies the source)
+        out_dictionary = xoppy_calc_power_cached(energies, source.copy(), material_constants_library=xraylib, **kwargs)
+        print("run %d: %.3f s, transmitted power: %g W" % (i + 1, time.time() - t0,
+                                                           integrate_spectra(out_dictionary["data"][-1], energies)))
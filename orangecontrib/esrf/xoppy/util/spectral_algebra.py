@@ -0,0 +1,59 @@
+import numpy
+
+#
+# Vectorized operations on spectral curves (arrays over the same energy grid), shared by the xoppy widgets.
+#
+# transmissions are given as a sequence (elements x energies) of transmission curves, e.g. the columns
+# 4 + 6 * k of the xoppy_calc_power output (see get_element_transmissions).
+#
+
+def transmission_product(transmissions):
+    # element-by-element product of the curves (e.g. total transmission, or spectrum times transmission)
+    return numpy.prod(numpy.array(transmissions, dtype=float, ndmin=2), axis=0)
+
+def cumulative_transmission(transmissions):
+    # (elements x energies) transmission after the first 1, 2, ... elements
+    return numpy.cumprod(numpy.array(transmissions, dtype=float, ndmin=2), axis=0)
+
+def absorbed_fraction(transmissions):
+    return 1.0 - transmission_product(transmissions)
+
+def absorbed_spectra(source, transmissions):
+    # (elements x energies) spectral power absorbed in each element
+    cumulative = cumulative_transmission(transmissions)
+    incident = numpy.vstack((numpy.ones_like(cumulative[0]), cumulative[:-1])) * numpy.asarray(source, dtype=float)
+    return incident * (1.0 - numpy.array(transmissions, dtype=float, ndmin=2))
+
+def identical_elements_transmission(transmission, number_of_elements):
+    # (number_of_elements x energies) transmission of a stack of 1, 2, ... number_of_elements identical elements
+    n = numpy.arange(1, number_of_elements + 1)[:, numpy.newaxis]
+    return numpy.asarray(transmission, dtype=float)[numpy.newaxis, :] ** n
+
+def get_element_transmissions(xoppy_calc_power_data, nelements):
+    # the transmission columns of the output of xoppy_calc_power (6 columns per element)
+    return xoppy_calc_power_data[4:4 + 6 * nelements:6]
+
+def integrate_spectra(spectra, energies):
+    # integral over the energies of one curve or of each curve (rows) of spectra
+    # (numpy.trapz was renamed numpy.trapezoid in numpy 2.0, and later removed)
+    trapezoid = getattr(numpy, "trapezoid", None) or numpy.trapz
+    return trapezoid(numpy.asarray(spectra, dtype=float), x=numpy.asarray(energies, dtype=float), axis=-1)
+
+def power_versus_number_of_elements(energies, source, transmissions):
+    # (number of elements, transmitted and absorbed fraction of the power) after the first 1, 2, ... elements,
+    # with transmissions the (elements x energies) cumulative transmission (e.g. identical_elements_transmission)
+    transmissions = numpy.array(transmissions, dtype=float, ndmin=2)
+    source = numpy.asarray(source, dtype=float)
+    power_in = integrate_spectra(source, energies)
+    transmitted = integrate_spectra(source[numpy.newaxis, :] * transmissions, energies) / power_in
+    return numpy.arange(1, transmissions.shape[0] + 1), transmitted, 1.0 - transmitted
+
+def identical_elements_power(xoppy_calc_power_data, number_of_elements):
+    # from the output of xoppy_calc_power for a single element, returns the rows (energy, source, transmission,
+    # absorption, transmitted spectrum) for a stack of number_of_elements identical elements, and the rows (number of
+    # elements, transmitted and absorbed fraction of the power) for 1, 2, ... number_of_elements elements
+    # (the source is taken from the output: xoppy_calc_power multiplies the source array it is given in place)
+    energies, source = xoppy_calc_power_data[0], xoppy_calc_power_data[1]
+    transmissions = identical_elements_transmission(xoppy_calc_power_data[4], number_of_elements)
+    spectra = numpy.vstack((energies, source, transmissions[-1], 1.0 - transmissions[-1], source * transmissions[-1]))
+    return spectra, numpy.vstack(power_versus_number_of_elements(energies, source, transmissions))
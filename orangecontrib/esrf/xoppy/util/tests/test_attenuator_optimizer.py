@@ -0,0 +1,71 @@
+import itertools
+
+import numpy
+import pytest
+import scipy.constants as codata
+
+from orangecontrib.esrf.xoppy.util.attenuator_optimizer import find_attenuator_combinations, \
+    TRANSMITTED_POWER, ABSORBED_POWER, TRANSMITTED_FLUX
+
+
+def _synthetic_axes(number_of_axes=5, filters_per_axis=4, seed=0):
+    # log-transmissions (filters x energies) decreasing with the thickness, the first filter of each axis is empty
+    energies = numpy.linspace(1000.0, 50000.0, 200)
+    rng = numpy.random.default_rng(seed)
+    axes = []
+    for i in range(number_of_axes):
+        mu = rng.uniform(0.5, 2.0) * (energies / 10000.0) ** -rng.uniform(2.5, 3.0)
+        thicknesses = numpy.concatenate(([0.0], numpy.sort(rng.uniform(0.05, 1.0, filters_per_axis - 1))))
+        axes.append(-thicknesses[:, numpy.newaxis] * mu[numpy.newaxis, :])
+    source = 1e-3 * numpy.exp(-energies / 20000.0) # W/eV
+    return energies, source, axes
+
+def _brute_force(energies, source, axes, quantity, minimum, maximum):
+    # all the combinations, the least attenuating first
+    spectrum = source / (energies * codata.e) if quantity == TRANSMITTED_FLUX else source
+    trapezoid = getattr(numpy, "trapezoid", None) or numpy.trapz
+    incident = trapezoid(spectrum, x=energies)
+    out = []
+    for indices in itertools.product(*[range(axis.shape[0]) for axis in axes]):
+        transmission = numpy.exp(sum(axis[index] for axis, index in zip(axes, indices)))
+        transmitted = trapezoid(spectrum * transmission, x=energies)
+        value = incident - transmitted if quantity == ABSORBED_POWER else transmitted
+        if (minimum is None or value >= minimum) and (maximum is None or value <= maximum):
+            out.append((transmitted, value, indices))
+    out.sort(key=lambda item: -item[0])
+    return out
+
+@pytest.mark.parametrize("quantity", [TRANSMITTED_POWER, ABSORBED_POWER, TRANSMITTED_FLUX])
+@pytest.mark.parametrize("number_of_axes", [1, 4, 5])
+def test_combinations_match_brute_force(quantity, number_of_axes):
+    energies, source, axes = _synthetic_axes(number_of_axes=number_of_axes)
+    everything = _brute_force(energies, source, axes, quantity, None, None)
+    values = numpy.sort([item[1] for item in everything])
+    atol = 1e-12 * numpy.abs(values).max() # (the absorbed power without filters is zero)
+
+    # limits (between two values) around the median value, and each limit alone
+    low, high = [0.5 * (values[k] + values[k + 1]) for k in (int(0.3 * values.size), int(0.7 * values.size))]
+    for minimum, maximum in [(low, high), (low, None), (None, high), (None, None)]:
+        expected = _brute_force(energies, source, axes, quantity, minimum, maximum)
+        for max_results, max_elements in [(10, 2**24), (len(everything), 2**24), (10, 7)]: # also in small chunks
+            combinations = find_attenuator_combinations(energies, source, axes, quantity=quantity,
+                                                        minimum=minimum, maximum=maximum,
+                                                        max_results=max_results, max_elements=max_elements)
+            assert len(combinations) == min(max_results, len(expected))
+            for combination, (transmitted, value, indices) in zip(combinations, expected):
+                assert combination["indices"] == indices
+                numpy.testing.assert_allclose(combination["value"], value, rtol=1e-10, atol=atol)
+                numpy.testing.assert_allclose(combination["transmitted"], transmitted, rtol=1e-10, atol=atol)
+                if minimum is not None: assert combination["value"] >= minimum
+                if maximum is not None: assert combination["value"] <= maximum
+
+            # the least attenuating first
+            transmitted = numpy.array([combination["transmitted"] for combination in combinations])
+            assert numpy.all(numpy.diff(transmitted) <= 0)
+
+def test_no_combination_in_range():
+    energies, source, axes = _synthetic_axes()
+    incident = find_attenuator_combinations(energies, source, axes, max_results=1)[0]["value"] # all empty filters
+    assert find_attenuator_combinations(energies, source, axes, minimum=1.1 * incident) == []
+    with pytest.raises(Exception):
+        find_attenuator_combinations(energies, source, [])
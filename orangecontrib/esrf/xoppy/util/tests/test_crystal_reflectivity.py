@@ -0,0 +1,80 @@
+import numpy
+import pytest
+
+from orangecontrib.esrf.xoppy.util import crystal_reflectivity
+from orangecontrib.esrf.xoppy.util.crystal_reflectivity import get_reflectivity_from_lut, get_harmonic_window
+
+
+class _FakeDiffractionSetup():
+    # Darwin half width decreasing with the harmonic, as for the real reflections
+    def __init__(self, harmonic):
+        self.harmonic = harmonic
+
+    def angleBragg(self, energy):
+        return 0.25
+
+    def angleBraggCorrected(self, energy):
+        return 0.25 + 1e-5 / self.harmonic ** 2
+
+    def darwinHalfwidthS(self, energy):
+        return 2e-5 / self.harmonic ** 3
+
+def _fake_calculate_harmonic(arguments):
+    energies = arguments[0]
+    return numpy.ones_like(energies)
+
+@pytest.fixture
+def fake_crystalpy(monkeypatch):
+    monkeypatch.setattr(crystal_reflectivity, "_diffraction_setup",
+                        lambda geometry, h_miller, k_miller, l_miller, thickness: _FakeDiffractionSetup(h_miller))
+    monkeypatch.setattr(crystal_reflectivity, "_calculate_harmonic", _fake_calculate_harmonic)
+    crystal_reflectivity._lut_cache.clear()
+    yield
+    crystal_reflectivity._lut_cache.clear()
+
+def test_lut_not_rebuilt_without_further_harmonic(fake_crystalpy, monkeypatch, tmp_path):
+    # setup at 8 keV, energies up to 20 keV: only the first harmonic fits, so the table ends at ~8 keV, far
+    # below the energy_max requested
+    builds = []
+    build_reflectivity_lut = crystal_reflectivity.build_reflectivity_lut
+    def counting_build(*args, **kwargs):
+        builds.append(kwargs["energy_max"])
+        return build_reflectivity_lut(*args, **kwargs)
+    monkeypatch.setattr(crystal_reflectivity, "build_reflectivity_lut", counting_build)
+
+    energies = numpy.linspace(1000.0, 20000.0, 1000)
+    for i in range(3):
+        get_reflectivity_from_lut(energies, energy_setup=8000.0, directory=str(tmp_path))
+    assert builds == [20000.0]
+
+    # also when the table is read back from disk
+    crystal_reflectivity._lut_cache.clear()
+    get_reflectivity_from_lut(energies, energy_setup=8000.0, directory=str(tmp_path))
+    assert builds == [20000.0]
+
+    # a larger range rebuilds
+    get_reflectivity_from_lut(numpy.linspace(1000.0, 30000.0, 1000), energy_setup=8000.0, directory=str(tmp_path))
+    assert builds == [20000.0, 30000.0]
+
+def test_harmonic_windows_scale_with_darwin_width(fake_crystalpy):
+    widths = []
+    for harmonic in [1, 3, 5]:
+        energy_min, energy_max = get_harmonic_window(8000.0, harmonic, darwin_widths=20.0)
+        center = 0.5 * (energy_min + energy_max)
+        assert center > harmonic * 8000.0 # refraction correction
+        widths.append((energy_max - energy_min) / (harmonic * 8000.0))
+    numpy.testing.assert_allclose(numpy.array(widths) / widths[0], [1.0, 1 / 27, 1 / 125])
+
+def test_harmonic_windows_contain_reflection():
+    pytest.importorskip("xraylib")
+    pytest.importorskip("crystalpy")
+    for harmonic in [1, 3, 5]:
+        energy_min, energy_max = get_harmonic_window(8000.0, harmonic, darwin_widths=20.0)
+        energies = numpy.linspace(energy_min, energy_max, 401)
+        bragg_angle = crystal_reflectivity._diffraction_setup(crystal_reflectivity.BRAGG, 1, 1, 1, 0.0).angleBragg(8000.0)
+        r = crystal_reflectivity._calculate_harmonic((energies, crystal_reflectivity.BRAGG, harmonic, harmonic, harmonic,
+                                                      0.0, bragg_angle, 0, 4))
+        assert r.max() > 0.5
+        # the reflection is sampled (not a single point) and vanishes at the window edges
+        assert (r > 0.5 * r.max()).sum() > 10
+        assert max(r[0], r[-1]) < 1e-3 * r.max()
@@ -0,0 +1,44 @@
+import numpy
+from scipy.special import erf
+
+from orangecontrib.esrf.xoppy.util.flux_cube import integrate_flux_cube
+
+
+def _gaussian_cube(distance=20.0, sigma_h=1.0, sigma_v=0.5, half_width_h=3.0, half_width_v=1.5, points=301):
+    # flux (2 energies, the second with twice the flux) of a normalized Gaussian beam, on a grid of
+    # +-half_width (mm) at distance (m)
+    h = numpy.linspace(-half_width_h, half_width_h, points)
+    v = numpy.linspace(-half_width_v, half_width_v, points)
+    density = numpy.exp(-0.5 * (h[:, numpy.newaxis] / sigma_h) ** 2 - 0.5 * (v[numpy.newaxis, :] / sigma_v) ** 2) / \
+              (2 * numpy.pi * sigma_h * sigma_v)
+    return {"distance": distance, "energy": numpy.array([1000.0, 2000.0]), "h": h, "v": v,
+            "flux": numpy.array([density, 2 * density])}
+
+def _gaussian_fraction(half_width, sigma):
+    return erf(half_width / sigma / numpy.sqrt(2))
+
+def test_aperture_at_the_cube_distance():
+    cube = _gaussian_cube()
+    # 1.2 mm x 0.7 mm (m), not aligned with the pixels
+    flux = integrate_flux_cube(cube, 20.0, 1.2e-3, 0.7e-3)
+    expected = _gaussian_fraction(0.6, 1.0) * _gaussian_fraction(0.35, 0.5)
+    numpy.testing.assert_allclose(flux, [expected, 2 * expected], rtol=1e-4)
+
+def test_aperture_projected_from_another_distance():
+    cube = _gaussian_cube()
+    # at 40 m, the same angular aperture is twice as large
+    numpy.testing.assert_allclose(integrate_flux_cube(cube, 40.0, 2.4e-3, 1.4e-3),
+                                  integrate_flux_cube(cube, 20.0, 1.2e-3, 0.7e-3), rtol=1e-12)
+
+def test_aperture_larger_than_the_cube():
+    cube = _gaussian_cube()
+    # limited to the cube, whose edge pixels extend half a step beyond the grid
+    full = integrate_flux_cube(cube, 20.0, 1.0, 1.0)
+    expected = _gaussian_fraction(3.0 + 0.01, 1.0) * _gaussian_fraction(1.5 + 0.005, 0.5)
+    numpy.testing.assert_allclose(full, [expected, 2 * expected], rtol=1e-4)
+
+    # the aperture of the grid
+    flux = integrate_flux_cube(cube, 20.0, 6e-3, 3e-3)
+    expected = _gaussian_fraction(3.0, 1.0) * _gaussian_fraction(1.5, 0.5)
+    numpy.testing.assert_allclose(flux, [expected, 2 * expected], rtol=1e-4)
+    assert flux[0] < full[0]
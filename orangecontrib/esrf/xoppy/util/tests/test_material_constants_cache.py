@@ -0,0 +1,84 @@
+import numpy
+import pytest
+
+from orangecontrib.esrf.xoppy.util import material_constants_cache
+from orangecontrib.esrf.xoppy.util.material_constants_cache import get_material_constants, get_library_name, \
+    clear_material_constants_cache, CachedMaterialConstantsLibrary
+
+
+class _FakeDabax():
+    # vectorized library, configured by its files, counting the calls
+    def __init__(self, file_CrossSec="CrossSec_EPDL97.dat"):
+        self._file_CrossSec = file_CrossSec
+        self.calls = 0
+
+    def get_dabax_repository(self):
+        return "/dabax"
+
+    def get_file_CrossSec(self):
+        return self._file_CrossSec
+
+    def CS_Total_CP(self, substance, energy_kev):
+        self.calls += 1
+        scale = 2.0 if self._file_CrossSec == "CrossSec_XCOM.dat" else 1.0
+        return scale * len(substance) / numpy.asarray(energy_kev) ** 3
+
+@pytest.fixture
+def fake_dabax(monkeypatch):
+    monkeypatch.setattr(material_constants_cache, "_is_dabax", lambda library: isinstance(library, _FakeDabax))
+    clear_material_constants_cache()
+    yield
+    clear_material_constants_cache()
+
+def test_dabax_called_once_on_the_grid(fake_dabax):
+    library = _FakeDabax()
+    energies_kev = numpy.linspace(1.0, 100.0, 500)
+
+    values = get_material_constants(library, "CS_Total_CP", "Cu", energies_kev, use_disk_cache=False)
+    assert library.calls == 1
+    numpy.testing.assert_allclose(values, 2 / energies_kev ** 3)
+    assert not values.flags.writeable
+
+    # the point by point calls of xoppy_calc_power through the proxy use the same single call
+    proxy = CachedMaterialConstantsLibrary(library, energies_kev, use_disk_cache=False)
+    clear_material_constants_cache()
+    library.calls = 0
+    tmp = numpy.array([proxy.CS_Total_CP("Cu", energy_kev) for energy_kev in energies_kev])
+    assert library.calls == 1
+    numpy.testing.assert_allclose(tmp, values)
+
+    # and the whole grid, returned as a copy
+    tmp = proxy.CS_Total_CP("Cu", energies_kev)
+    tmp *= 0.0
+    assert library.calls == 1
+    numpy.testing.assert_allclose(proxy.CS_Total_CP("Cu", energies_kev), values)
+
+def test_dabax_instances_with_different_files_are_not_shared(fake_dabax):
+    library1 = _FakeDabax()
+    library2 = _FakeDabax(file_CrossSec="CrossSec_XCOM.dat")
+    assert get_library_name(library1) != get_library_name(library2)
+    assert get_library_name(library1) == get_library_name(_FakeDabax())
+
+    energies_kev = numpy.linspace(1.0, 100.0, 50)
+    values1 = get_material_constants(library1, "CS_Total_CP", "Cu", energies_kev, use_disk_cache=False)
+    values2 = get_material_constants(library2, "CS_Total_CP", "Cu", energies_kev, use_disk_cache=False)
+    numpy.testing.assert_allclose(values2, 2 * values1)
+
+def test_cached_xoppy_calc_power_matches_direct_calculation():
+    xraylib = pytest.importorskip("xraylib")
+    xoppy_calc_power = pytest.importorskip("xoppylib.power.xoppy_calc_power").xoppy_calc_power
+    from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
+
+    energies = numpy.linspace(1000.0, 100000.0, 300)
+    source = numpy.exp(-energies / 30000.0)
+    kwargs = {"substance": ["C", "Cu", "Rh"], "thick": [1.0, 0.05, 0.0], "angle": [0.0, 0.0, 3.0],
+              "dens": ["?", "?", "?"], "roughness": [0.0, 0.0, 0.0], "flags": [0, 0, 1], "nelements": 3}
+
+    clear_material_constants_cache()
+    # (xoppy_calc_power modifies the source)
+    direct = xoppy_calc_power(energies, source.copy(), material_constants_library=xraylib, **kwargs)
+    for i in range(2): # computing and from the cache
+        cached = xoppy_calc_power_cached(energies, source.copy(), material_constants_library=xraylib,
+                                         use_disk_cache=False, **kwargs)
+        numpy.testing.assert_array_equal(cached["data"], direct["data"])
+    clear_material_constants_cache()
@@ -0,0 +1,36 @@
+import numpy
+import pytest
+
+from orangecontrib.esrf.xoppy.util.spectral_algebra import identical_elements_power, integrate_spectra
+
+
+@pytest.mark.parametrize("number_of_elements", [1, 2, 3])
+def test_identical_elements_match_xoppy_calc_power(number_of_elements):
+    xraylib = pytest.importorskip("xraylib")
+    xoppy_calc_power = pytest.importorskip("xoppylib.power.xoppy_calc_power").xoppy_calc_power
+    from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
+
+    energies = numpy.linspace(10000.0, 100000.0, 500)
+    source = numpy.exp(-energies / 30000.0)
+
+    # a single lens (given the source array itself, modified in place by xoppy_calc_power), as the Transfocator
+    single = xoppy_calc_power_cached(energies=energies, source=source, substance=["Be"], nelements=1, flags=[0],
+                                     dens=["?"], thick=[0.5], angle=[], roughness=[], material_constants_library=xraylib)
+    spectra, lenses = identical_elements_power(single["data"], number_of_elements)
+
+    # the stack of lenses calculated by xoppy_calc_power
+    source = numpy.exp(-energies / 30000.0)
+    for n in range(1, number_of_elements + 1):
+        stack = xoppy_calc_power(energies, source.copy(), substance=["Be"] * n, nelements=n, flags=[0] * n,
+                                 dens=["?"] * n, thick=[0.5] * n, angle=[0.0] * n, roughness=[0.0] * n,
+                                 material_constants_library=xraylib)["data"]
+        transmitted = integrate_spectra(stack[-1], energies) / integrate_spectra(source, energies)
+        assert lenses[0, n - 1] == n
+        numpy.testing.assert_allclose(lenses[1, n - 1], transmitted, rtol=1e-10)
+        numpy.testing.assert_allclose(lenses[2, n - 1], 1.0 - transmitted, rtol=1e-10)
+
+    numpy.testing.assert_allclose(spectra[0], energies)
+    numpy.testing.assert_allclose(spectra[1], source, rtol=1e-12)
+    numpy.testing.assert_allclose(spectra[2], stack[-1] / source, rtol=1e-10)
+    numpy.testing.assert_allclose(spectra[3], 1.0 - stack[-1] / source, rtol=1e-10, atol=1e-12)
+    numpy.testing.assert_allclose(spectra[4], stack[-1], rtol=1e-10)
@@ -8,7 +8,7 @@ from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
 
 
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
@@ -414,7 +414,7 @@ class OWBM05Scintillators(XoppyWidget):
             material_constants_library_str = 'DabaxXraylib()'
             print(material_constants_library.info())
 
-        out_dictionary = xoppy_calc_power(
+        out_dictionary = xoppy_calc_power_cached(
             energies,
             source,
             substance                  = substance,
@@ -8,10 +8,12 @@ from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
 
 
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
+from orangecontrib.esrf.xoppy.util.attenuator_optimizer import get_axes_log_transmission, find_attenuator_combinations, \
+    format_attenuator_combinations, QUANTITY_NAMES
 import json
 import orangecanvas.resources as resources
 
@@ -47,6 +49,9 @@ class OWBM05WBAttenuators(XoppyWidget):
     FILE_DUMP = 0
 
     MATERIAL_CONSTANT_LIBRARY_FLAG = Setting(0)
+    OPTIMIZE_QUANTITY = Setting(0)
+    OPTIMIZE_MIN = Setting(0.0)
+    OPTIMIZE_MAX = Setting(100.0)
     file_json = os.path.join(resources.package_dirname("orangecontrib.esrf.xoppy.data"), 'bm05_wb_attenuators.json')
     input_spectrum = None
     input_script = None
@@ -161,6 +166,36 @@ class OWBM05WBAttenuators(XoppyWidget):
                     valueType=int, orientation="horizontal", labelWidth=250)
         self.show_at(self.unitFlags()[idx], box1)
 
+        # widget index 18
+        idx += 1
+        box1 = gui.widgetBox(box)
+        gui.separator(box1, height=7)
+
+        gui.comboBox(box1, self, "OPTIMIZE_QUANTITY",
+                     label=self.unitLabels()[idx], addSpace=False,
+                     items=QUANTITY_NAMES,
+                     valueType=int, orientation="horizontal", labelWidth=150)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 19
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MIN",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 20
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MAX",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        box1 = gui.widgetBox(box, orientation="horizontal")
+        gui.button(box1, self, "Find filter combinations", callback=self.find_combinations)
+
         #self.input_spectrum = None
 
     def select_input_file(self):
@@ -195,7 +230,8 @@ class OWBM05WBAttenuators(XoppyWidget):
                  'File with input beam spectral power:',
                  self.get_axis_name(0), self.get_axis_name(1), self.get_axis_name(2),
                  self.get_axis_name(3), self.get_axis_name(4),                                  
-                 'Plot','Material data library','Dump file']
+                 'Plot','Material data library','Dump file',
+                 'Find combinations meeting:','Minimum value:','Maximum value:']
 
 
     def unitFlags(self):
@@ -205,7 +241,8 @@ class OWBM05WBAttenuators(XoppyWidget):
                  'self.SOURCE  ==  1',
                  'self.SOURCE  >  1',
                  'True','True','True','True', 'True',                
-                 'True','True', 'True']
+                 'True','True', 'True',
+                 'True','True','True']
 
     def get_help_name(self):
         return 'BM05_WB_Attenuators'
@@ -360,7 +397,19 @@ class OWBM05WBAttenuators(XoppyWidget):
              
         return dens        
 
-    def do_xoppy_calculation(self):
+    def att_axes(self):
+        """ All the filters of each axis as lists of layers (substance, thickness, density), and their names """
+        axes = []
+        filter_names = []
+        for att_axis in self.att_dic.keys():
+            n_filters = len([key for key in self.att_dic[att_axis].keys() if key[0] != "_"])
+            filters = [self.att_dic[att_axis][f'filter{i + 1}'] for i in range(n_filters)]
+            axes.append([[(filter['substance'], filter['thickness'], filter['density'])] for filter in filters])
+            filter_names.append([filter['name'] for filter in filters])
+
+        return axes, filter_names
+
+    def get_input_beam(self):
 
         if self.SOURCE == 0:
             if self.input_spectrum is None:
@@ -402,7 +451,32 @@ class OWBM05WBAttenuators(XoppyWidget):
                                 (source_file)
             except:
                 print("Error loading file %s "%(source_file))
-                raise         
+                raise
+
+        return energies, source, script_previous
+
+    def find_combinations(self):
+        """ Print the filter combinations (one filter per axis) meeting the target, the least attenuating first """
+        try:
+            self.check_fields()
+            energies, source, _ = self.get_input_beam()
+            axes, filter_names = self.att_axes()
+            if self.MATERIAL_CONSTANT_LIBRARY_FLAG == 0:
+                material_constants_library = xraylib
+            else:
+                material_constants_library = DabaxXraylib()
+            combinations = find_attenuator_combinations(energies, source,
+                                                        get_axes_log_transmission(energies, axes, material_constants_library),
+                                                        quantity=self.OPTIMIZE_QUANTITY,
+                                                        minimum=self.OPTIMIZE_MIN,
+                                                        maximum=self.OPTIMIZE_MAX)
+            print(format_attenuator_combinations(combinations, filter_names, quantity=self.OPTIMIZE_QUANTITY))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e.args[0]), QMessageBox.Ok)
+
+    def do_xoppy_calculation(self):
+
+        energies, source, script_previous = self.get_input_beam()
 
         substance = self.att_substance()  # str list of substances
         thick     = self.att_thick() # float list of thickness
@@ -442,7 +516,7 @@ class OWBM05WBAttenuators(XoppyWidget):
             material_constants_library_str = 'DabaxXraylib()'
             print(material_constants_library.info())
 
-        out_dictionary = xoppy_calc_power(
+        out_dictionary = xoppy_calc_power_cached(
             energies,
             source,
             substance                  = substance,
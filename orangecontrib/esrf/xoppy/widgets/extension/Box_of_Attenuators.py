@@ -7,10 +7,12 @@ from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
 
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
+from orangecontrib.esrf.xoppy.util.attenuator_optimizer import get_axes_log_transmission, find_attenuator_combinations, \
+    format_attenuator_combinations, QUANTITY_NAMES
 import json
 import orangecanvas.resources as resources
 
@@ -47,6 +49,9 @@ class OWAttenuatorsBox(XoppyWidget):
     FILE_DUMP = 0
 
     MATERIAL_CONSTANT_LIBRARY_FLAG = Setting(0)
+    OPTIMIZE_QUANTITY = Setting(0)
+    OPTIMIZE_MIN = Setting(0.0)
+    OPTIMIZE_MAX = Setting(100.0)
     file_json = '' # os.path.join(resources.package_dirname("orangecontrib.esrf.xoppy.data"), 'bm05_wb_attenuators.json')
     input_spectrum = None
     input_script = None
@@ -174,6 +179,36 @@ class OWAttenuatorsBox(XoppyWidget):
                      valueType=int, orientation="horizontal", labelWidth=250)
         self.show_at(self.unitFlags()[idx], box1)
 
+        # widget index 18
+        idx += 1
+        box1 = gui.widgetBox(box)
+        gui.separator(box1, height=7)
+
+        gui.comboBox(box1, self, "OPTIMIZE_QUANTITY",
+                     label=self.unitLabels()[idx], addSpace=False,
+                     items=QUANTITY_NAMES,
+                     valueType=int, orientation="horizontal", labelWidth=150)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 19
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MIN",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 20
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MAX",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        box1 = gui.widgetBox(box, orientation="horizontal")
+        gui.button(box1, self, "Find filter combinations", callback=self.find_combinations)
+
         self.configure_att_combox()
 
 
@@ -192,7 +227,8 @@ class OWAttenuatorsBox(XoppyWidget):
                 'Energy points:  ',
                 'File with input beam spectral power:',
                 'Att1', 'Att2', 'Att3', 'Att4', 'Att5',
-                'Plot', 'Material data library', 'Dump file']
+                'Plot', 'Material data library', 'Dump file',
+                'Find combinations meeting:', 'Minimum value:', 'Maximum value:']
 
     def unitFlags(self):
         return ['True',
@@ -201,6 +237,7 @@ class OWAttenuatorsBox(XoppyWidget):
                 'self.SOURCE  ==  1',
                 'self.SOURCE  >  1',
                 'self.n_att >= 0', 'self.n_att >= 1', 'self.n_att >= 2', 'self.n_att >= 3', 'self.n_att >= 4',
+                'True', 'True', 'True',
                 'True', 'True', 'True']
 
     def load_config_from_json_file(self):
@@ -430,7 +467,19 @@ class OWAttenuatorsBox(XoppyWidget):
 
         return dens
 
-    def do_xoppy_calculation(self):
+    def att_axes(self):
+        """ All the filters of each axis as lists of layers (substance, thickness, density), and their names """
+        axes = []
+        filter_names = []
+        for att_axis in self.att_dic.keys():
+            n_filters = len([key for key in self.att_dic[att_axis].keys() if key[0] != "_"])
+            filters = [self.att_dic[att_axis][f'filter{i + 1}'] for i in range(n_filters)]
+            axes.append([[(filter['substance'], filter['thickness'], filter['density'])] for filter in filters])
+            filter_names.append([filter['name'] for filter in filters])
+
+        return axes, filter_names
+
+    def get_input_beam(self):
 
         if self.SOURCE == 0:
             if self.input_spectrum is None:
@@ -474,6 +523,31 @@ class OWAttenuatorsBox(XoppyWidget):
                 print("Error loading file %s " % (source_file))
                 raise
 
+        return energies, source, script_previous
+
+    def find_combinations(self):
+        """ Print the filter combinations (one filter per axis) meeting the target, the least attenuating first """
+        try:
+            self.check_fields()
+            energies, source, _ = self.get_input_beam()
+            axes, filter_names = self.att_axes()
+            if self.MATERIAL_CONSTANT_LIBRARY_FLAG == 0:
+                material_constants_library = xraylib
+            else:
+                material_constants_library = DabaxXraylib()
+            combinations = find_attenuator_combinations(energies, source,
+                                                        get_axes_log_transmission(energies, axes, material_constants_library),
+                                                        quantity=self.OPTIMIZE_QUANTITY,
+                                                        minimum=self.OPTIMIZE_MIN,
+                                                        maximum=self.OPTIMIZE_MAX)
+            print(format_attenuator_combinations(combinations, filter_names, quantity=self.OPTIMIZE_QUANTITY))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e.args[0]), QMessageBox.Ok)
+
+    def do_xoppy_calculation(self):
+
+        energies, source, script_previous = self.get_input_beam()
+
         substance = self.att_substance()  # str list of substances
         thick = self.att_thick()  # float list of thickness
         angle = numpy.zeros_like(thick)  # float zeros it does not apply for filter type
@@ -513,7 +587,7 @@ class OWAttenuatorsBox(XoppyWidget):
             material_constants_library_str = 'DabaxXraylib()'
             print(material_constants_library.info())
 
-        out_dictionary = xoppy_calc_power(
+        out_dictionary = xoppy_calc_power_cached(
             energies,
             source,
             substance=substance,
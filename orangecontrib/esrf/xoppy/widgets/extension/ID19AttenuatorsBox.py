@@ -7,10 +7,13 @@ from orangewidget import gui
 from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
+from orangecontrib.esrf.xoppy.util.spectral_algebra import transmission_product, absorbed_fraction, get_element_transmissions
+from orangecontrib.esrf.xoppy.util.attenuator_optimizer import get_axes_log_transmission, find_attenuator_combinations, \
+    format_attenuator_combinations, QUANTITY_NAMES
 
 
 import scipy.constants as codata
@@ -50,6 +53,23 @@ class OWID19AttenuatorsBox(XoppyWidget):
     Au = Setting(0.14)
     PLOT_SETS = Setting(2)
     FILE_DUMP = 0
+    OPTIMIZE_QUANTITY = Setting(0)
+    OPTIMIZE_MIN = Setting(0.0)
+    OPTIMIZE_MAX = Setting(100.0)
+
+    # attenuators box: substance, density and thickness of each position of the attenuators 11 to 25
+    BOX_SUBSTANCES = ['C','Al','Cu','Al','Cu','Cu','Mo','W','W','Au']
+    BOX_DENSITIES = [3.508,2.7,8.96,2.7,8.96,8.96,10.20,19.3,19.3,19.3]
+    BOX_THICKNESSES = [[0.0, 1.4, 2.8, 1.0],
+                       [0.7, 1.4, 2.8, 0.0],
+                       [4.0, 6.0, 8.0, 0.0],
+                       [0.7, 1.4, 2.8, 0.0],
+                       [0.14, 0.35, 1.4, 0.0],
+                       [0.7, 1.4, 2.8, 0.0],
+                       [0.14, 0.35, 0.7, 0.0],
+                       [0.3, 0.5, 1.0, 0.0],
+                       [0.07, 0.14, 0.28, 0.0],
+                       [0.07, 0.14, 0.28, 0.0]]
 
 
     def build_gui(self):
@@ -279,6 +299,37 @@ class OWID19AttenuatorsBox(XoppyWidget):
                     valueType=int, orientation="horizontal", labelWidth=250)
         self.show_at(self.unitFlags()[idx], box1)
 
+        #widget index 43
+        idx += 1
+        box1 = gui.widgetBox(box)
+        gui.separator(box1, height=7)
+
+        gui.comboBox(box1, self, "OPTIMIZE_QUANTITY",
+                     label=self.unitLabels()[idx], addSpace=False,
+                     items=QUANTITY_NAMES,
+                     valueType=int, orientation="horizontal", labelWidth=150)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        #widget index 44
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MIN",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        #widget index 45
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MAX",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        box1 = gui.widgetBox(box, orientation="horizontal")
+        gui.button(box1, self, "Find filter combinations", callback=self.find_combinations)
+        self.show_at("self.FLAG  ==  0", box1)
+
         self.input_spectrum = None
 
 
@@ -305,7 +356,8 @@ class OWID19AttenuatorsBox(XoppyWidget):
                  'thickness of the C attenuator (mm) [diamond]', 'thickness of the Al attenuator (mm)',
                  'thickness of the Cu attenuator (mm)', 'thickness of the Mo attenuator (mm)',
                  'thickness of the W attenuator (mm)', 'thickness of the Au attenuator (mm)',
-                 'Plot','Dump file']
+                 'Plot','Dump file',
+                 'Find combinations meeting:','Minimum value:','Maximum value:']
 
 
     def unitFlags(self):
@@ -316,7 +368,8 @@ class OWID19AttenuatorsBox(XoppyWidget):
                  'self.SOURCE  ==  2',
                  'self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0',
                  'self.FLAG  ==  1','self.FLAG  ==  1','self.FLAG  ==  1','self.FLAG  ==  1','self.FLAG  ==  1','self.FLAG  ==  1',
-                 'True','True']
+                 'True','True',
+                 'self.FLAG  ==  0','self.FLAG  ==  0','self.FLAG  ==  0']
 
     def get_help_name(self):
         return 'ID19AttenuatorsBox'
@@ -514,52 +567,25 @@ class OWID19AttenuatorsBox(XoppyWidget):
     def Attenuators_Thickness(self):
         thick=[]
         if self.FLAG == 0 :
-            if self.ATT11== 0: thick.append(0.0)
-            if self.ATT11== 1: thick.append(1.4)
-            if self.ATT11== 2: thick.append(2.8)
-            if self.ATT11== 3: thick.append(1.0)
-            if self.ATT12== 0: thick.append(0.7)
-            if self.ATT12== 1: thick.append(1.4)
-            if self.ATT12== 2: thick.append(2.8)
-            if self.ATT12== 3: thick.append(0.0)
-            if self.ATT13== 0: thick.append(4.0)
-            if self.ATT13== 1: thick.append(6.0)
-            if self.ATT13== 2: thick.append(8.0)
-            if self.ATT13== 3: thick.append(0.0)
-            if self.ATT14== 0: thick.append(0.7)
-            if self.ATT14== 1: thick.append(1.4)
-            if self.ATT14== 2: thick.append(2.8)
-            if self.ATT14== 3: thick.append(0.0)
-            if self.ATT15== 0: thick.append(0.14)
-            if self.ATT15== 1: thick.append(0.35)
-            if self.ATT15== 2: thick.append(1.4)
-            if self.ATT15== 3: thick.append(0.0)
-            if self.ATT21== 0: thick.append(0.7)
-            if self.ATT21== 1: thick.append(1.4)
-            if self.ATT21== 2: thick.append(2.8)
-            if self.ATT21== 3: thick.append(0.0)
-            if self.ATT22== 0: thick.append(0.14)
-            if self.ATT22== 1: thick.append(0.35)
-            if self.ATT22== 2: thick.append(0.7)
-            if self.ATT22== 3: thick.append(0.0)
-            if self.ATT23== 0: thick.append(0.3)
-            if self.ATT23== 1: thick.append(0.5)
-            if self.ATT23== 2: thick.append(1.0)
-            if self.ATT23== 3: thick.append(0.0)
-            if self.ATT24== 0: thick.append(0.07)
-            if self.ATT24== 1: thick.append(0.14)
-            if self.ATT24== 2: thick.append(0.28)
-            if self.ATT24== 3: thick.append(0.0)
-            if self.ATT25== 0: thick.append(0.07)
-            if self.ATT25== 1: thick.append(0.14)
-            if self.ATT25== 2: thick.append(0.28)
-            if self.ATT25== 3: thick.append(0.0)
+            positions = [self.ATT11, self.ATT12, self.ATT13, self.ATT14, self.ATT15,
+                         self.ATT21, self.ATT22, self.ATT23, self.ATT24, self.ATT25]
+            for i, position in enumerate(positions):
+                thick.append(self.BOX_THICKNESSES[i][int(position)])
         if self.FLAG == 1:
             thick=[self.C,self.Al,self.Cu,self.Mo,self.W,self.Au]
 
         return(thick)
 
+    def att_axes(self):
+        """ All the positions of each attenuator of the box as lists of layers (substance, thickness, density), and their names """
+        axes = []
+        filter_names = []
+        for i, thicknesses in enumerate(self.BOX_THICKNESSES):
+            axes.append([[(self.BOX_SUBSTANCES[i], thickness, self.BOX_DENSITIES[i])] for thickness in thicknesses])
+            filter_names.append(["%s %gmm" % (self.BOX_SUBSTANCES[i], thickness) if thickness > 0 else "None"
+                                 for thickness in thicknesses])
 
+        return axes, filter_names
 
     def xoppy_calc_xpower(self):
 
@@ -568,9 +594,9 @@ class OWID19AttenuatorsBox(XoppyWidget):
         # Note that the input for xpower_calc accepts any number of elements.
         #
         if self.FLAG == 0:
-            substance = ['C','Al','Cu','Al','Cu','Cu','Mo','W','W','Au']
+            substance = self.BOX_SUBSTANCES
             thick     = self.Attenuators_Thickness()
-            dens      = [3.508,2.7,8.96,2.7,8.96,8.96,10.20,19.3,19.3,19.3]
+            dens      = self.BOX_DENSITIES
             flags     = [0,0,0,0,0,0,0,0,0,0]
             
         if self.FLAG == 1:
@@ -581,37 +607,16 @@ class OWID19AttenuatorsBox(XoppyWidget):
 
         cumulated_data = {}
         Result=[]
-        Result_Absorption=[]
 
-        if self.SOURCE == 0:
-            if self.input_spectrum is None:
-                raise Exception("No input beam")
-            else:
-                energies = self.input_spectrum[0,:].copy()
-                source = self.input_spectrum[1,:].copy()
-        elif self.SOURCE == 1:
-            energies = numpy.linspace(self.ENER_MIN,self.ENER_MAX,self.ENER_N)
-            source = numpy.ones(energies.size)
-            tmp = numpy.vstack( (energies,source))
-            self.input_spectrum = source
-        elif self.SOURCE == 2:
-            if self.SOURCE == 2: source_file = self.SOURCE_FILE
-            try:
-                tmp = numpy.loadtxt(source_file)
-                energies = tmp[:,0]
-                source = tmp[:,1]
-                self.input_spectrum = source
-            except:
-                print("Error loading file %s "%(source_file))
-                raise
+        energies, source = self.get_input_beam()
 
         if self.FILE_DUMP == 0:
             output_file = None
         else:
             output_file = "power.spec"
-        out_dictionary = xoppy_calc_power(energies=energies, source=source, substance=substance, nelements=len(substance),
-                                      flags=flags, dens=dens, thick=thick,angle=[],
-                                      roughness=[], FILE_DUMP = output_file, material_constants_library=xraylib)
+        out_dictionary = xoppy_calc_power_cached(energies=energies, source=source, substance=substance, nelements=len(substance),
+                                             flags=flags, dens=dens, thick=thick,angle=[],
+                                             roughness=[], FILE_DUMP = output_file, material_constants_library=xraylib)
 
         try:
             print(out_dictionary["info"])
@@ -620,20 +625,9 @@ class OWID19AttenuatorsBox(XoppyWidget):
         #calculate attenuators total
         Result.append((out_dictionary['data'][0]).tolist())
         Result.append((out_dictionary['data'][1]).tolist())
-        #list2=[]
-        #list3=[]
-        list4=[]
-        for k in range(len(substance)):
-            #list2.append(out_dictionary['data'][2 + 5*k])
-            #list3.append(out_dictionary['data'][3 + 5*k])
-            list4.append(out_dictionary['data'][4 + 6*k])
-        #Result.append(List_Product(list2))
-        #Result.append(List_Product(list3))
-        Result.append(List_Product(list4))
-
-        for k in range(len(Result[0])):
-            Result_Absorption.append(1-Result[-1][k])
-        Result.append(Result_Absorption)
+        transmissions = get_element_transmissions(out_dictionary['data'], len(substance))
+        Result.append(transmission_product(transmissions))
+        Result.append(absorbed_fraction(transmissions))
 
         Result.append((out_dictionary['data'][6*len(substance)+1]).tolist())
         cumulated_data['data']=numpy.array(Result)
@@ -646,15 +640,48 @@ class OWID19AttenuatorsBox(XoppyWidget):
             pass
         return calculated_data
 
-def List_Product(list):
-    L = []
-    l = 1
-    for k in range(len(list[0])):
-        for i in range(len(list)):
-            l = l * list[i][k]
-        L.append(l)
-        l = 1
-    return (L)
+    def get_input_beam(self):
+
+        if self.SOURCE == 0:
+            if self.input_spectrum is None:
+                raise Exception("No input beam")
+            else:
+                energies = self.input_spectrum[0,:].copy()
+                source = self.input_spectrum[1,:].copy()
+        elif self.SOURCE == 1:
+            energies = numpy.linspace(self.ENER_MIN,self.ENER_MAX,self.ENER_N)
+            source = numpy.ones(energies.size)
+            tmp = numpy.vstack( (energies,source))
+            self.input_spectrum = source
+        elif self.SOURCE == 2:
+            if self.SOURCE == 2: source_file = self.SOURCE_FILE
+            try:
+                tmp = numpy.loadtxt(source_file)
+                energies = tmp[:,0]
+                source = tmp[:,1]
+                self.input_spectrum = source
+            except:
+                print("Error loading file %s "%(source_file))
+                raise
+
+        return energies, source
+
+    def find_combinations(self):
+        """ Print the combinations of the attenuators of the box meeting the target, the least attenuating first """
+        try:
+            if self.FLAG != 0: raise Exception("The search of combinations is only available for the attenuators box")
+            self.check_fields()
+            energies, source = self.get_input_beam()
+            axes, filter_names = self.att_axes()
+            combinations = find_attenuator_combinations(energies, source,
+                                                        get_axes_log_transmission(energies, axes, xraylib),
+                                                        quantity=self.OPTIMIZE_QUANTITY,
+                                                        minimum=self.OPTIMIZE_MIN,
+                                                        maximum=self.OPTIMIZE_MAX)
+            print(format_attenuator_combinations(combinations, filter_names, quantity=self.OPTIMIZE_QUANTITY))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e.args[0]), QMessageBox.Ok)
+
 
 if __name__ == "__main__":
 
@@ -6,10 +6,12 @@ from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
 
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
+from orangecontrib.esrf.xoppy.util.attenuator_optimizer import get_axes_log_transmission, find_attenuator_combinations, \
+    format_attenuator_combinations, QUANTITY_NAMES
 
 import scipy.constants as codata
 
@@ -41,6 +43,9 @@ class OWID24HPAttenuators(XoppyWidget):
     FILE_DUMP = 0
 
     MATERIAL_CONSTANT_LIBRARY_FLAG = Setting(0) # not yet interfaced, to be done
+    OPTIMIZE_QUANTITY = Setting(0)
+    OPTIMIZE_MIN = Setting(0.0)
+    OPTIMIZE_MAX = Setting(100.0)
 
     input_spectrum = None
     input_script = None
@@ -105,7 +110,7 @@ class OWID24HPAttenuators(XoppyWidget):
         box1 = gui.widgetBox(box)
         gui.comboBox(box1, self, "Axis1",
                      label=self.unitLabels()[idx], addSpace=False,
-                    items=['None', 'Diam: 0.3 mm','PyroC: 3 mm', 'Diam: 0.3 mm'],
+                    items=[name for name, layers in self.AXES_FILTERS[0]],
                     valueType=str, orientation="horizontal", labelWidth=250, callback=self.set_EL_FLAG)
         self.show_at(self.unitFlags()[idx], box1)
 
@@ -114,7 +119,7 @@ class OWID24HPAttenuators(XoppyWidget):
         box1 = gui.widgetBox(box)
         gui.comboBox(box1, self, "Axis2",
                      label=self.unitLabels()[idx], addSpace=False,
-                    items=['None', 'Al: 0.5 mm + BlackDiam: 0.5 mm','PyroC: 1 mm + BlackDiam: 0.5 mm', 'PyroC: 2 mm + PyroC: 0.5 mm'],
+                    items=[name for name, layers in self.AXES_FILTERS[1]],
                     valueType=str, orientation="horizontal", labelWidth=175, callback=self.set_EL_FLAG)
         self.show_at(self.unitFlags()[idx], box1)
 
@@ -123,7 +128,7 @@ class OWID24HPAttenuators(XoppyWidget):
         box1 = gui.widgetBox(box)
         gui.comboBox(box1, self, "Axis3",
                      label=self.unitLabels()[idx], addSpace=False,
-                    items=['None', 'Al: 1 mm + BlackDiam: 0.5 mm', 'PyroC: 0.5 mm + BlackDiam: 0.5 mm', 'PyroC: 3 mm'],
+                    items=[name for name, layers in self.AXES_FILTERS[2]],
                     valueType=str, orientation="horizontal", labelWidth=150, callback=self.set_EL_FLAG)
         self.show_at(self.unitFlags()[idx], box1)        
 
@@ -149,6 +154,36 @@ class OWID24HPAttenuators(XoppyWidget):
                     valueType=int, orientation="horizontal", labelWidth=250)
         self.show_at(self.unitFlags()[idx], box1)
 
+        # widget index 15
+        idx += 1
+        box1 = gui.widgetBox(box)
+        gui.separator(box1, height=7)
+
+        gui.comboBox(box1, self, "OPTIMIZE_QUANTITY",
+                     label=self.unitLabels()[idx], addSpace=False,
+                     items=QUANTITY_NAMES,
+                     valueType=int, orientation="horizontal", labelWidth=150)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 16
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MIN",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 17
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "OPTIMIZE_MAX",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=float, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        box1 = gui.widgetBox(box, orientation="horizontal")
+        gui.button(box1, self, "Find filter combinations", callback=self.find_combinations)
+
         #self.input_spectrum = None
 
     def select_input_file(self):
@@ -166,7 +201,8 @@ class OWID24HPAttenuators(XoppyWidget):
                  'Energy points:  ',
                  'File with input beam spectral power:',
                  'Axis1','Axis2','Axis3',                                  
-                 'Plot','Dump file']
+                 'Plot','Dump file',
+                 'Find combinations meeting:','Minimum value:','Maximum value:']
 
 
     def unitFlags(self):
@@ -176,7 +212,8 @@ class OWID24HPAttenuators(XoppyWidget):
                  'self.SOURCE  ==  1',
                  'self.SOURCE  >  1',
                  'True','True','True',                 
-                 'True','True']
+                 'True','True',
+                 'True','True','True']
 
     def get_help_name(self):
         return 'power'
@@ -286,70 +323,50 @@ class OWID24HPAttenuators(XoppyWidget):
 
     ### Input for each axis of HP attenuators    
 
+    # filters of each axis: name and layers (substance, thickness [mm], density [g/cm3])
+    AXES_FILTERS = [
+        [('None', [('C', 0.0, 3.52)]),
+         ('Diam: 0.3 mm', [('C', 0.3, 3.52)]),
+         ('PyroC: 3 mm', [('C', 3.0, 1.40)]),
+         ('Diam: 0.3 mm', [('C', 0.3, 3.52)])],
+        [('None', [('C', 0.0, 3.52)]),
+         ('Al: 0.5 mm + BlackDiam: 0.5 mm', [('Al', 0.5, 2.7), ('C', 0.5, 3.5)]),
+         ('PyroC: 1 mm + BlackDiam: 0.5 mm', [('C', 1.0, 1.4), ('C', 0.5, 3.5)]),
+         ('PyroC: 2 mm + PyroC: 0.5 mm', [('C', 2.0, 1.4), ('C', 0.5, 1.4)])],
+        [('None', [('C', 0.0, 3.52)]),
+         ('Al: 1 mm + BlackDiam: 0.5 mm', [('Al', 1.0, 2.7), ('C', 0.5, 3.5)]),
+         ('PyroC: 0.5 mm + BlackDiam: 0.5 mm', [('C', 0.5, 1.4), ('C', 0.5, 3.5)]),
+         ('PyroC: 3 mm', [('C', 3.0, 1.4)])],
+        ]
+
+    def att_layers(self):
+        """ Layers (substance, thickness, density) of the selected filter of each axis """
+        layers = []
+        for axis, position in enumerate([self.Axis1, self.Axis2, self.Axis3]):
+            layers.extend(self.AXES_FILTERS[axis][int(position)][1])
+
+        return layers
+
     def att_substance(self):
         """ Substance (or material) for each axis """
-        substance=[]
-        # Axis 1
-        if self.Axis1 == 0: substance.append('C') #None
-        if self.Axis1 == 1: substance.append('C') #Diamond
-        if self.Axis1 == 2: substance.append('C') #PyroC
-        if self.Axis1 == 3: substance.append('C') #Diamond
-        # Axis 2
-        if self.Axis2 == 0: substance.append('C')          #None
-        if self.Axis2 == 1: substance.extend(('Al', 'C'))  #Alu + Black Diamond 
-        if self.Axis2 == 2: substance.extend(('C', 'C'))   #PyroC + Black Diamond
-        if self.Axis2 == 3: substance.extend(('C', 'C'))   #PyroC + PyroC
-        # Axis 3
-        if self.Axis3 == 0: substance.append('C')          #None
-        if self.Axis3 == 1: substance.extend(('Al', 'C'))  #Alu + Black Diamond  
-        if self.Axis3 == 2: substance.extend(('C', 'C'))   #PyroC + Black Diamond
-        if self.Axis3 == 3: substance.append('C')          #PyroC
-
-        return substance
+        return [layer[0] for layer in self.att_layers()]
     
     def att_thick(self):
         """ Thickness of each attenuator at a given axis """
-        thick=[]
-        # Axis 1
-        if self.Axis1 == 0: thick.append(0.0) #None
-        if self.Axis1 == 1: thick.append(0.3) #Diamond
-        if self.Axis1 == 2: thick.append(3.0) #PyroC
-        if self.Axis1 == 3: thick.append(0.3) #Diamond
-        # Axis 2
-        if self.Axis2 == 0: thick.append(0.0)        #None
-        if self.Axis2 == 1: thick.extend((0.5, 0.5)) #Al + Black Diamond 
-        if self.Axis2 == 2: thick.extend((1.0, 0.5)) #PyroC + Black Diamond
-        if self.Axis2 == 3: thick.extend((2.0, 0.5)) #PyroC + PyroC
-        # Axis 3
-        if self.Axis3 == 0: thick.append(0.0)        #None        
-        if self.Axis3 == 1: thick.extend((1.0, 0.5)) #Al + Black Diamond        
-        if self.Axis3 == 2: thick.extend((0.5, 0.5)) #PyroC + Black Diamond
-        if self.Axis3 == 3: thick.append(3.0)        #PyroC
-
-        return thick    
+        return [layer[1] for layer in self.att_layers()]
 
     def att_dens(self):
         """ Particular density of each attenuator at a given axis """
-        dens = []
-        # Axis 1
-        if self.Axis1 == 0: dens.append(3.52) #None
-        if self.Axis1 == 1: dens.append(3.52) #Diamond
-        if self.Axis1 == 2: dens.append(1.40) #PyroC
-        if self.Axis1 == 3: dens.append(3.52) #Diamond
-        # Axis 2
-        if self.Axis2 == 0: dens.append(3.52)       #None
-        if self.Axis2 == 1: dens.extend((2.7, 3.5)) #Alu + Black Diamond 
-        if self.Axis2 == 2: dens.extend((1.4, 3.5)) #PyroC + Black Diamond
-        if self.Axis2 == 3: dens.extend((1.4, 1.4)) #PyroC + PyroC
-        # Axis 3
-        if self.Axis3 == 0: dens.append(3.52)       #None        
-        if self.Axis3 == 1: dens.extend((2.7, 3.5)) #Alu + Black Diamond  
-        if self.Axis3 == 2: dens.extend((1.4, 3.5)) #PyroC + Black Diamond
-        if self.Axis3 == 3: dens.append(1.4)        #PyroC       
-
-        return dens        
+        return [layer[2] for layer in self.att_layers()]
 
-    def do_xoppy_calculation(self):
+    def att_axes(self):
+        """ All the filters of each axis as lists of layers (substance, thickness, density), and their names """
+        axes = [[layers for name, layers in axis] for axis in self.AXES_FILTERS]
+        filter_names = [[name for name, layers in axis] for axis in self.AXES_FILTERS]
+
+        return axes, filter_names
+
+    def get_input_beam(self):
 
         if self.SOURCE == 0:
             if self.input_spectrum is None:
@@ -391,7 +408,32 @@ class OWID24HPAttenuators(XoppyWidget):
                                 (source_file)
             except:
                 print("Error loading file %s "%(source_file))
-                raise        
+                raise
+
+        return energies, source, script_previous
+
+    def find_combinations(self):
+        """ Print the filter combinations (one filter per axis) meeting the target, the least attenuating first """
+        try:
+            self.check_fields()
+            energies, source, _ = self.get_input_beam()
+            axes, filter_names = self.att_axes()
+            if self.MATERIAL_CONSTANT_LIBRARY_FLAG == 0:
+                material_constants_library = xraylib
+            else:
+                material_constants_library = DabaxXraylib()
+            combinations = find_attenuator_combinations(energies, source,
+                                                        get_axes_log_transmission(energies, axes, material_constants_library),
+                                                        quantity=self.OPTIMIZE_QUANTITY,
+                                                        minimum=self.OPTIMIZE_MIN,
+                                                        maximum=self.OPTIMIZE_MAX)
+            print(format_attenuator_combinations(combinations, filter_names, quantity=self.OPTIMIZE_QUANTITY))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e.args[0]), QMessageBox.Ok)
+
+    def do_xoppy_calculation(self):
+
+        energies, source, script_previous = self.get_input_beam()
 
         substance = self.att_substance()  # str
         thick     = self.att_thick() # float
@@ -431,7 +473,7 @@ class OWID24HPAttenuators(XoppyWidget):
             material_constants_library_str = 'DabaxXraylib()'
             print(material_constants_library.info())
 
-        out_dictionary = xoppy_calc_power(
+        out_dictionary = xoppy_calc_power_cached(
             energies,
             source,
             substance                  = substance,
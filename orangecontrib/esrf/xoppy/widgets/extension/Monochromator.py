@@ -8,12 +8,10 @@ from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
 
-from crystalpy.diffraction.GeometryType import BraggDiffraction, LaueDiffraction
-from crystalpy.diffraction.DiffractionSetupXraylib import DiffractionSetupXraylib
-from crystalpy.diffraction.Diffraction import Diffraction
 import scipy.constants as codata
-from crystalpy.util.Vector import Vector
-from crystalpy.util.Photon import Photon
+from orangecontrib.esrf.xoppy.util.crystal_reflectivity import calculate_crystal_reflectivity, get_reflectivity_from_lut
+from orangecontrib.esrf.xoppy.util.crystal_reflectivity import BRAGG, LAUE
+from orangecontrib.esrf.xoppy.util.spectral_algebra import transmission_product
 
 
 class Monochromator(XoppyWidget):
@@ -40,6 +38,8 @@ class Monochromator(XoppyWidget):
     SOURCE_FILE = Setting("?")
     FILE_DUMP = Setting(0)
     METHOD = Setting(0)                # Zachariasen
+    NUMBER_OF_PROCESSES = Setting(1)
+    USE_LUT = Setting(0)
 
     def build_gui(self):
 
@@ -166,6 +166,23 @@ class Monochromator(XoppyWidget):
                      orientation="horizontal")
         self.show_at(self.unitFlags()[idx], box1)
 
+        # widget index 14
+        idx += 1
+        box1 = gui.widgetBox(box)
+        oasysgui.lineEdit(box1, self, "NUMBER_OF_PROCESSES",
+                          label=self.unitLabels()[idx], addSpace=False,
+                          valueType=int, orientation="horizontal", labelWidth=250)
+        self.show_at(self.unitFlags()[idx], box1)
+
+        # widget index 15
+        idx += 1
+        box1 = gui.widgetBox(box)
+        gui.comboBox(box1, self, "USE_LUT",
+                     label=self.unitLabels()[idx], addSpace=True,
+                     items=["Calculate", "Lookup table (built if missing)"],
+                     orientation="horizontal")
+        self.show_at(self.unitFlags()[idx], box1)
+
         self.input_spectrum = None
 
 
@@ -186,7 +203,9 @@ class Monochromator(XoppyWidget):
                  'Energy Selected [eV]',
                  'miller index h','miller index k','miller index l','Crystal thickness [microns]',
                  "Dump file",
-                 "Calculation method"]
+                 "Calculation method",
+                 "Number of processes",
+                 "Reflectivity"]
 
 
     def unitFlags(self):
@@ -200,7 +219,9 @@ class Monochromator(XoppyWidget):
                  'self.TYPE  ==  1 or self.TYPE  ==  2','self.TYPE  ==  1 or self.TYPE  ==  2','self.TYPE  ==  1 or self.TYPE  ==  2',
                  'self.TYPE  ==  2',
                  'True',
-                 'True']
+                 'True',
+                 'self.TYPE  ==  1 or self.TYPE  ==  2',
+                 'self.TYPE  ==  1 or self.TYPE  ==  2']
 
     def get_help_name(self):
         return 'Monochromator'
@@ -299,6 +320,9 @@ class Monochromator(XoppyWidget):
         if self.TYPE == 3:
             self.ENER_SELECTED = congruence.checkPositiveNumber(self.ENER_SELECTED, "Energy Selected [eV]")
 
+        if self.TYPE == 1 or self.TYPE == 2:
+            self.NUMBER_OF_PROCESSES = congruence.checkStrictlyPositiveNumber(self.NUMBER_OF_PROCESSES, "Number of processes")
+
         if self.SOURCE == 1:
             self.ENER_MIN = congruence.checkPositiveNumber(self.ENER_MIN, "Energy from")
             self.ENER_MAX = congruence.checkStrictlyPositiveNumber(self.ENER_MAX, "Energy to")
@@ -335,129 +359,31 @@ class Monochromator(XoppyWidget):
 
     def calculate_bragg_dcm(self, h_miller=1, k_miller=1, l_miller=1,
                             energy_setup=8000.0, energies=numpy.linspace(7900, 8100, 200)):
-
-        energy_setup = self.ENER_SELECTED
-        r = numpy.zeros_like(energies)
-        harmonic = 1
-
-        diffraction_setup_r = DiffractionSetupXraylib(geometry_type=BraggDiffraction(),  # GeometryType object
-                                               crystal_name="Si",  # string
-                                               thickness=1,  # meters
-                                               miller_h=harmonic * h_miller,  # int
-                                               miller_k=harmonic * k_miller,  # int
-                                               miller_l=harmonic * l_miller,  # int
-                                               asymmetry_angle=0,  # 10.0*numpy.pi/180.,            # radians
-                                               azimuthal_angle=0.0)  # radians                            # int
-
-
-        bragg_angle = diffraction_setup_r.angleBragg(energy_setup)
-        print("Bragg angle for Si%d%d%d at E=%f eV is %f deg" % (
-            h_miller, k_miller, l_miller, energy_setup, bragg_angle * 180.0 / numpy.pi))
-        nharmonics = int( energies.max() / energy_setup)
-
-        if nharmonics < 1:
-            nharmonics = 1
-        print("Calculating %d harmonics" % nharmonics)
-
-        for harmonic in range(1,nharmonics+1,2): # calculate only odd harmonics
-            print("\nCalculating harmonic: ", harmonic)
-            ri = numpy.zeros_like(energies)
-            for i in range(energies.size):
-                try:
-                    diffraction_setup_r = DiffractionSetupXraylib(geometry_type=BraggDiffraction(),  # GeometryType object
-                                                           crystal_name="Si",  # string
-                                                           thickness=1,  # meters
-                                                           miller_h=harmonic * h_miller,  # int
-                                                           miller_k=harmonic * k_miller,  # int
-                                                           miller_l=harmonic * l_miller,  # int
-                                                           asymmetry_angle=0,  # 10.0*numpy.pi/180.,            # radians
-                                                           azimuthal_angle=0.0)  # radians                            # int
-
-                    diffraction = Diffraction()
-
-                    energy = energies[i]
-                    deviation = 0.0  # angle_deviation_min + ia * angle_step
-                    angle = deviation + bragg_angle
-
-                    # calculate the components of the unitary vector of the incident photon scan
-                    # Note that diffraction plane is YZ
-                    yy = numpy.cos(angle)
-                    zz = - numpy.abs(numpy.sin(angle))
-                    photon = Photon(energy_in_ev=energy, direction_vector=Vector(0.0, yy, zz))
-
-                    # perform the calculation
-                    coeffs_r = diffraction.calculateDiffractedComplexAmplitudes(diffraction_setup_r, photon, calculation_method=self.METHOD)
-                    # note the power 4 to get intensity (**2) for a double reflection (**2)
-
-                    r[i] += numpy.abs( coeffs_r['S'] ) ** 4
-                    ri[i] = numpy.abs( coeffs_r['S'] ) ** 4
-                except:
-                    print("Failed to calculate reflectivity at E=%g eV for %d%d%d reflection" % (energy,
-                                            harmonic*h_miller, harmonic*k_miller, harmonic*l_miller))
-            print("Max reflectivity: ", ri.max(), " at energy: ", energies[ri.argmax()])
+        # note the power 4 to get intensity (**2) for a double reflection (**2)
+        if self.USE_LUT:
+            return get_reflectivity_from_lut(energies, energy_setup=self.ENER_SELECTED,
+                                             h_miller=h_miller, k_miller=k_miller, l_miller=l_miller,
+                                             geometry=BRAGG, method=self.METHOD, number_of_reflections=2,
+                                             number_of_processes=self.NUMBER_OF_PROCESSES)
+        r = calculate_crystal_reflectivity(energies, energy_setup=self.ENER_SELECTED,
+                                           h_miller=h_miller, k_miller=k_miller, l_miller=l_miller,
+                                           geometry=BRAGG, method=self.METHOD, number_of_reflections=2,
+                                           number_of_processes=self.NUMBER_OF_PROCESSES)
         print("\n\n\n")
         return r
 
     def calculate_laue_monochromator(self, h_miller=1, k_miller=1, l_miller=1,
                             energy_setup=8000.0, energies=numpy.linspace(7900, 8100, 200)):
-
-        energy_setup = self.ENER_SELECTED
-        r = numpy.zeros_like(energies)
-        harmonic = 1
-        diffraction_setup_r = DiffractionSetupXraylib(geometry_type=LaueDiffraction(),  # GeometryType object
-                                               crystal_name="Si",  # string
-                                               thickness=self.THICK*1e-6,  # meters
-                                               miller_h=harmonic * h_miller,  # int
-                                               miller_k=harmonic * k_miller,  # int
-                                               miller_l=harmonic * l_miller,  # int
-                                               asymmetry_angle=numpy.pi/2,  # 10.0*numpy.pi/180.,            # radians
-                                               azimuthal_angle=0)  # radians                            # int
-
-
-        bragg_angle = diffraction_setup_r.angleBragg(energy_setup)
-        print("Bragg angle for Si%d%d%d at E=%f eV is %f deg" % (
-            h_miller, k_miller, l_miller, energy_setup, bragg_angle * 180.0 / numpy.pi))
-        nharmonics = int( energies.max() / energy_setup)
-
-        if nharmonics < 1:
-            nharmonics = 1
-        print("Calculating %d harmonics" % nharmonics)
-
-        for harmonic in range(1, nharmonics+1, 2): # calculate only odd harmonics
-            print("\nCalculating harmonic: ", harmonic)
-            ri = numpy.zeros_like(energies)
-            for i in range(energies.size):
-                try:
-                    diffraction_setup_r = DiffractionSetupXraylib(geometry_type=LaueDiffraction(),  # GeometryType object
-                                                           crystal_name="Si",  # string
-                                                           thickness=self.THICK*1e-6,  # meters
-                                                           miller_h=harmonic * h_miller,  # int
-                                                           miller_k=harmonic * k_miller,  # int
-                                                           miller_l=harmonic * l_miller,  # int
-                                                           asymmetry_angle=numpy.pi/2,  # 10.0*numpy.pi/180.,            # radians
-                                                           azimuthal_angle=0)  # radians                            # int
-
-                    diffraction = Diffraction()
-
-                    energy = energies[i]
-                    deviation = 0.0  # angle_deviation_min + ia * angle_step
-                    angle = deviation + numpy.pi/2 + bragg_angle
-
-                    # calculate the components of the unitary vector of the incident photon scan
-                    # Note that diffraction plane is YZ
-                    yy = numpy.cos(angle)
-                    zz = - numpy.abs(numpy.sin(angle))
-                    photon = Photon(energy_in_ev=energy, direction_vector=Vector(0.0, yy, zz))
-
-                    # perform the calculation
-                    coeffs_r = diffraction.calculateDiffractedComplexAmplitudes(diffraction_setup_r, photon, calculation_method=self.METHOD)
-                    # note the power 2 to get intensity
-                    r[i] += numpy.abs( coeffs_r['S'] ) ** 2
-                    ri[i] = numpy.abs( coeffs_r['S'] ) ** 2
-                except:
-                    print("Failed to calculate reflectivity at E=%g eV for %d%d%d reflection" % (energy,
-                                            harmonic*h_miller, harmonic*k_miller, harmonic*l_miller))
-            print("Max reflectivity: ", ri.max(), " at energy: ", energies[ri.argmax()])
+        # note the power 2 to get intensity
+        if self.USE_LUT:
+            return get_reflectivity_from_lut(energies, energy_setup=self.ENER_SELECTED,
+                                             h_miller=h_miller, k_miller=k_miller, l_miller=l_miller,
+                                             geometry=LAUE, thickness=self.THICK*1e-6, method=self.METHOD,
+                                             number_of_reflections=1, number_of_processes=self.NUMBER_OF_PROCESSES)
+        r = calculate_crystal_reflectivity(energies, energy_setup=self.ENER_SELECTED,
+                                           h_miller=h_miller, k_miller=k_miller, l_miller=l_miller,
+                                           geometry=LAUE, thickness=self.THICK*1e-6, method=self.METHOD,
+                                           number_of_reflections=1, number_of_processes=self.NUMBER_OF_PROCESSES)
         print("\n\n\n")
         return r
 
@@ -496,7 +422,7 @@ class Monochromator(XoppyWidget):
             Mono_Effect = [1] * len(energies)
 
 
-        Final_Spectrum=List_Product([source,Mono_Effect])
+        Final_Spectrum=transmission_product([source,Mono_Effect])
 
         Output=[]
         Output.append(energies.tolist())
@@ -534,16 +460,6 @@ class Monochromator(XoppyWidget):
 
         return calculated_data
 
-def List_Product(list):
-    L = []
-    l = 1
-    for k in range(len(list[0])):
-        for i in range(len(list)):
-            l = l * list[i][k]
-        L.append(l)
-        l = 1
-    return (L)
-
 if __name__ == "__main__":
 
     from oasys.widgets.exchange import DataExchangeObject
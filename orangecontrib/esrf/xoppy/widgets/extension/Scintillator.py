@@ -7,10 +7,11 @@ from orangewidget import gui
 from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
+from orangecontrib.esrf.xoppy.util.spectral_algebra import transmission_product
 
 
 import scipy.constants as codata
@@ -387,15 +388,15 @@ class Scintillator(XoppyWidget):
             output_file = "Scinti.spec"
             
 
-        out_dictionary = xoppy_calc_power(energies=energies, source=source, substance=substance,
-                                     flags=flags, dens=dens, thick=thick, angle=[], roughness=[], material_constants_library=xraylib)
+        out_dictionary = xoppy_calc_power_cached(energies=energies, source=source, substance=substance,
+                                            flags=flags, dens=dens, thick=thick, angle=[], roughness=[], material_constants_library=xraylib)
 
         L=[]
         for k in range (5):
             L.append((out_dictionary['data'][k]).tolist())
         L.append(self.correction(L[0],(out_dictionary['data'][5]).tolist()))
         L.append((out_dictionary['data'][6]).tolist())
-        L.append(List_Product([L[5],L[1]]))
+        L.append(transmission_product([L[5],L[1]]))
         out_dictionary['data']=numpy.array(L)
 
         try:
@@ -423,17 +424,6 @@ class Scintillator(XoppyWidget):
         return calculated_data
 
 
-def List_Product(list):
-    L = []
-    l = 1
-    for k in range(len(list[0])):
-        for i in range(len(list)):
-            l = l * list[i][k]
-        L.append(l)
-        l = 1
-    return (L)
-
-
 if __name__ == "__main__":
 
     from oasys.widgets.exchange import DataExchangeObject
@@ -7,10 +7,11 @@ from orangewidget import gui
 from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui, congruence
 from oasys.widgets.exchange import DataExchangeObject
-from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.material_constants_cache import xoppy_calc_power_cached
 
 from oasys.widgets.exchange import DataExchangeObject
 from orangecontrib.xoppy.widgets.gui.ow_xoppy_widget import XoppyWidget
+from orangecontrib.esrf.xoppy.util.spectral_algebra import identical_elements_power
 
 
 import scipy.constants as codata
@@ -288,24 +289,39 @@ class Transfocator(XoppyWidget):
     def getLogPlot(self):
         return [(False,False),(False, False),(False, False),(False,False)]
 
+    # power versus the number of lenses (content "xoppy_lenses"), in tabs after the ones of getTitles
+    def getLensesTitles(self):
+        return ["Transmitted Power", "Absorbed Power"]
 
-    def xoppy_calc_xpower(self):
+    def getLensesYTitles(self):
+        return ["Transmitted power fraction", "Absorbed power fraction"]
+
+    def initializeTabs(self):
+        super().initializeTabs()
+
+        for title in self.getLensesTitles():
+            self.tab.append(oasysgui.createTabPage(self.tabs, title))
+            self.plot_canvas.append(None)
+            self.tab[-1].setFixedHeight(self.IMAGE_HEIGHT)
+            self.tab[-1].setFixedWidth(self.IMAGE_WIDTH)
 
-        Result=[]
-        Result_Absorption = []
-        list=[]
-        cumulated_data = {}
+    def plot_results(self, calculated_data, progressBarValue=80):
+        super().plot_results(calculated_data, progressBarValue=progressBarValue)
 
-        substance = []
-        thick = []
-        dens = []
-        flags = []
+        if not self.view_type == 0 and not calculated_data is None:
+            xoppy_lenses = calculated_data.get_content("xoppy_lenses")
+            for k, (title, ytitle) in enumerate(zip(self.getLensesTitles(), self.getLensesYTitles())):
+                index = len(self.getTitles()) + k
+                self.plot_histo(xoppy_lenses[:, 0], xoppy_lenses[:, k + 1], 100, tabs_canvas_index=index,
+                                plot_canvas_index=index, title=title, xtitle="Number of lenses", ytitle=ytitle)
+
+    def xoppy_calc_xpower(self):
 
-        for k in range (self.NUMBER_LENS) :
-            substance.append(self.SUBSTANCE)
-            thick.append(self.THICK)
-            dens.append(self.DENS)
-            flags.append(0)
+        # the lenses are identical: the transmission of one lens is calculated and the stack of N lenses is T**N
+        substance = [self.SUBSTANCE]
+        thick = [self.THICK]
+        dens = [self.DENS]
+        flags = [0]
 
 
         if self.SOURCE == 0:
@@ -335,48 +351,27 @@ class Transfocator(XoppyWidget):
         else:
             output_file = "Transfo.spec"
 
-        out_dictionary = xoppy_calc_power(energies=energies, source=source, substance=substance, nelements=len(substance), 
-                                          flags=flags, dens=dens, thick=thick, angle=[], roughness=[], material_constants_library=xraylib)
+        out_dictionary = xoppy_calc_power_cached(energies=energies, source=source.copy(), substance=substance, nelements=len(substance), 
+                                                 flags=flags, dens=dens, thick=thick, angle=[], roughness=[], material_constants_library=xraylib)
 
         try:
             print(out_dictionary["info"])
         except:
             pass
 
-        #calculate attenuators total
-        Result.append((out_dictionary['data'][0]).tolist())
-        Result.append((out_dictionary['data'][1]).tolist())
-        for k in range(self.NUMBER_LENS):
-            list.append(out_dictionary['data'][4 + 6*k])
-        Result.append(List_Product(list))
-
-        for k in range(len(Result[0])):
-            Result_Absorption.append(1-Result[-1][k])
-        Result.append(Result_Absorption)
-
-        Result.append((out_dictionary['data'][6*len(substance)+1]).tolist())
-        cumulated_data['data']=numpy.array(Result)
+        #calculate attenuators total, and the power versus the number of lenses
+        spectra, lenses = identical_elements_power(out_dictionary['data'], self.NUMBER_LENS)
 
         #send exchange
         calculated_data = DataExchangeObject("XOPPY", self.get_data_exchange_widget_name())
         try:
-            calculated_data.add_content("xoppy_data", cumulated_data["data"].T)
+            calculated_data.add_content("xoppy_data", spectra.T)
+            calculated_data.add_content("xoppy_lenses", lenses.T)
         except:
             pass
         return calculated_data
 
 
-def List_Product(list):
-    L = []
-    l = 1
-    for k in range(len(list[0])):
-        for i in range(len(list)):
-            l = l * list[i][k]
-        L.append(l)
-        l = 1
-    return (L)
-
-
 if __name__ == "__main__":
 
     from oasys.widgets.exchange import DataExchangeObject
@@ -38,6 +38,8 @@ class PowerLoadPythonScript(widget.OWWidget):
     e_min = Setting(500)
     e_max = Setting(100000)
     e_points = Setting(200)
+    use_flux_cube = Setting(0)
+    number_of_workers = Setting(1)
 
     #
     #
@@ -117,6 +119,14 @@ class PowerLoadPythonScript(widget.OWWidget):
         oasysgui.lineEdit(box3, self, "e_points", "Photon Energy Points", labelWidth=150, valueType=int,
                           orientation="horizontal", callback=self.refresh_script)
 
+        gui.comboBox(box3, self, "use_flux_cube", label="Power through apertures", labelWidth=150,
+                     items=["Undulator spectrum per element", "Single flux cube (6 sigma aperture)"],
+                     valueType=int, orientation="horizontal", callback=self.refresh_script)
+
+        oasysgui.lineEdit(box3, self, "number_of_workers", "Parallel workers (elements)", labelWidth=150, valueType=int,
+                          orientation="horizontal", callback=self.refresh_script,
+                          tooltip="Used when the script is run as a file with METHOD=2 (SRW), otherwise sequential")
+
         #
         #
         #
@@ -152,6 +162,7 @@ class PowerLoadPythonScript(widget.OWWidget):
             self.e_max = congruence.checkPositiveNumber(self.e_max, "Photon Energy Max [eV]")
             congruence.checkLessThan(self.e_min, self.e_max, "Photon Energy Min [eV]", "Photon Energy Max [eV]")
             self.e_points = congruence.checkPositiveNumber(self.e_points, "Photon Energy Points")
+            self.number_of_workers = congruence.checkStrictlyPositiveNumber(self.number_of_workers, "Parallel workers")
 
     def set_input(self, syned_data):
 
@@ -197,7 +208,9 @@ class PowerLoadPythonScript(widget.OWWidget):
             "excel_file_name": self.excel_file_name,            
             "e_min": self.e_min,
             "e_max": self.e_max,
-            "e_points": self.e_points            
+            "e_points": self.e_points,
+            "use_flux_cube": self.use_flux_cube,
+            "number_of_workers": self.number_of_workers,
         }
 
         self.xoppy_script.set_code(self.script_template().format_map(dict_parameters))    
@@ -216,12 +229,20 @@ class PowerLoadPythonScript(widget.OWWidget):
 # ---------------------------------------------------------------------------
 # Imports # # xoppylib could be used as well #
 # ---------------------------------------------------------------------------
+import sys
 import numpy as np
 import pandas as pd
 import xraylib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from xoppylib.sources.xoppy_undulators import xoppy_calc_undulator_spectrum, xoppy_calc_undulator_power_density
+from xoppylib.sources.xoppy_undulators import xoppy_calc_undulator_radiation
 from xoppylib.fit_gaussian2d import fit_gaussian2d
 from xoppylib.power.xoppy_calc_power import xoppy_calc_power
+from orangecontrib.esrf.xoppy.util.flux_cube import integrate_flux_cube
+try:
+    from numpy import trapezoid
+except ImportError:
+    from numpy import trapz as trapezoid # numpy < 2.0 has no numpy.trapezoid
 
 import scipy.constants as codata
 
@@ -466,9 +487,89 @@ def get_full_aperture(id_dict, dataframe):
     return distance, full_h, full_v
 
 
-def calcul_spectrum(id_dict, dist, h_slit, v_slit, df, *up_win_list, window=False):
+def calcul_flux_cube(id_dict, distance, full_h, full_v):
+    # Angle- and energy-resolved flux calculated once, at the distance of the first element, on a grid covering
+    # the full aperture (full_h, full_v in mm). The flux through any aperture at any distance is then obtained by
+    # integrating the cube over the aperture projected to this distance (see integrate_flux_cube). Apertures
+    # larger than the cube (the 6 sigma full aperture) are limited to the cube
+
+    energy, h, v, p, code = xoppy_calc_undulator_radiation(
+        ELECTRONENERGY=id_dict["ELECTRONENERGY"],
+        ELECTRONENERGYSPREAD=id_dict["ELECTRONENERGYSPREAD"],
+        ELECTRONCURRENT=id_dict["ELECTRONCURRENT"],
+        ELECTRONBEAMSIZEH=id_dict["ELECTRONBEAMSIZEH"],
+        ELECTRONBEAMSIZEV=id_dict["ELECTRONBEAMSIZEV"],
+        ELECTRONBEAMDIVERGENCEH=id_dict["ELECTRONBEAMDIVERGENCEH"],
+        ELECTRONBEAMDIVERGENCEV=id_dict["ELECTRONBEAMDIVERGENCEV"],
+        PERIODID=id_dict["PERIODID"],
+        NPERIODS=id_dict["NPERIODS"],
+        KV=id_dict["KV"],
+        KH=id_dict["KH"],
+        KPHASE=id_dict["KPHASE"],
+        DISTANCE=distance,
+        SETRESONANCE=0,
+        HARMONICNUMBER=1,
+        GAPH=full_h * 1e-3,
+        GAPV=full_v * 1e-3,
+        GAPH_CENTER=id_dict["GAPH_CENTER"],
+        GAPV_CENTER=id_dict["GAPV_CENTER"],
+        HSLITPOINTS=id_dict["HSLITPOINTS"],
+        VSLITPOINTS=id_dict["VSLITPOINTS"],
+        METHOD=id_dict["METHOD"],
+        PHOTONENERGYMIN=id_dict["PHOTONENERGYMIN"],
+        PHOTONENERGYMAX=id_dict["PHOTONENERGYMAX"],
+        PHOTONENERGYPOINTS=id_dict["PHOTONENERGYPOINTS"],
+        USEEMITTANCES=id_dict["USEEMITTANCES"],
+        h5_file=None,
+        h5_entry_name=None,
+        h5_initialize=False,
+    )
+
+    # energy in eV, h and v in mm at the distance, p (flux) in photons/s/0.1%bw/mm^2
+    cube = dict()
+    cube["distance"] = distance
+    cube["energy"] = energy
+    cube["h"] = h
+    cube["v"] = v
+    cube["flux"] = p
+    cube["window_transmission"] = dict() # transmission of each window, calculated when first needed
+
+    return cube
+
+
+def get_window_transmission(cube, df, element):
+    # transmission versus energy of a window (element index in the data frame), calculated once
+
+    element = int(element)
+    if element not in cube["window_transmission"]:
+        out_dict = xoppy_calc_power(energies=cube["energy"], source=np.ones_like(cube["energy"]),
+                                    substance=[str(df.formula[element])], flags=[0],
+                                    dens=[float(df.density[element])], thick=[float(df.thickness[element])],
+                                    material_constants_library=xraylib)
+        cube["window_transmission"][element] = out_dict['data'][4]
+
+    return cube["window_transmission"][element]
+
+
+def calcul_spectrum(id_dict, dist, h_slit, v_slit, df, *up_win_list, window=False, cube=None):
     # From 1D undulator spectrum this function uses the id dict and element characteristics to calculates the
     #    full power through the element
+    # If the flux cube is given, the spectrum is obtained by integrating the cube over the aperture (and
+    #    multiplying by the transmission of the upstream windows) instead of a new undulator calculation
+
+    if cube is not None:
+
+        energy = cube["energy"]
+        spectral_power = integrate_flux_cube(cube, dist, h_slit, v_slit) * codata.e * 1e3
+
+        if window:
+            for element in up_win_list[0]:
+                spectral_power = spectral_power * get_window_transmission(cube, df, element)
+
+        tot_power = trapezoid(spectral_power, x=energy, axis=-1)
+        tot_phot_sec = trapezoid(spectral_power / codata.e / 1e3 / (0.001 * energy), x=energy, axis=-1)
+
+        return tot_power, tot_phot_sec
 
     energy, flux, spectral_power, cumulated_power = xoppy_calc_undulator_spectrum(
         ELECTRONENERGY=id_dict["ELECTRONENERGY"],
@@ -548,146 +649,257 @@ def dif_totals(in_pow, in_phsec, out_pow, out_phsec):
     return abs_pow, abs_phsec
 
 
-def run_calculations(df, id_dict):
-    # Main function that depends on the above ones, it uses as an input the dataframe fo the elements and the id dictionary #
+# Data shared by the element calculations (set by init_element_calculation in this process, or in each process
+# of the pool)
+_element_data = dict()
 
-    # Loads the data frame with the elements characteristics #
-    df1 = df  # srio !!!  load_elements('id_components_test.xlsx')
 
-    # calculates the projections on each element from upstream apertures #
-    new_df = ap_projections(df1)
+def init_element_calculation(new_df, id_dict, distance, full_ap_h, full_ap_v, cube):
+    _element_data["new_df"] = new_df
+    _element_data["id_dict"] = id_dict
+    _element_data["distance"] = distance
+    _element_data["full_ap_h"] = full_ap_h
+    _element_data["full_ap_v"] = full_ap_v
+    _element_data["cube"] = cube
 
-    # get the distance and apertures of full aperture for the specific id #
-    distance, full_ap_h, full_ap_v = get_full_aperture(id_dict, new_df)
 
-    # output lists
-    abs_pow = []
-    abs_phosec = []
-    transm_power = []
+def get_element_dependencies(df):
+    # The elements calculated with the upstream windows (windows and slits after a window) must run after them, #
+    # so that the window transmissions already calculated are reused #
 
+    win_indexs = df.index[df['type'] == 'window'].tolist()
+
+    dependencies = []
     for i, type in enumerate(df.type):
+        if type in ['slit', 'window']:
+            dependencies.append([j for j in win_indexs if j < i])
+        else:
+            dependencies.append([])
 
-        # this is to get the window index to compare is the element has a upstream window #
-        win_indexs = df.index[df['type'] == 'window'].tolist()
+    return dependencies
 
-        if type == 'source':
 
-            print(">>>>>>>>>> Calculating for element:", new_df.element[i])
-            # For the source, it gets te total power just by analytic equation
-            codata_mee = codata.m_e * codata.c ** 2 / codata.e
-            gamma = id_dict['ELECTRONENERGY'] * 1e9 / codata_mee
+def calcul_element(i, window_transmission=None):
+    # Absorbed power, absorbed photons/sec and transmitted power of the element i, and the window transmissions #
+    # calculated so far. window_transmission: transmissions of the upstream windows, from other processes #
 
-            p_tot = (id_dict['NPERIODS'] / 6) * codata.value('characteristic impedance of vacuum') * id_dict[
-                    'ELECTRONCURRENT'] * codata.e * 2 * np.pi * codata.c * gamma ** 2 * (
-                    id_dict['KV'] ** 2 + id_dict['KH'] ** 2) / id_dict['PERIODID']
+    new_df = _element_data["new_df"]
+    id_dict = _element_data["id_dict"]
+    distance = _element_data["distance"]
+    full_ap_h = _element_data["full_ap_h"]
+    full_ap_v = _element_data["full_ap_v"]
+    cube = _element_data["cube"]
 
-            abs_pow.append(0.0)
-            abs_phosec.append(0.0)
-            transm_power.append(p_tot)
+    if cube is not None and window_transmission is not None:
+        cube["window_transmission"].update(window_transmission)
 
+    type = new_df.type[i]
 
-        elif type == 'slit' and i == 1:
+    # this is to get the window index to compare is the element has a upstream window #
+    win_indexs = new_df.index[new_df['type'] == 'window'].tolist()
 
-            # This is for the first slit which is normally the FE mask #
+    if type == 'source':
 
-            print(">>>>>>>>>> Calculating for first element:", new_df.element[i])
+        print(">>>>>>>>>> Calculating for element:", new_df.element[i])
+        # For the source, it gets te total power just by analytic equation
+        codata_mee = codata.m_e * codata.c ** 2 / codata.e
+        gamma = id_dict['ELECTRONENERGY'] * 1e9 / codata_mee
 
+        p_tot = (id_dict['NPERIODS'] / 6) * codata.value('characteristic impedance of vacuum') * id_dict[
+                'ELECTRONCURRENT'] * codata.e * 2 * np.pi * codata.c * gamma ** 2 * (
+                id_dict['KV'] ** 2 + id_dict['KH'] ** 2) / id_dict['PERIODID']
+
+        abs_pow = 0.0
+        abs_phosec = 0.0
+        transm_power = p_tot
+
+
+    elif type == 'slit' and i == 1:
+
+        # This is for the first slit which is normally the FE mask #
+
+        print(">>>>>>>>>> Calculating for first element:", new_df.element[i])
+
+        if cube is None:
             p_imp, phsec_imp = calcul_spectrum(id_dict, distance, full_ap_h, full_ap_v, new_df)
-            p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h[i], new_df.v[i], new_df)
+        else:
+            # full aperture in mm -> m
+            p_imp, phsec_imp = calcul_spectrum(id_dict, distance, full_ap_h * 1e-3, full_ap_v * 1e-3, new_df, cube=cube)
+        p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h[i], new_df.v[i], new_df, cube=cube)
 
-            abs_pow.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0])
-            abs_phosec.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1])
-            transm_power.append(p_trans)
+        abs_pow = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0]
+        abs_phosec = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1]
+        transm_power = p_trans
 
 
-        elif type == 'slit' and i > 1 and all(j > i for j in win_indexs):
+    elif type == 'slit' and i > 1 and all(j > i for j in win_indexs):
 
-            # Slit that does not have an upstream window #
+        # Slit that does not have an upstream window #
 
-            print(">>>>>>>>>> Calculating for slit without any upstream slit:", new_df.element[i])
+        print(">>>>>>>>>> Calculating for slit without any upstream slit:", new_df.element[i])
 
-            p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i], new_df.v_proj[i],
-                                               new_df)
+        p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i], new_df.v_proj[i],
+                                           new_df, cube=cube)
 
-            p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], np.min([new_df.h_proj[i],
-                                                   new_df.h[i]]), np.min([new_df.v_proj[i], new_df.v[i]]), new_df)
+        p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], np.min([new_df.h_proj[i],
+                                               new_df.h[i]]), np.min([new_df.v_proj[i], new_df.v[i]]), new_df, cube=cube)
 
-            abs_pow.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0])
-            abs_phosec.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1])
-            transm_power.append(p_trans)
+        abs_pow = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0]
+        abs_phosec = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1]
+        transm_power = p_trans
 
 
-        elif type == 'slit' and i > 1 and any(j < i for j in win_indexs):
+    elif type == 'slit' and i > 1 and any(j < i for j in win_indexs):
 
-            # Slit with an upstream window #
+        # Slit with an upstream window #
 
-            print(">>>>>>>>>> Calculating for slit with at least one upstream window:", new_df.element[i])
+        print(">>>>>>>>>> Calculating for slit with at least one upstream window:", new_df.element[i])
 
-            up_win_list = list(item for item in win_indexs if item < i)
+        up_win_list = list(item for item in win_indexs if item < i)
 
-            p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
-                                               new_df.v_proj[i],new_df, up_win_list, window=True)
+        p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
+                                           new_df.v_proj[i],new_df, up_win_list, window=True, cube=cube)
 
-            p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], np.min([new_df.h_proj[i],
-                                                   new_df.h[i]]), np.min([new_df.v_proj[i], new_df.v[i]]), new_df,
-                                                   up_win_list, window=True)
+        p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], np.min([new_df.h_proj[i],
+                                               new_df.h[i]]), np.min([new_df.v_proj[i], new_df.v[i]]), new_df,
+                                               up_win_list, window=True, cube=cube)
 
-            abs_pow.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0])
-            abs_phosec.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1])
-            transm_power.append(p_trans)
+        abs_pow = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0]
+        abs_phosec = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1]
+        transm_power = p_trans
 
 
-        elif type == 'absorber':
+    elif type == 'absorber':
 
-            print(">>>>>>>>>> Calculating for element:", new_df.element[i])
+        print(">>>>>>>>>> Calculating for element:", new_df.element[i])
 
-            p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
-                                               new_df.v_proj[i])
+        p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
+                                           new_df.v_proj[i], cube=cube)
 
-            abs_pow.append(p_imp)
-            abs_phosec.append(phsec_imp)
-            transm_power.append(0.0)
+        abs_pow = p_imp
+        abs_phosec = phsec_imp
+        transm_power = 0.0
 
-        elif type == 'window':
+    elif type == 'window':
 
-            # none upstream window
+        # none upstream window
 
-            if win_indexs and i == win_indexs[0]:
+        if win_indexs and i == win_indexs[0]:
 
-                # This gets the index for this only window
-                up_win_list = list(item for item in win_indexs if item <= i)
+            # This gets the index for this only window
+            up_win_list = list(item for item in win_indexs if item <= i)
 
-                print(">>>>>>>>>> Calculating for (first) window, without any upstream window:", new_df.element[i])
+            print(">>>>>>>>>> Calculating for (first) window, without any upstream window:", new_df.element[i])
 
-                p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i], new_df.v_proj[i], new_df)
+            p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i], new_df.v_proj[i], new_df, cube=cube)
 
-                p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
-                                                       new_df.v_proj[i],new_df, up_win_list, window=True)
+            p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
+                                                   new_df.v_proj[i],new_df, up_win_list, window=True, cube=cube)
 
-                abs_pow.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0])
-                abs_phosec.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1])
-                transm_power.append(p_trans)
+            abs_pow = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0]
+            abs_phosec = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1]
+            transm_power = p_trans
 
-            elif win_indexs and any(j < i for j in win_indexs):
-                # This gets the list of all upstream windows
-                up_win_list = list(item for item in win_indexs if item < i)
-                # This gets the list of all upstream windows including itself
-                includ_win_list = list(item for item in win_indexs if item <= i)
+        elif win_indexs and any(j < i for j in win_indexs):
+            # This gets the list of all upstream windows
+            up_win_list = list(item for item in win_indexs if item < i)
+            # This gets the list of all upstream windows including itself
+            includ_win_list = list(item for item in win_indexs if item <= i)
 
-                print(">>>>>>>>>> Calculating for window with at least one upstream window:", new_df.element[i])
+            print(">>>>>>>>>> Calculating for window with at least one upstream window:", new_df.element[i])
 
-                p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
-                                                   new_df.v_proj[i], new_df, up_win_list, window=True)
+            p_imp, phsec_imp = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
+                                               new_df.v_proj[i], new_df, up_win_list, window=True, cube=cube)
 
-                p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
-                                                       new_df.v_proj[i], new_df, includ_win_list, window=True)
+            p_trans, phsec_trans = calcul_spectrum(id_dict, new_df.dist_to_source[i], new_df.h_proj[i],
+                                                   new_df.v_proj[i], new_df, includ_win_list, window=True, cube=cube)
 
-                abs_pow.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0])
-                abs_phosec.append(dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1])
-                transm_power.append(p_trans)
+            abs_pow = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[0]
+            abs_phosec = dif_totals(p_imp, phsec_imp, p_trans, phsec_trans)[1]
+            transm_power = p_trans
 
-        else:
-            raise RuntimeError('The following type sis not included', new_df.type[i])
+    else:
+        raise RuntimeError('The following type sis not included', new_df.type[i])
+
+    if cube is None:
+        return abs_pow, abs_phosec, transm_power, dict()
+    else:
+        return abs_pow, abs_phosec, transm_power, dict(cube["window_transmission"])
+
+
+def run_elements(number_of_elements, dependencies, initargs, number_of_workers=1):
+    # Runs calcul_element for all the elements, in a pool of number_of_workers processes if > 1. An element is #
+    # submitted when all its dependencies are done. The results are returned in the order of the elements #
+    # The pool is only used when the script is run as a file (python script.py), as its processes import the #
+    # functions from __main__, and with METHOD=2 (SRW): US (METHOD=0) and URGENT (METHOD=1) write their input #
+    # and output files with fixed names in the working directory, so they must run with number_of_workers=1 #
+    # Otherwise (e.g. script executed in the OASYS console) the elements are calculated sequentially #
+
+    init_element_calculation(*initargs)
+
+    if number_of_workers > 1 and initargs[1]["METHOD"] in [0, 1]:
+        print("US and URGENT (METHOD=0, 1) cannot run in parallel: calculating the elements sequentially")
+        number_of_workers = 1
+    elif number_of_workers > 1 and getattr(sys.modules["__main__"], "calcul_element", None) is not calcul_element:
+        print("Functions not importable from __main__ (script not run as a file): calculating the elements sequentially")
+        number_of_workers = 1
+
+    if number_of_workers <= 1:
+        window_transmission = dict()
+        results = []
+        for i in range(number_of_elements):
+            results.append(calcul_element(i, window_transmission))
+            window_transmission.update(results[-1][3])
+        return results
+
+    executor = ProcessPoolExecutor(max_workers=number_of_workers, initializer=init_element_calculation,
+                                   initargs=initargs)
+
+    results = dict()
+    window_transmission = dict()
+    pending = list(range(number_of_elements))
+    running = dict()
+    with executor:
+        while pending or running:
+            for i in [i for i in pending if all(j in results for j in dependencies[i])]:
+                running[executor.submit(calcul_element, i, dict(window_transmission))] = i
+                pending.remove(i)
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                results[i] = future.result()
+                window_transmission.update(results[i][3])
+
+    return [results[i] for i in range(number_of_elements)]
+
+
+def run_calculations(df, id_dict, use_flux_cube=False, number_of_workers=1):
+    # Main function that depends on the above ones, it uses as an input the dataframe fo the elements and the id dictionary #
+    # With use_flux_cube, a single undulator calculation (the flux cube) is used for all the elements #
+    # With number_of_workers > 1, the elements are calculated in parallel (script run as a file, METHOD=2 only) #
+
+    # Loads the data frame with the elements characteristics #
+    df1 = df  # srio !!!  load_elements('id_components_test.xlsx')
+
+    # calculates the projections on each element from upstream apertures #
+    new_df = ap_projections(df1)
+
+    # get the distance and apertures of full aperture for the specific id #
+    distance, full_ap_h, full_ap_v = get_full_aperture(id_dict, new_df)
+
+    if use_flux_cube:
+        cube = calcul_flux_cube(id_dict, distance, full_ap_h, full_ap_v)
+    else:
+        cube = None
+
+    results = run_elements(len(df.type), get_element_dependencies(df),
+                           (new_df, id_dict, distance, full_ap_h, full_ap_v, cube),
+                           number_of_workers=number_of_workers)
+
+    # output lists
+    abs_pow = [result[0] for result in results]
+    abs_phosec = [result[1] for result in results]
+    transm_power = [result[2] for result in results]
 
     # Creates a data frame with the absorbed power and absorbed photons info
     tmp = dict()
@@ -701,11 +913,11 @@ def run_calculations(df, id_dict):
     return full_df
 
 
-if True:
+if __name__ != "__mp_main__": # not when imported by the processes of the pool (spawn start method)
 
     df1, id_dict = load_elements_from_json_file('{json_file_name}')
 
-    full_df = run_calculations(df1, id_dict)
+    full_df = run_calculations(df1, id_dict, use_flux_cube={use_flux_cube}, number_of_workers={number_of_workers})
 
     full_df.to_csv('{excel_file_name}')
 